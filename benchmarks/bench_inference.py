@@ -0,0 +1,101 @@
+"""
+Throughput and memory of YOLO + OCR under load, with every worker loading its
+own models vs. all workers sharing the inference server.
+
+Each case runs detection and OCR on a blueprint. `--workers` processes run
+`--cases` cases each, all at once. Peak RSS is summed over the workers (and
+the server), read from /proc so linux only.
+
+usage (from the repo root):
+    uv run python -m benchmarks.bench_inference [--workers 4] [--cases 10] [--image assets/blueprint.jpg]
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+
+def _peak_rss_mb(pid: int = None) -> float:
+    status = Path(f'/proc/{pid or "self"}/status').read_text()
+    for line in status.splitlines():
+        if line.startswith('VmHWM:'):
+            return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _init_worker():
+    from buildcheck.backend.models import warm_models
+    warm_models()
+
+
+def _run_cases(image_path: str, cases: int) -> float:
+    # runs in a worker, returns its peak rss
+    from buildcheck.backend.images import decode_image
+    from buildcheck.backend.models import YOLO_MODEL_PATH
+    from buildcheck.backend.vectorization import Layout
+    from buildcheck.backend.yolo_processor import YOLOProcessor
+    from buildcheck.backend.ocr_processor import OCRProcessor
+
+    image = decode_image(Path(image_path).read_bytes())
+    for _ in range(cases):
+        YOLOProcessor(image, YOLO_MODEL_PATH, Layout()).detect()
+        OCRProcessor(image, Layout()).read(mode='full')
+    return _peak_rss_mb()
+
+
+def run(image_path: str, workers: int, cases: int) -> tuple[float, float]:
+    # -> (cases per second, summed peak rss of the workers)
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_worker) as pool:
+        # let every worker load (or connect to) the models before timing
+        list(pool.map(_peak_rss_mb, [None] * workers))
+        start = time.perf_counter()
+        rss = list(pool.map(_run_cases, [image_path] * workers, [cases] * workers))
+        elapsed = time.perf_counter() - start
+    return workers * cases / elapsed, sum(rss)
+
+
+def start_server(socket_path: str) -> subprocess.Popen:
+    server = subprocess.Popen([sys.executable, '-m', 'buildcheck.backend.inference_server', '--socket', socket_path])
+    while not os.path.exists(socket_path):
+        if server.poll() is not None:
+            raise RuntimeError("inference server exited during startup")
+        time.sleep(0.1)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="inference throughput, per worker models vs. the inference server")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--cases', type=int, default=10, help="cases per worker")
+    parser.add_argument('--image', default='assets/blueprint.jpg')
+    args = parser.parse_args()
+
+    os.environ['INFERENCE_SOCKET'] = ''
+    local_rate, local_rss = run(args.image, args.workers, args.cases)
+
+    socket_path = os.path.join(tempfile.mkdtemp(prefix='buildcheck-inference-'), 'inference.sock')
+    server = start_server(socket_path)
+    try:
+        # spawned workers read INFERENCE_SOCKET when they import the models module
+        os.environ['INFERENCE_SOCKET'] = socket_path
+        served_rate, served_rss = run(args.image, args.workers, args.cases)
+        served_rss += _peak_rss_mb(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f'{args.workers} workers x {args.cases} cases, {args.image}')
+    print(f'{"":>8}{"cases/s":>10}{"peak rss MB":>14}')
+    print(f'{"local":>8}{local_rate:10.2f}{local_rss:14.0f}')
+    print(f'{"server":>8}{served_rate:10.2f}{served_rss:14.0f}')
+    print(f'throughput {served_rate / local_rate:.2f}x, memory {served_rss / local_rss:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
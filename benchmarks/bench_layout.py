@@ -0,0 +1,94 @@
+"""
+Memory and rule-evaluation time of the in-memory `Layout`.
+
+Builds a layout of a grid of rooms with `--symbols` symbols (a door or window
+on every wall shared by two rooms, the rest inside a room), a name and a
+dimension per room, like `_build_layout` does. Memory is the RSS growth of
+building it, in a fresh process so earlier allocations don't hide it, read
+from /proc so linux only. Rule time is `validate_ajyal` on the built layout.
+
+usage (from the repo root):
+    uv run python -m benchmarks.bench_layout [--symbols 10000] [--rooms 400] [--repeats 20]
+"""
+import math
+import time
+import random
+import argparse
+import statistics
+import multiprocessing
+from pathlib import Path
+
+
+ROOM_SIZE = 100
+SYMBOL_SIZE = 10
+
+
+def _rss_mb() -> float:
+    pages = int(Path('/proc/self/statm').read_text().split()[1])
+    return pages * 4096 / 1024 / 1024
+
+
+def make_layout(n_symbols: int, n_rooms: int, seed: int = 0):
+    from buildcheck.backend.vectorization import Layout, Room, Symbol, Category, Label, Dimension
+    import shapely
+
+    rng = random.Random(seed)
+    cols = math.ceil(math.sqrt(n_rooms))
+    layout = Layout(rooms=[
+        Room(shapely.box(x * ROOM_SIZE, y * ROOM_SIZE, (x + 1) * ROOM_SIZE, (y + 1) * ROOM_SIZE))
+        for y, x in (divmod(i, cols) for i in range(n_rooms))
+    ])
+    for room in layout.rooms:
+        room.add_metadata(Label(rng.choice(['BEDROOM', 'KITCHEN', 'BATH'])))
+        room.add_metadata(Dimension(round(rng.uniform(2, 12), 1), round(rng.uniform(2, 12), 1)))
+
+    for i in range(n_symbols):
+        first = rng.randrange(n_rooms)
+        x0, y0 = first % cols * ROOM_SIZE, first // cols * ROOM_SIZE
+        neighbour = first + 1
+        if i % 2 and neighbour < n_rooms and neighbour % cols:
+            # on the wall to the right neighbour, in both rooms
+            x, y = x0 + ROOM_SIZE - SYMBOL_SIZE / 2, y0 + rng.uniform(0, ROOM_SIZE - SYMBOL_SIZE)
+            rooms = [layout.rooms[first], layout.rooms[neighbour]]
+        else:
+            x, y = x0 + rng.uniform(0, ROOM_SIZE - SYMBOL_SIZE), y0 + rng.uniform(0, ROOM_SIZE - SYMBOL_SIZE)
+            rooms = [layout.rooms[first]]
+        category = rng.choice([Category.DOOR, Category.WINDOW])
+        layout.add_symbol(Symbol.from_bounds(category, (x, y, x + SYMBOL_SIZE, y + SYMBOL_SIZE)), rooms)
+    return layout
+
+
+def measure(n_symbols: int, n_rooms: int, repeats: int) -> dict:
+    # runs in a fresh process
+    from buildcheck.backend.rule_engine import validate_ajyal
+
+    before = _rss_mb()
+    layout = make_layout(n_symbols, n_rooms)
+    grown = _rss_mb() - before
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        failures = validate_ajyal(layout)
+        times.append(time.perf_counter() - start)
+    return {"mb": grown, "rules_ms": statistics.median(times) * 1000, "failures": len(failures)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="layout memory and rule evaluation benchmark")
+    parser.add_argument('--symbols', type=int, default=10_000)
+    parser.add_argument('--rooms', type=int, default=400)
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(1, maxtasksperchild=1) as pool:
+        result = pool.apply(measure, (args.symbols, args.rooms, args.repeats))
+
+    print(f'{args.symbols} symbols, {args.rooms} rooms')
+    print(f'memory     {result["mb"]:8.2f} MB ({result["mb"] * 1024 * 10_000 / args.symbols:.0f} KB per 10k symbols)')
+    print(f'rules      {result["rules_ms"]:8.2f} ms ({result["failures"]} failures)')
+
+
+if __name__ == '__main__':
+    main()
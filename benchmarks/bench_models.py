@@ -0,0 +1,63 @@
+"""
+Cold vs warm per-case latency of the YOLO + OCR stages.
+
+cold: every case builds its own YOLO model and EasyOCR reader (the old behaviour)
+warm: every case uses the process level model registry
+
+usage (from the repo root):
+    uv run python -m benchmarks.bench_models [image] [cases]
+"""
+import sys
+import time
+import statistics
+from PIL import Image
+from buildcheck.backend import models
+from buildcheck.backend.models import YOLO_MODEL_PATH
+from buildcheck.backend.yolo_processor import YOLOProcessor
+from buildcheck.backend.ocr_processor import OCRProcessor, create_test_layout
+
+
+def run_case(image: Image) -> float:
+    start = time.perf_counter()
+    layout = create_test_layout()
+    YOLOProcessor(image, YOLO_MODEL_PATH, layout).yoloProcesser()
+    OCRProcessor(image, layout).ocrProcess()
+    return time.perf_counter() - start
+
+
+def bench_cold(image: Image, cases: int) -> list[float]:
+    models.WARMUP_MODELS = False
+    timings = []
+    for _ in range(cases):
+        # forget everything so the processors load from disk again
+        models._registry.clear()
+        timings.append(run_case(image))
+    return timings
+
+
+def bench_warm(image: Image, cases: int) -> list[float]:
+    models.WARMUP_MODELS = True
+    models._registry.clear()
+    models.warm_models()
+    return [run_case(image) for _ in range(cases)]
+
+
+def report(name: str, timings: list[float]):
+    print(f"{name:>5}: mean {statistics.mean(timings):7.3f}s  "
+          f"min {min(timings):7.3f}s  max {max(timings):7.3f}s  (n={len(timings)})")
+
+
+if __name__ == '__main__':
+    image_path = sys.argv[1] if len(sys.argv) > 1 else "assets/blueprint.jpg"
+    cases = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    image = Image.open(image_path)
+
+    cold = bench_cold(image, cases)
+    warm = bench_warm(image, cases)
+
+    print()
+    print(f"per-case latency, {image_path}")
+    report("cold", cold)
+    report("warm", warm)
+    print(f"speedup: {statistics.mean(cold) / statistics.mean(warm):.1f}x")
+    print(f"models: {models.model_versions()}")
@@ -0,0 +1,195 @@
+"""
+End-to-end benchmark of `run_validation`, stage by stage.
+
+Runs the whole pipeline (real YOLO + EasyOCR, rules, visualizer) on the bundled
+blueprints and a few synthetic plans, with R2G replaced by a local mock that
+replays recorded payloads. Every case starts from an empty artifact cache.
+Per-span wall time, CPU time and memory are compared against a stored
+baseline, and the run fails if a span got slower than `--threshold`.
+
+usage (from the repo root):
+    uv run python -m benchmarks.bench_pipeline                     # compare with the baseline
+    uv run python -m benchmarks.bench_pipeline --update-baseline   # record a new baseline
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import statistics
+import tempfile
+from collections import defaultdict
+from pathlib import Path
+
+
+BASELINE_PATH = Path(__file__).parent / 'baseline.json'
+BENCH_EMPLOYEE_ID = 0
+# ignore differences smaller than this, they are noise
+MIN_REGRESSION_SECONDS = 0.02
+
+# bundled plans and the recorded R2G payload for each
+RECORDED_PLANS = {
+    'assets/blueprint.jpg': 'blueprint',
+    '2d-floor-plan.jpg': 'blueprint',
+}
+# (cols, rows, size) of the synthetic plans
+SYNTHETIC_PLANS = [
+    (2, 2, (1200, 900)),
+    (4, 3, (2400, 1800)),
+    (6, 4, (4800, 3600)),
+]
+
+
+def _isolate(tmp: Path):
+    # keep uploads and caches of the benchmark away from the real ones,
+    # N.B. must happen before buildcheck is imported
+    os.environ['REFLEX_UPLOADED_FILES_DIR'] = str(tmp / 'uploads')
+    os.environ['BUILDCHECK_CACHE_DIR'] = str(tmp / 'cache')
+    os.environ.pop('BUILDCHECK_TRACE_FILE', None)
+
+
+def collect_plans() -> list[tuple[str, bytes, dict]]:
+    from benchmarks.mock_r2g import load_payload, rooms2payload
+    from benchmarks.synthetic import make_plan
+
+    plans = []
+    for path, payload_name in RECORDED_PLANS.items():
+        plans.append((Path(path).name, Path(path).read_bytes(), load_payload(payload_name)))
+    for i, (cols, rows, size) in enumerate(SYNTHETIC_PLANS):
+        image_bytes, rooms = make_plan(cols, rows, size, seed=i)
+        plans.append((f'synthetic_{cols}x{rows}_{size[0]}.png', image_bytes, rooms2payload(rooms, size)))
+    return plans
+
+
+def run_case(file_name: str, cache_root: Path) -> list[dict]:
+    from buildcheck.backend import tracing, validation
+    from buildcheck.backend.cache import DiskCache
+
+    # cold artifact cache, so every stage really runs
+    shutil.rmtree(cache_root, ignore_errors=True)
+    validation.validation_pipeline.store = DiskCache('artifacts', root=cache_root)
+
+    spans = []
+    tracing.add_sink(spans.append)
+    try:
+        validation.run_validation(file_name, BENCH_EMPLOYEE_ID)
+    finally:
+        tracing.remove_sink(spans.append)
+    return spans
+
+
+def summarize(runs: dict[str, list[list[dict]]]) -> dict[str, dict]:
+    """
+    Per span name: median (over repeats) wall/cpu time per case, averaged over
+    the plans, and the largest peak rss growth seen.
+    """
+    per_plan = defaultdict(lambda: defaultdict(list))
+    rss_growth = defaultdict(float)
+    for plan, plan_runs in runs.items():
+        for spans in plan_runs:
+            totals = defaultdict(lambda: [0.0, 0.0])
+            for s in spans:
+                totals[s["name"]][0] += s["wall_seconds"]
+                totals[s["name"]][1] += s["cpu_seconds"]
+                rss_growth[s["name"]] = max(rss_growth[s["name"]], s["peak_rss_growth_mb"])
+            for name, (wall, cpu) in totals.items():
+                per_plan[name][plan].append((wall, cpu))
+
+    summary = {}
+    for name, plans in per_plan.items():
+        walls = [statistics.median(w for w, _ in timings) for timings in plans.values()]
+        cpus = [statistics.median(c for _, c in timings) for timings in plans.values()]
+        summary[name] = {
+            "wall_seconds": statistics.mean(walls),
+            "cpu_seconds": statistics.mean(cpus),
+            "peak_rss_growth_mb": rss_growth[name],
+        }
+    return summary
+
+
+def compare(summary: dict, baseline: dict, threshold: float) -> list[str]:
+    regressions = []
+    for name, current in sorted(summary.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        slower = current["wall_seconds"] - base["wall_seconds"]
+        if slower > MIN_REGRESSION_SECONDS and current["wall_seconds"] > base["wall_seconds"] * (1 + threshold):
+            regressions.append(
+                f'{name}: {base["wall_seconds"]:.3f}s -> {current["wall_seconds"]:.3f}s '
+                f'(+{slower / base["wall_seconds"]:.0%})'
+            )
+    return regressions
+
+
+def report(summary: dict, baseline: dict, peak_rss_mb: float):
+    print(f'{"span":<26}{"wall":>9}{"cpu":>9}{"rss+MB":>9}{"baseline":>10}')
+    for name, s in sorted(summary.items(), key=lambda item: -item[1]["wall_seconds"]):
+        base = baseline.get(name, {}).get("wall_seconds")
+        base = f'{base:10.3f}' if base is not None else f'{"-":>10}'
+        print(f'{name:<26}{s["wall_seconds"]:9.3f}{s["cpu_seconds"]:9.3f}{s["peak_rss_growth_mb"]:9.1f}{base}')
+    print(f'peak rss {peak_rss_mb:.0f} MB')
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="end-to-end validation pipeline benchmark")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--threshold', type=float, default=0.25, help="allowed slowdown per span, 0.25 = 25%%")
+    parser.add_argument('--baseline', type=Path, default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--r2g-latency', type=float, default=0.0, help="simulated R2G latency in seconds")
+    args = parser.parse_args()
+
+    # fail before the (slow) run, a missing baseline must not pass as "no regressions"
+    if not args.update_baseline and not args.baseline.exists():
+        parser.error(f"no baseline at {args.baseline}, run with --update-baseline to record one")
+
+    tmp = Path(tempfile.mkdtemp(prefix='buildcheck-bench-'))
+    _isolate(tmp)
+
+    from benchmarks.mock_r2g import MockR2G
+    from buildcheck.backend.blueprints import bp_name2path
+    from buildcheck.backend.models import warm_models
+    from buildcheck.backend.tracing import _peak_rss_mb
+
+    try:
+        with MockR2G(latency=args.r2g_latency) as r2g:
+            os.environ['R2G_API_URL'] = r2g.url
+            warm_models()
+
+            runs = {}
+            for file_name, image_bytes, payload in collect_plans():
+                r2g.register(image_bytes, payload)
+                bp_name2path(file_name, BENCH_EMPLOYEE_ID).write_bytes(image_bytes)
+                runs[file_name] = [run_case(file_name, tmp / 'artifacts') for _ in range(args.repeats)]
+                print(f'{file_name}: done')
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    summary = summarize(runs)
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    print()
+    report(summary, baseline, _peak_rss_mb())
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(summary, indent=2, sort_keys=True) + '\n')
+        print(f'\nwrote baseline to {args.baseline}')
+        return 0
+
+    if not baseline:
+        print(f'\nthe baseline at {args.baseline} is empty, run with --update-baseline to record one')
+        return 1
+
+    regressions = compare(summary, baseline, args.threshold)
+    if regressions:
+        print(f'\n{len(regressions)} spans regressed more than {args.threshold:.0%}:')
+        for line in regressions:
+            print(f'  {line}')
+        return 1
+
+    print(f'\nno regressions (threshold {args.threshold:.0%})')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Matplotlib vs. raster overlay renderer: time, memory and file size.
+
+Renders synthetic plans of growing size, with rooms, symbols and dimensions,
+through both renderers of `FloorPlanVisualizer`. Every render runs in a fresh
+process so the peak RSS growth of one does not hide the other's.
+
+usage (from the repo root):
+    uv run python -m benchmarks.bench_visualizer [--format webp] [--repeats 3]
+"""
+import random
+import argparse
+import statistics
+import tempfile
+import multiprocessing
+from pathlib import Path
+
+
+# (cols, rows, size) of the synthetic plans
+PLANS = [
+    (2, 2, (1200, 900)),
+    (4, 3, (2400, 1800)),
+    (6, 4, (4800, 3600)),
+]
+SYMBOLS_PER_ROOM = 4
+
+
+def make_layout(cols: int, rows: int, size: tuple[int, int], seed: int = 0):
+    from benchmarks.synthetic import make_plan
+    from buildcheck.backend.images import decode_image
+    from buildcheck.backend.vectorization import Layout, Room, Symbol, Category, Dimension
+    import shapely
+
+    rng = random.Random(seed)
+    image_bytes, rooms = make_plan(cols, rows, size, seed)
+    layout = Layout(rooms=[Room(shapely.Polygon(corners)) for corners in rooms])
+    for room in layout.rooms:
+        minx, miny, maxx, maxy = room.polygon.bounds
+        for _ in range(SYMBOLS_PER_ROOM):
+            x, y = rng.uniform(minx, maxx - 40), rng.uniform(miny, maxy - 40)
+            room.add_symbol(Symbol(rng.choice([Category.DOOR, Category.WINDOW]), shapely.box(x, y, x + 40, y + 40)))
+        room.add_metadata(Dimension(round(rng.uniform(8, 20), 1), round(rng.uniform(8, 20), 1)))
+    return decode_image(image_bytes), layout
+
+
+def render(renderer: str, plan: tuple, suffix: str) -> dict:
+    # runs in a fresh process
+    from buildcheck.backend.tracing import span
+    from buildcheck.backend.visualizer import FloorPlanVisualizer
+
+    image, layout = make_layout(*plan)
+    output = Path(tempfile.mkdtemp(prefix='buildcheck-vis-')) / f'overlay{suffix}'
+    with span('render') as s:
+        FloorPlanVisualizer('', layout, image=image).visualize(str(output), renderer=renderer)
+    return {"seconds": s.wall_seconds, "rss_mb": s.peak_rss_growth_mb, "kb": output.stat().st_size / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="overlay renderer benchmark")
+    parser.add_argument('--format', default='webp', help="raster output format: png, webp or jpg")
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    cases = [('matplotlib', '.png'), ('raster', f'.{args.format}')]
+    ctx = multiprocessing.get_context('spawn')
+
+    print(f'{"plan":<18}{"renderer":<12}{"seconds":>9}{"rss+MB":>9}{"KB":>9}')
+    with ctx.Pool(1, maxtasksperchild=1) as pool:
+        for plan in PLANS:
+            cols, rows, (width, height) = plan
+            for renderer, suffix in cases:
+                runs = [pool.apply(render, (renderer, plan, suffix)) for _ in range(args.repeats)]
+                seconds = statistics.median(r["seconds"] for r in runs)
+                rss = max(r["rss_mb"] for r in runs)
+                print(f'{f"{cols}x{rows} {width}x{height}":<18}{renderer:<12}{seconds:9.3f}{rss:9.1f}{runs[0]["kb"]:9.0f}')
+
+
+if __name__ == '__main__':
+    main()
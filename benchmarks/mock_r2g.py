@@ -0,0 +1,139 @@
+"""
+Local stand-in for the R2G service, replaying recorded (or synthetic) payloads.
+
+Payloads are registered against the image they belong to and matched on the
+pixels of the upload, so the real client (downscaling, multipart or json
+upload) is exercised unchanged. A payload records the `input_size` of the
+image it was produced for and is rescaled if the client sends a different size.
+
+    with MockR2G() as r2g:
+        r2g.register(image_bytes, payload)
+        os.environ['R2G_API_URL'] = r2g.url
+"""
+import json
+import base64
+import hashlib
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from pathlib import Path
+from PIL import Image
+
+
+PAYLOAD_DIR = Path(__file__).parent / 'payloads'
+
+
+def _pixels_key(img: Image) -> str:
+    img = img.convert('RGB')
+    return hashlib.sha256(repr(img.size).encode() + img.tobytes()).hexdigest()
+
+
+def load_payload(name: str) -> dict:
+    return json.loads((PAYLOAD_DIR / f'{name}.json').read_text())
+
+
+def rooms2payload(rooms: list[list[tuple[float, float]]], input_size: tuple[int, int]) -> dict:
+    # an R2G response for rooms given in pixels of an image of `input_size`
+    return {
+        "input_size": list(input_size),
+        "scale_factor": 1.0,
+        "rooms": [
+            {"room_junctions": [{"x": x, "y": y} for x, y in room]}
+            for room in rooms
+        ],
+    }
+
+
+def _rescale(payload: dict, upload_size: tuple[int, int]) -> dict:
+    input_w, _ = payload["input_size"]
+    ratio = upload_size[0] / input_w
+    return {
+        "scale_factor": payload["scale_factor"],
+        "rooms": [
+            {
+                **room,
+                "room_junctions": [
+                    {"x": j["x"] * ratio, "y": j["y"] * ratio} for j in room["room_junctions"]
+                ],
+            }
+            for room in payload["rooms"]
+        ],
+    }
+
+
+class MockR2G:
+    def __init__(self, latency: float = 0.0):
+        # simulated network + inference time per /vectorize call
+        self.latency = latency
+        self.payloads: dict[str, dict] = {}
+        self.calls = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f'http://{host}:{port}'
+
+    def register(self, image_bytes: bytes, payload: dict):
+        # key on what the client will actually upload
+        from buildcheck.backend.images import decode_image
+        from buildcheck.backend.r2g_client import _downscale
+
+        upload, _ = _downscale(decode_image(image_bytes))
+        self.payloads[_pixels_key(upload)] = payload
+
+    def respond(self, image_bytes: bytes) -> tuple[int, dict]:
+        self.calls += 1
+        img = Image.open(BytesIO(image_bytes))
+        payload = self.payloads.get(_pixels_key(img))
+        if payload is None:
+            return 422, {"error": "no payload registered for this image"}
+        return 200, _rescale(payload, img.size)
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body: dict):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._send(200, {"status": "ok"})
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                content_type = self.headers.get('Content-Type', '')
+
+                if content_type.startswith('multipart/form-data'):
+                    message = BytesParser(policy=HTTP).parsebytes(
+                        f'Content-Type: {content_type}\r\n\r\n'.encode() + body
+                    )
+                    parts = {part.get_param('name', header='content-disposition'): part for part in message.iter_parts()}
+                    image_bytes = parts['image'].get_payload(decode=True)
+                else:
+                    image_bytes = base64.b64decode(json.loads(body)['input'])
+
+                if mock.latency:
+                    threading.Event().wait(mock.latency)
+                self._send(*mock.respond(image_bytes))
+
+        return Handler
+
+    def __enter__(self) -> 'MockR2G':
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,61 @@
+"""
+Synthetic floor plans with known rooms, for benchmarking without real scans.
+
+A plan is a grid of rectangular rooms with thick walls, a door gap in every
+room and a name + dimension label, so that every stage of the pipeline
+(vectorize, YOLO, OCR, rules, visualize) has something to chew on.
+"""
+import random
+from io import BytesIO
+from PIL import Image, ImageDraw, ImageFont
+
+
+ROOM_NAMES = ['BEDROOM', 'LIVING', 'KITCHEN', 'DINING', 'BATH', 'OFFICE', 'STORE', 'MAJLIS']
+WALL = 8  # px
+
+
+def make_plan(cols: int, rows: int, size: tuple[int, int] = (1200, 900), seed: int = 0) -> tuple[bytes, list]:
+    """
+    Returns the plan as png bytes and its rooms, as lists of (x, y) corners in image pixels.
+    """
+    rng = random.Random(seed)
+    width, height = size
+    margin = width // 20
+
+    img = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=max(10, width // 80))
+
+    # uneven column/row splits so rooms are not all the same size
+    def splits(total: int, n: int) -> list[int]:
+        weights = [rng.uniform(0.7, 1.3) for _ in range(n)]
+        edges, acc = [margin], margin
+        for w in weights:
+            acc += (total - 2 * margin) * w / sum(weights)
+            edges.append(round(acc))
+        return edges
+
+    xs, ys = splits(width, cols), splits(height, rows)
+    rooms = []
+    for i in range(cols):
+        for j in range(rows):
+            x0, x1, y0, y1 = xs[i], xs[i + 1], ys[j], ys[j + 1]
+            rooms.append([(x0, y0), (x1, y0), (x1, y1), (x0, y1)])
+            draw.rectangle((x0, y0, x1, y1), outline='black', width=WALL)
+
+            # door gap + swing in the bottom wall
+            door = min(60, (x1 - x0) // 4)
+            dx = rng.randint(x0 + WALL * 2, x1 - door - WALL * 2)
+            draw.rectangle((dx, y1 - WALL, dx + door, y1 + WALL), fill='white')
+            draw.arc((dx - door, y1 - door, dx + door, y1 + door), 270, 360, fill='black', width=2)
+
+            # label and dimensions in the middle of the room
+            cx, cy = (x0 + x1) // 2, (y0 + y1) // 2
+            name = rng.choice(ROOM_NAMES)
+            dims = f'{rng.uniform(2.5, 6):.1f}x{rng.uniform(2.5, 6):.1f}'
+            draw.text((cx, cy - font.size), name, fill='black', font=font, anchor='mm')
+            draw.text((cx, cy + font.size), dims, fill='black', font=font, anchor='mm')
+
+    buf = BytesIO()
+    img.save(buf, format='PNG')
+    return buf.getvalue(), rooms
@@ -0,0 +1,54 @@
+"""
+Backend routes served next to the reflex app, see `api_transformer` in `buildcheck.py`.
+"""
+import asyncio
+from urllib.parse import quote
+from fastapi import FastAPI, Request, Response
+from buildcheck.backend import tracing
+from buildcheck.backend.overlays import get_overlay, overlay_etag, media_type
+
+
+api = FastAPI()
+
+# the validation stages run in worker processes, their spans only reach the app through the trace file
+_trace_follower = tracing.TraceFileFollower(tracing.TRACE_FILE) if tracing.TRACE_FILE else None
+
+
+def overlay_url(api_url: str, file_name: str, employee_id: int, version) -> str:
+    # a new `version` (e.g. of the layout) makes the browser fetch the overlay again after a revalidation
+    # the name is quoted, an uploaded name may contain '#', '?' or '%'
+    return f'{api_url}/overlay/{employee_id}/{quote(file_name, safe="")}?v={version}'
+
+
+@api.get('/overlay/{employee_id}/{file_name}')
+async def overlay(employee_id: int, file_name: str, request: Request) -> Response:
+    # N.B! like the uploaded blueprints, overlays are not behind a login
+    if file_name in ('.', '..'):
+        return Response(status_code=404)
+
+    # the file system calls and rendering block, keep them off the event loop
+    etag = await asyncio.to_thread(overlay_etag, file_name, employee_id)
+    if etag is None:
+        return Response(status_code=404)
+
+    quoted = f'"{etag}"'
+    headers = {'ETag': quoted, 'Cache-Control': 'private, no-cache'}
+    if quoted in [tag.strip() for tag in request.headers.get('if-none-match', '').split(',')]:
+        return Response(status_code=304, headers=headers)
+
+    result = await asyncio.to_thread(get_overlay, file_name, employee_id)
+    if result is None:
+        return Response(status_code=404)
+    etag, data = result
+    headers['ETag'] = f'"{etag}"'
+    return Response(content=data, media_type=media_type(), headers=headers)
+
+
+@api.get('/metrics')
+async def metrics() -> Response:
+    # prometheus scrape target for the per stage latency histograms of every process
+    if _trace_follower is None:
+        return Response('set BUILDCHECK_TRACE_FILE to collect the spans of the validation workers\n',
+                        status_code=404, media_type='text/plain')
+    hists = await asyncio.to_thread(_trace_follower.update)
+    return Response(tracing.export_prometheus(hists), media_type='text/plain; version=0.0.4')
@@ -0,0 +1,283 @@
+"""
+Bulk re-validation of every case, e.g. after a rule set release.
+
+    python -m buildcheck.backend.backfill --workers 4
+
+Progress is checkpointed in the job store, running the same backfill again
+(same `--run-id`, which defaults to a hash of the current rules) skips the
+cases that are already done. The backfill runs at a lower priority and pauses
+while interactive validations are queued, so reviewers don't wait behind it.
+"""
+import os
+import json
+import time
+import argparse
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+from dotenv import load_dotenv
+from . import jobs
+from .blueprints import bp_name2layoutpath
+from .cache import content_hash
+from .layout_io import load_layout
+from .revalidate import revalidate_layout
+from .violations import AIDecision, case_pages, read_violations, write_violations_bulk
+
+
+load_dotenv()
+
+BACKFILL_WORKERS = int(os.getenv('BACKFILL_WORKERS', '2'))
+# cases whose violations are written (and checkpointed) together
+BACKFILL_WRITE_BATCH = int(os.getenv('BACKFILL_WRITE_BATCH', '100'))
+# 0 means as fast as the workers go
+BACKFILL_MAX_PER_MINUTE = float(os.getenv('BACKFILL_MAX_PER_MINUTE', '0'))
+BACKFILL_NICE = 10
+BACKFILL_YIELD_INTERVAL = 2.0  # seconds to wait while interactive jobs are queued
+
+# 'auto' re-checks the saved layout when there is one and runs the full pipeline otherwise
+BACKFILL_MODES = ('auto', 'rules', 'full')
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS backfill_cases (
+    run_id TEXT NOT NULL,
+    case_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    seconds REAL,
+    finished_at REAL NOT NULL,
+    PRIMARY KEY (run_id, case_id)
+);
+"""
+
+
+@dataclass
+class BackfillSummary:
+    run_id: str
+    total: int = 0
+    skipped: int = 0  # already done by an earlier, interrupted run
+    done: int = 0
+    failed: int = 0
+    violations_changed: int = 0
+    verdict_changed: int = 0
+    seconds: float = 0.0
+
+    @property
+    def per_minute(self) -> float:
+        return (self.done + self.failed) / self.seconds * 60 if self.seconds else 0.0
+
+    def __str__(self):
+        return (
+            f"backfill {self.run_id}: {self.done} done, {self.failed} failed, {self.skipped} skipped of {self.total} cases\n"
+            f"  {self.seconds:.1f}s, {self.per_minute:.1f} cases/min\n"
+            f"  violations changed for {self.violations_changed} cases, verdict changed for {self.verdict_changed}"
+        )
+
+
+def _connect():
+    conn = jobs._connect()
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def default_run_id() -> str:
+    # same rules and pipeline -> same run, so re-running resumes it
+    rules_source = (Path(__file__).parent / 'rule_engine.py').read_bytes()
+    return 'rules-' + content_hash(rules_source, jobs.PIPELINE_VERSION)[:12]
+
+
+def _checkpointed(run_id: str) -> set[int]:
+    with closing(_connect()) as conn:
+        rows = conn.execute("SELECT case_id FROM backfill_cases WHERE run_id = ? AND status = ?", (run_id, 'done'))
+        return {row["case_id"] for row in rows}
+
+
+def _checkpoint(run_id: str, results: list[dict]):
+    with closing(_connect()) as conn:
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT OR REPLACE INTO backfill_cases (run_id, case_id, status, result, error, seconds, finished_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    run_id,
+                    result["case_id"],
+                    'failed' if result["error"] else 'done',
+                    json.dumps(result["failures"]) if result["failures"] is not None else None,
+                    result["error"],
+                    result["seconds"],
+                    time.time(),
+                ) for result in results
+            ],
+        )
+        conn.execute("COMMIT")
+
+
+def _interactive_backlog() -> int:
+    with closing(jobs._connect()) as conn:
+        row = conn.execute("SELECT COUNT(*) AS n FROM jobs WHERE status = ?", (jobs.JobStatus.QUEUED.value,)).fetchone()
+    return row["n"]
+
+
+def _init_worker():
+    # interactive validations get the cpu first
+    os.nice(BACKFILL_NICE)
+
+
+def _backfill_case(case: dict, mode: str) -> dict:
+    # N.B. runs in a backfill worker process
+    start = time.perf_counter()
+    file_name, employee_id = case["blueprint_path"], case["submitter_id"]
+    try:
+        layout_path = bp_name2layoutpath(file_name, employee_id)
+        if mode == 'rules' or (mode == 'auto' and layout_path.exists()):
+            failures = revalidate_layout(load_layout(layout_path))
+        else:
+            from .validation import run_validation
+            failures = [f.guideline.value for f in run_validation(file_name, employee_id)]
+        error = None
+    except Exception:
+        failures = None
+        error = traceback.format_exc()
+
+    return {
+        "case_id": case["id"],
+        "failures": failures,
+        "error": error,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def _pending_cases(done: set[int], summary: BackfillSummary, decisions: dict[int, str]) -> Iterator[dict]:
+    # pages are fetched as the workers get through them, not every case up front
+    for page in case_pages("id, submitter_id, blueprint_path, ai_decision"):
+        for case in page:
+            if not case["blueprint_path"]:
+                continue
+            summary.total += 1
+            if case["id"] in done:
+                summary.skipped += 1
+                continue
+            decisions[case["id"]] = case["ai_decision"]
+            yield case
+
+
+class _Throttle:
+    def __init__(self, max_per_minute: float):
+        self.interval = 60 / max_per_minute if max_per_minute > 0 else 0
+        self.next_at = 0.0
+
+    def wait(self):
+        # back off while reviewers have validations waiting
+        while _interactive_backlog() > 0:
+            time.sleep(BACKFILL_YIELD_INTERVAL)
+
+        if self.interval:
+            now = time.monotonic()
+            if now < self.next_at:
+                time.sleep(self.next_at - now)
+            self.next_at = max(now, self.next_at) + self.interval
+
+
+def run_backfill(
+    run_id: str = None,
+    workers: int = BACKFILL_WORKERS,
+    mode: str = 'auto',
+    write_batch: int = BACKFILL_WRITE_BATCH,
+    max_per_minute: float = BACKFILL_MAX_PER_MINUTE,
+) -> BackfillSummary:
+    if mode not in BACKFILL_MODES:
+        raise ValueError(f"unknown backfill mode {mode!r}, expected one of {BACKFILL_MODES}")
+
+    start = time.perf_counter()
+    run_id = run_id or default_run_id()
+    summary = BackfillSummary(run_id)
+
+    done = _checkpointed(run_id)
+    # ai_decision of the cases handed out and not flushed yet
+    decisions = {}
+    print(f'backfill {run_id}: starting ({len(done)} cases already done)')
+
+    finished = []
+
+    def flush():
+        # write the violations first, the checkpoint only records what is persisted
+        succeeded = {r["case_id"]: r["failures"] for r in finished if not r["error"]}
+        current = read_violations(list(succeeded))
+        changed = {
+            case_id: codes for case_id, codes in succeeded.items()
+            if sorted(codes) != sorted(current[case_id])
+        }
+        # a case that was never validated has no violations and no ai_decision,
+        # it has to be written even when it passes with no failures
+        verdict_changed = {
+            case_id: codes for case_id, codes in succeeded.items()
+            if (AIDecision.REJECTED if codes else AIDecision.APPROVED).value != decisions[case_id]
+        }
+        for result in finished:
+            decisions.pop(result["case_id"], None)
+        if changed or verdict_changed:
+            write_violations_bulk(changed | verdict_changed)
+
+        summary.verdict_changed += len(verdict_changed)
+        summary.violations_changed += len(changed)
+        summary.done += len(succeeded)
+        summary.failed += len(finished) - len(succeeded)
+
+        _checkpoint(run_id, finished)
+        finished.clear()
+        print(f'backfill {run_id}: {summary.done + summary.failed} cases')
+
+    throttle = _Throttle(max_per_minute)
+    ctx = multiprocessing.get_context('spawn')
+    remaining = _pending_cases(done, summary, decisions)
+    in_flight = set()
+
+    with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_worker) as pool:
+        try:
+            while True:
+                # only `workers` cases in flight, so pausing for interactive jobs takes effect quickly
+                while len(in_flight) < workers:
+                    case = next(remaining, None)
+                    if case is None:
+                        break
+                    throttle.wait()
+                    in_flight.add(pool.submit(_backfill_case, case, mode))
+
+                if not in_flight:
+                    break
+
+                completed, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    finished.append(future.result())
+
+                if len(finished) >= write_batch:
+                    flush()
+        except BrokenProcessPool:
+            # keep what we have, running the backfill again resumes from here
+            print(f'backfill {run_id}: a worker died, stopping')
+            raise
+        finally:
+            if finished:
+                flush()
+            summary.seconds = time.perf_counter() - start
+
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="re-validate every case")
+    parser.add_argument('--run-id', help="resume this backfill, defaults to one per rule set")
+    parser.add_argument('--workers', type=int, default=BACKFILL_WORKERS)
+    parser.add_argument('--mode', choices=BACKFILL_MODES, default='auto')
+    parser.add_argument('--batch', type=int, default=BACKFILL_WRITE_BATCH, help="cases per bulk write")
+    parser.add_argument('--max-per-minute', type=float, default=BACKFILL_MAX_PER_MINUTE)
+    args = parser.parse_args()
+
+    summary = run_backfill(args.run_id, args.workers, args.mode, args.batch, args.max_per_minute)
+    print(summary)
@@ -1,8 +1,15 @@
+import os
 from pathlib import Path
 from PIL import Image
+from dotenv import load_dotenv
 import reflex as rx
 
+
+load_dotenv()
+
 BLUEPRINT_HOME = Path('./uploaded_files')
+# png, webp or jpg. see `visualizer.py`
+OVERLAY_FORMAT = os.getenv('VISUALIZER_FORMAT', 'png')
 
 
 
@@ -18,15 +25,12 @@ def bp_name2path(file_name: str, employee_id: int) -> Path:
 
 def bp_name2vispath(file_name: str, employee_id: int) -> Path:
     image_path = bp_name2path(file_name, employee_id)
-    output_path = image_path.with_name(image_path.stem + "_output.png")
+    output_path = image_path.with_name(image_path.stem + f"_output.{OVERLAY_FORMAT}")
     return output_path
 
-
-def bp_name2r2g(file_name: str, employee_id: int) -> Path:
+def bp_name2layoutpath(file_name: str, employee_id: int) -> Path:
     image_path = bp_name2path(file_name, employee_id)
-    output_path = image_path.with_name(image_path.stem + "_r2g.json")
-    return output_path
-
+    return image_path.with_name(image_path.stem + "_layout.arrow")
 
 
 def bp_name2image(file_name: str, employee_id: int) -> Image:
@@ -0,0 +1,127 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+CACHE_HOME = Path(os.getenv('BUILDCHECK_CACHE_DIR', '.buildcheck_cache'))
+CACHE_QUOTA_MB = int(os.getenv('BUILDCHECK_CACHE_QUOTA_MB', '1024'))
+# list the cache at least every this many writes, other processes write to it too
+EVICT_CHECK_INTERVAL = 100
+# eviction goes down to this fraction of the quota
+EVICT_LOW_WATER = 0.9
+
+
+def content_hash(*parts: bytes | str) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        # length prefix so ("ab", "c") and ("a", "bc") don't collide
+        h.update(len(part).to_bytes(8, 'little'))
+        h.update(part)
+    return h.hexdigest()
+
+
+class DiskCache:
+    """
+    Content addressed on-disk cache shared by every user and worker process.
+
+    Entries are written atomically (temp file + rename) so concurrent writers
+    never expose a half written file, and the least recently used entries are
+    evicted once the cache grows past its quota.
+
+    Listing the cache is what eviction costs, so a write only triggers it once
+    a running estimate of the size passes the quota, or every
+    `EVICT_CHECK_INTERVAL` writes to catch up with other processes' writes.
+    """
+
+    def __init__(self, name: str, quota_bytes: int = None, root: Path = None):
+        self.dir = (root if root is not None else CACHE_HOME) / name
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.quota_bytes = quota_bytes if quota_bytes is not None else CACHE_QUOTA_MB * 1024 * 1024
+        # size as of the last listing plus what we wrote since, None until the first listing
+        self._size_estimate: Optional[int] = None
+        self._writes_since_listing = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        # fan out over subdirectories to keep directory listings short
+        return self.dir / key[:2] / key
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            # bump the mtime, which is what LRU eviction goes by
+            os.utime(path)
+        except FileNotFoundError:
+            # never cached, or evicted by another process in the meantime
+            return None
+        return data
+
+    def put(self, key: str, data: bytes):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+        with self._lock:
+            self._writes_since_listing += 1
+            if self._size_estimate is not None:
+                self._size_estimate += len(data)
+            due = (
+                self._size_estimate is None
+                or self._size_estimate > self.quota_bytes
+                or self._writes_since_listing >= EVICT_CHECK_INTERVAL
+            )
+        if due:
+            self.evict()
+
+    def get_json(self, key: str):
+        data = self.get(key)
+        return json.loads(data) if data is not None else None
+
+    def put_json(self, key: str, obj):
+        self.put(key, json.dumps(obj, ensure_ascii=False).encode('utf-8'))
+
+    def evict(self):
+        # drop least recently used entries until we are back under the quota, with some
+        # headroom so the next few writes don't list the cache again right away
+        entries = []
+        total = 0
+        for path in self.dir.glob('*/*'):
+            if path.name.startswith('.tmp-'):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        if total > self.quota_bytes:
+            target = self.quota_bytes * EVICT_LOW_WATER
+            entries.sort()
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+
+        with self._lock:
+            self._size_estimate = total
+            self._writes_since_listing = 0
@@ -0,0 +1,31 @@
+"""
+The decoded blueprint, shared by every stage of a validation.
+
+A blueprint is decoded once into a read-only BGR buffer (opencv's channel
+order, which is also what YOLO and EasyOCR expect for arrays). Stages that
+need another channel order take a view of it instead of converting a copy.
+"""
+import cv2
+import numpy as np
+from PIL import Image
+
+
+def decode_image(data: bytes) -> np.ndarray:
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("could not decode the blueprint image")
+    # shared between stages, nobody gets to draw on it
+    image.flags.writeable = False
+    return image
+
+
+def rgb_view(image: np.ndarray) -> np.ndarray:
+    # BGR <-> RGB without copying, just a negative stride over the channels
+    return image[..., ::-1]
+
+
+def as_bgr(image) -> np.ndarray:
+    # callers that still hand us a PIL image
+    if isinstance(image, Image.Image):
+        return cv2.cvtColor(np.asarray(image.convert('RGB')), cv2.COLOR_RGB2BGR)
+    return image
@@ -0,0 +1,376 @@
+"""
+Inference server shared by every worker of a deployment.
+
+One process owns the YOLO model and the EasyOCR reader and serves them over a
+unix socket (`INFERENCE_SOCKET`), so the models are in memory once instead of
+once per worker. Images travel in shared memory, only a small descriptor goes
+over the socket.
+
+Concurrent requests from all workers are gathered into micro-batches: the
+first request of a batch waits at most `INFERENCE_MAX_WAIT_MS` for others to
+join, and a model call takes up to `INFERENCE_MAX_BATCH` images.
+
+    uv run python -m buildcheck.backend.inference_server
+
+With `INFERENCE_SOCKET` set, `models.get_yolo` and `models.get_ocr_reader`
+hand out clients with the same `predict` / `readtext` / `readtext_batched`
+methods as the real models, so the processors don't know the difference.
+"""
+import os
+import time
+import queue
+import threading
+import traceback
+from collections import defaultdict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Connection, Listener
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable
+import numpy as np
+from dotenv import load_dotenv
+from .images import as_bgr
+from .tiling import batched
+from .tracing import span
+
+
+load_dotenv()
+
+INFERENCE_SOCKET = os.getenv('INFERENCE_SOCKET', '')
+INFERENCE_MAX_BATCH = int(os.getenv('INFERENCE_MAX_BATCH', '8'))  # images per model call
+INFERENCE_MAX_WAIT_MS = float(os.getenv('INFERENCE_MAX_WAIT_MS', '10'))
+# shared secret of the server and its clients, requests are pickles so don't run without one
+# where other users can reach the socket
+INFERENCE_AUTHKEY = os.getenv('INFERENCE_AUTHKEY', '').encode() or None
+DEFAULT_SOCKET = '/tmp/buildcheck-inference.sock'
+
+
+class InferenceError(Exception):
+    pass
+
+
+# descriptor of an image in a shared memory segment: (offset, shape)
+ImageRef = tuple[int, tuple[int, ...]]
+
+
+def _share(images: list[np.ndarray]) -> tuple[SharedMemory, list[ImageRef]]:
+    # copy the images back to back into one new segment
+    images = [np.asarray(image, dtype=np.uint8) for image in images]
+    shm = SharedMemory(create=True, size=max(sum(image.nbytes for image in images), 1))
+    refs, offset = [], 0
+    for image in images:
+        np.ndarray(image.shape, dtype=np.uint8, buffer=shm.buf, offset=offset)[...] = image
+        refs.append((offset, image.shape))
+        offset += image.nbytes
+    return shm, refs
+
+
+def _views(shm: SharedMemory, refs: list[ImageRef]) -> list[np.ndarray]:
+    views = []
+    for offset, shape in refs:
+        view = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+        view.flags.writeable = False
+        views.append(view)
+    return views
+
+
+#
+# MARK - Server
+#
+
+
+@dataclass
+class _Request:
+    key: tuple  # requests with the same key can share a model call
+    images: list[np.ndarray]
+    received: float  # monotonic
+    future: Future
+
+
+class MicroBatcher:
+    """
+    Runs `run(images, key)` on the images of all requests that arrive within
+    `max_wait` seconds of the first one, per key and `max_batch` images at a
+    time. `run` returns one output per image.
+    """
+
+    def __init__(self, name: str, run: Callable[[list[np.ndarray], tuple], list],
+                 max_batch: int = INFERENCE_MAX_BATCH, max_wait: float = INFERENCE_MAX_WAIT_MS / 1000):
+        self.name = name
+        self.run = run
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue: queue.Queue[_Request] = queue.Queue()
+        self.thread = threading.Thread(target=self._loop, name=f'batcher-{name}', daemon=True)
+        self.thread.start()
+
+    def submit(self, key: tuple, images: list[np.ndarray]) -> Future:
+        future = Future()
+        self.queue.put(_Request(key, images, time.monotonic(), future))
+        return future
+
+    def _gather(self) -> list[_Request]:
+        first = self.queue.get()
+        batch, size = [first], len(first.images)
+        deadline = first.received + self.max_wait
+        while size < self.max_batch:
+            # past the deadline, still take whatever queued up while the model was busy
+            timeout = deadline - time.monotonic()
+            try:
+                request = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request.images)
+        return batch
+
+    def _loop(self):
+        while True:
+            groups = defaultdict(list)
+            for request in self._gather():
+                groups[request.key].append(request)
+
+            for key, requests in groups.items():
+                counts = [len(request.images) for request in requests]
+                images = [image for request in requests for image in request.images]
+                try:
+                    with span(f'inference.{self.name}', requests=len(requests), images=len(images)):
+                        outputs = []
+                        for chunk in batched(images, self.max_batch):
+                            outputs += self.run(chunk, key)
+                except Exception as e:
+                    outputs = None
+                    error = InferenceError(f'{type(e).__name__}: {e}')
+                finally:
+                    # the images are views of the clients' shared memory, let go of them
+                    # before answering, the clients free the memory once they have their answer
+                    del images
+                    for request in requests:
+                        request.images = None
+
+                start = 0
+                for request, n in zip(requests, counts):
+                    if outputs is None:
+                        request.future.set_exception(error)
+                    else:
+                        request.future.set_result(outputs[start:start + n])
+                    start += n
+
+
+def _run_yolo(images: list[np.ndarray], key: tuple) -> list:
+    # -> (xyxy, conf, cls) arrays for every image
+    from .models import get_yolo
+
+    _, conf, imgsz = key
+    model = get_yolo(remote=False).model
+    options = {'imgsz': imgsz} if imgsz is not None else {}
+    outputs = []
+    for result in model.predict(source=images, conf=conf, save=False, verbose=False, **options):
+        boxes = result.boxes
+        if boxes is None or len(boxes) == 0:
+            outputs.append((np.empty((0, 4)), np.empty(0), np.empty(0)))
+        else:
+            outputs.append((boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy(), boxes.cls.cpu().numpy()))
+    return outputs
+
+
+def _run_ocr(images: list[np.ndarray], key: tuple) -> list:
+    # requests are grouped by image shape, so readtext_batched gets equally sized images.
+    # `OCRProcessor` rounds its crops up to `OCR_CANVAS_STEP`, so crops of different requests share shapes
+    from .models import get_ocr_reader
+
+    return get_ocr_reader(remote=False).model.readtext_batched(images, batch_size=len(images))
+
+
+def _handle(conn: Connection, batchers: dict[str, MicroBatcher], info: dict):
+    # one thread per client connection, the clients wait for the answer before sending the next request
+    with conn:
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                return
+
+            try:
+                reply = _serve_request(batchers, info, *message)
+            except Exception as e:
+                # a bad request (unknown op, shared memory gone, ...) must not take the connection down,
+                # the client is blocked on our answer
+                traceback.print_exc()
+                reply = ('error', f'{type(e).__name__}: {e}')
+
+            try:
+                conn.send(reply)
+            except (OSError, ValueError):
+                return
+
+
+def _serve_request(batchers: dict[str, MicroBatcher], info: dict, op: str, shm_name: str, refs: list, options: dict) -> tuple:
+    if op == 'info':
+        return ('ok', info)
+    if op not in batchers:
+        raise InferenceError(f"unknown op {op!r}")
+
+    shm = SharedMemory(shm_name, track=False)
+    try:
+        views = _views(shm, refs)
+        if op == 'predict':
+            key = ('predict', options.get('conf', 0.25), options.get('imgsz'))
+        else:
+            key = ('readtext', views[0].shape if views else None)
+        future = batchers[op].submit(key, views)
+        del views
+        try:
+            return ('ok', future.result())
+        except InferenceError as e:
+            return ('error', str(e))
+    finally:
+        try:
+            shm.close()
+        except BufferError:
+            # the model still holds on to a view (e.g. ultralytics keeps its last batch),
+            # the mapping goes away with it
+            pass
+
+
+def serve(address: str = None, max_batch: int = INFERENCE_MAX_BATCH, max_wait_ms: float = INFERENCE_MAX_WAIT_MS):
+    from .models import get_yolo, get_ocr_reader
+
+    address = address or INFERENCE_SOCKET or DEFAULT_SOCKET
+    yolo = get_yolo(remote=False)
+    ocr = get_ocr_reader(remote=False)
+    info = {
+        "yolo": yolo.version,
+        "easyocr": ocr.version,
+        "names": dict(yolo.model.names),
+    }
+    batchers = {
+        'predict': MicroBatcher('yolo', _run_yolo, max_batch, max_wait_ms / 1000),
+        'readtext': MicroBatcher('easyocr', _run_ocr, max_batch, max_wait_ms / 1000),
+    }
+
+    # a socket left behind by a server that did not shut down cleanly
+    if os.path.exists(address):
+        os.unlink(address)
+
+    # the socket is created owner-only, there is no window in which others can connect and send pickles
+    umask = os.umask(0o077)
+    try:
+        listener = Listener(address, family='AF_UNIX', authkey=INFERENCE_AUTHKEY)
+    finally:
+        os.umask(umask)
+
+    with listener:
+        print(f'serving {yolo.version} and {ocr.version} on {address} '
+              f'(batches of up to {max_batch}, waiting up to {max_wait_ms:g}ms)')
+        while True:
+            try:
+                conn = listener.accept()
+            except AuthenticationError as e:
+                print(f'rejected a client: {e}')
+                continue
+            threading.Thread(target=_handle, args=(conn, batchers, info), daemon=True).start()
+
+
+#
+# MARK - Client
+#
+
+
+class InferenceClient:
+    # one connection per thread, requests on a connection are answered in order
+    def __init__(self, address: str = None):
+        self.address = address or INFERENCE_SOCKET or DEFAULT_SOCKET
+        self._local = threading.local()
+
+    def _connection(self) -> Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            try:
+                conn = Client(self.address, family='AF_UNIX', authkey=INFERENCE_AUTHKEY)
+            except (OSError, AuthenticationError) as e:
+                raise InferenceError(f'inference server not reachable at {self.address}: {e}') from e
+            self._local.conn = conn
+        return conn
+
+    def _send(self, message: tuple):
+        # reconnect once, the server may have been restarted since the last call
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.send(message)
+                return conn.recv()
+            except (EOFError, OSError):
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise InferenceError(f'lost the connection to the inference server at {self.address}')
+
+    def call(self, op: str, images: list[np.ndarray] = (), **options):
+        if op != 'info' and not images:
+            return []
+
+        shm, refs = _share(images) if images else (None, [])
+        try:
+            status, value = self._send((op, shm.name if shm else None, refs, options))
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+        if status == 'error':
+            raise InferenceError(value)
+        return value
+
+
+@dataclass
+class RemoteBoxes:
+    xyxy: np.ndarray
+    conf: np.ndarray
+    cls: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.xyxy)
+
+
+@dataclass
+class RemoteResult:
+    names: dict
+    boxes: RemoteBoxes
+
+
+class RemoteYOLO:
+    # stands in for `ultralytics.YOLO`, as far as `YOLOProcessor` uses it
+    def __init__(self, client: InferenceClient, names: dict):
+        self.client = client
+        self.names = names
+
+    def predict(self, source, conf: float = 0.25, imgsz: int = None, **_):
+        images = source if isinstance(source, list) else [source]
+        outputs = self.client.call('predict', [as_bgr(image) for image in images], conf=conf, imgsz=imgsz)
+        return [RemoteResult(self.names, RemoteBoxes(*output)) for output in outputs]
+
+
+class RemoteOCRReader:
+    # stands in for `easyocr.Reader`, as far as `OCRProcessor` uses it
+    def __init__(self, client: InferenceClient):
+        self.client = client
+
+    def readtext(self, image) -> list:
+        return self.client.call('readtext', [as_bgr(image)])[0]
+
+    def readtext_batched(self, images: list, batch_size: int = 1) -> list:
+        return self.client.call('readtext', [as_bgr(image) for image in images])
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="serve the YOLO and OCR models to every worker")
+    parser.add_argument('--socket', default=INFERENCE_SOCKET or DEFAULT_SOCKET)
+    parser.add_argument('--max-batch', type=int, default=INFERENCE_MAX_BATCH, help="images per model call")
+    parser.add_argument('--max-wait-ms', type=float, default=INFERENCE_MAX_WAIT_MS,
+                        help="how long the first request of a batch waits for others")
+    args = parser.parse_args()
+    serve(args.socket, args.max_batch, args.max_wait_ms)
@@ -0,0 +1,459 @@
+import os
+import json
+import sqlite3
+import time
+import uuid
+import shutil
+import multiprocessing
+import traceback
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from threading import Event, Lock
+from typing import Optional
+from dotenv import load_dotenv
+from .blueprints import bp_name2path, bp_name2layoutpath
+from .models import warm_models
+from .cache import content_hash
+
+
+load_dotenv()
+
+# The job store is a small sqlite db so that queued/running validations
+# survive an app restart. every worker process opens its own connection.
+JOBS_DB = Path(os.getenv('BUILDCHECK_JOBS_DB', 'buildcheck_jobs.db'))
+VALIDATION_WORKERS = int(os.getenv('VALIDATION_WORKERS', '2'))
+
+# bump whenever a change to the pipeline changes its output,
+# so that identical validations of old and new code are not coalesced
+PIPELINE_VERSION = '1'
+FLIGHT_POLL_INTERVAL = 0.5  # seconds
+# give up on a validation computed by another process after this long
+FLIGHT_TIMEOUT = float(os.getenv('VALIDATION_FLIGHT_TIMEOUT', '900'))
+# a job whose worker died this many times (e.g. OOM on a huge scan) is failed instead of requeued
+MAX_ATTEMPTS = int(os.getenv('VALIDATION_MAX_ATTEMPTS', '2'))
+
+
+class JobStatus(Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+@dataclass
+class Job:
+    id: str
+    case_id: Optional[int]
+    file_name: str
+    employee_id: int
+    status: JobStatus
+    result: Optional[list[int]]  # guideline codes of the failures
+    error: Optional[str]
+    submitted_at: float
+    started_at: Optional[float]
+    finished_at: Optional[float]
+    worker_pid: Optional[int]
+    flight_key: Optional[str]
+    attempts: int
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JobStatus.DONE, JobStatus.FAILED)
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    case_id INTEGER,
+    file_name TEXT NOT NULL,
+    employee_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    submitted_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    worker_pid INTEGER,
+    flight_key TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+
+-- validations currently being computed, one row per blueprint content + pipeline version.
+-- this is the cross process lock that coalesces identical validations
+CREATE TABLE IF NOT EXISTS flights (
+    key TEXT PRIMARY KEY,
+    owner_pid INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    started_at REAL NOT NULL,
+    finished_at REAL
+);
+"""
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(JOBS_DB, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    # WAL lets the app poll while workers are writing
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+
+    # job stores created before flight_key / attempts existed
+    columns = [row["name"] for row in conn.execute("PRAGMA table_info(jobs)")]
+    if "flight_key" not in columns:
+        conn.execute("ALTER TABLE jobs ADD COLUMN flight_key TEXT")
+    if "attempts" not in columns:
+        conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+    return conn
+
+
+def _row2job(row: sqlite3.Row) -> Job:
+    return Job(
+        id=row["id"],
+        case_id=row["case_id"],
+        file_name=row["file_name"],
+        employee_id=row["employee_id"],
+        status=JobStatus(row["status"]),
+        result=json.loads(row["result"]) if row["result"] is not None else None,
+        error=row["error"],
+        submitted_at=row["submitted_at"],
+        started_at=row["started_at"],
+        finished_at=row["finished_at"],
+        worker_pid=row["worker_pid"],
+        flight_key=row["flight_key"],
+        attempts=row["attempts"],
+    )
+
+
+def get_job(job_id: str) -> Optional[Job]:
+    with closing(_connect()) as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _row2job(row) if row else None
+
+
+def list_jobs(status: JobStatus = None) -> list[Job]:
+    with closing(_connect()) as conn:
+        if status is None:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY submitted_at").fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY submitted_at", (status.value,)
+            ).fetchall()
+    return [_row2job(row) for row in rows]
+
+
+#
+# MARK - Worker side
+#
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _claim_job(conn: sqlite3.Connection, job_id: str) -> bool:
+    # only one process may move a job from queued to running
+    cur = conn.execute(
+        "UPDATE jobs SET status = ?, started_at = ?, worker_pid = ?, attempts = attempts + 1 WHERE id = ? AND status = ?",
+        (JobStatus.RUNNING.value, time.time(), os.getpid(), job_id, JobStatus.QUEUED.value),
+    )
+    return cur.rowcount == 1
+
+
+def validation_key(file_name: str, employee_id: int) -> str:
+    # identical blueprints give identical results, regardless of who uploaded them
+    image_bytes = bp_name2path(file_name, employee_id).read_bytes()
+    return content_hash(image_bytes, PIPELINE_VERSION)
+
+
+def _acquire_flight(conn: sqlite3.Connection, key: str) -> Optional[float]:
+    # Try to become the process computing `key`.
+    # Returns our start time if we got it, None if someone else is computing it
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT * FROM flights WHERE key = ?", (key,)).fetchone()
+        running = (
+            row is not None
+            and row["status"] == JobStatus.RUNNING.value
+            and _pid_alive(row["owner_pid"])
+        )
+        if running:
+            return None
+
+        started_at = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO flights (key, owner_pid, status, started_at) VALUES (?, ?, ?, ?)",
+            (key, os.getpid(), JobStatus.RUNNING.value, started_at),
+        )
+        return started_at
+    finally:
+        conn.execute("COMMIT")
+
+
+def _finish_flight(conn: sqlite3.Connection, key: str, result=None, error: str = None):
+    status = JobStatus.FAILED if error is not None else JobStatus.DONE
+    conn.execute(
+        "UPDATE flights SET status = ?, result = ?, error = ?, finished_at = ? WHERE key = ? AND owner_pid = ?",
+        (status.value, json.dumps(result), error, time.time(), key, os.getpid()),
+    )
+    # finished flights are only kept around for the waiters to read
+    conn.execute("DELETE FROM flights WHERE finished_at < ?", (time.time() - 3600,))
+
+
+def _wait_flight(conn: sqlite3.Connection, key: str, timeout: float = FLIGHT_TIMEOUT):
+    # wait for the process computing `key` and return its result.
+    # returns None if that process went away, so the caller can take over
+    deadline = time.monotonic() + timeout
+    while True:
+        if time.monotonic() > deadline:
+            # the owner is alive but stuck, taking over would just wait on it again
+            raise TimeoutError(f"coalesced validation {key=} did not finish within {timeout:.0f}s")
+        time.sleep(FLIGHT_POLL_INTERVAL)
+        row = conn.execute("SELECT * FROM flights WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row["status"] == JobStatus.DONE.value:
+            return json.loads(row["result"])
+        if row["status"] == JobStatus.FAILED.value:
+            raise RuntimeError(f"coalesced validation failed: {row['error']}")
+        if not _pid_alive(row["owner_pid"]):
+            return None
+
+
+def _coalesced(key: str, compute):
+    # run `compute` unless another process is already computing `key`, then share its result
+    conn = _connect()
+    try:
+        while True:
+            if _acquire_flight(conn, key) is not None:
+                try:
+                    result = compute()
+                except Exception as e:
+                    _finish_flight(conn, key, error=f"{type(e).__name__}: {e}")
+                    raise
+                _finish_flight(conn, key, result=result)
+                return result
+
+            print(f'attaching to in-flight validation {key=}')
+            result = _wait_flight(conn, key)
+            if result is not None:
+                return result
+    finally:
+        conn.close()
+
+
+def _validate(file_name: str, employee_id: int) -> dict:
+    from .validation import run_validation
+
+    failures = run_validation(file_name, employee_id)
+    return {
+        "failures": [f.guideline.value for f in failures],
+        "layout": str(bp_name2layoutpath(file_name, employee_id)),
+    }
+
+
+def _run_job(job_id: str):
+    # N.B. this runs inside a pool worker process, never in the app process
+    from .violations import write_violations
+
+    conn = _connect()
+    try:
+        if not _claim_job(conn, job_id):
+            return
+
+        job = _row2job(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+        try:
+            key = job.flight_key or validation_key(job.file_name, job.employee_id)
+            result = _coalesced(key, lambda: _validate(job.file_name, job.employee_id))
+            failure_codes = result["failures"]
+
+            # the layout was saved for whichever upload computed it first,
+            # every upload needs its own to render its overlay from
+            layout = bp_name2layoutpath(job.file_name, job.employee_id)
+            if result.get("layout") and Path(result["layout"]) != layout and Path(result["layout"]).exists():
+                shutil.copyfile(result["layout"], layout)
+
+            if job.case_id is not None:
+                write_violations(job.case_id, failure_codes)
+        except Exception as e:
+            traceback.print_exc()
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                (JobStatus.FAILED.value, f"{type(e).__name__}: {e}", time.time(), job_id),
+            )
+            return
+
+        conn.execute(
+            "UPDATE jobs SET status = ?, result = ?, finished_at = ? WHERE id = ?",
+            (JobStatus.DONE.value, json.dumps(failure_codes), time.time(), job_id),
+        )
+    finally:
+        conn.close()
+
+
+#
+# MARK - App side
+#
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = Lock()
+_submit_lock = Lock()
+_restart_lock = Lock()
+# set once a worker of the pool died, every job submitted to it is lost
+_pool_broken = Event()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn instead of fork, the app process has threads and an event loop running.
+            # each worker loads the models once up front instead of per validation
+            _pool = ProcessPoolExecutor(
+                max_workers=VALIDATION_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=warm_models,
+            )
+            _pool_broken.clear()
+            _resume_jobs(_pool)
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _watch(future: Future):
+    # N.B. runs in the pool's management thread
+    if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+        _pool_broken.set()
+
+
+def _submit(pool: ProcessPoolExecutor, job_id: str):
+    pool.submit(_run_job, job_id).add_done_callback(_watch)
+
+
+def _resume_jobs(pool: ProcessPoolExecutor):
+    # pick up work that was lost when the app (or a worker) went down
+    with closing(_connect()) as conn:
+        for job in list_jobs(JobStatus.RUNNING):
+            if _pid_alive(job.worker_pid):
+                continue
+            if job.attempts >= MAX_ATTEMPTS:
+                # the input itself probably kills the worker, don't take the next one down with it
+                print(f'giving up on validation job {job.id=} {job.file_name=} after {job.attempts} attempts')
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ? AND status = ?",
+                    (JobStatus.FAILED.value, f"the validation worker died {job.attempts} times",
+                     time.time(), job.id, JobStatus.RUNNING.value),
+                )
+            else:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, started_at = NULL, worker_pid = NULL WHERE id = ? AND status = ?",
+                    (JobStatus.QUEUED.value, job.id, JobStatus.RUNNING.value),
+                )
+
+    for job in list_jobs(JobStatus.QUEUED):
+        print(f'resuming validation job {job.id=} {job.file_name=}')
+        _submit(pool, job.id)
+
+
+def _restart_pool():
+    # a fresh pool resumes whatever the dead one lost
+    _reset_pool()
+    _get_pool()
+
+
+def resume_jobs():
+    """
+    Start the worker pool and pick up the jobs left queued or running when
+    the app last went down. Runs at app startup, see `buildcheck.py`.
+    """
+    _get_pool()
+
+
+def check_job(job_id: str) -> Optional[Job]:
+    """
+    `get_job` for callers waiting on a job: if the worker running it (or any
+    worker of the pool) died, the pool is restarted first, which requeues the
+    job or fails it after `MAX_ATTEMPTS`.
+    """
+    job = get_job(job_id)
+    if job is None or job.finished:
+        return job
+
+    # several reviewers may be waiting on jobs of the same dead pool, restart it once
+    with _restart_lock:
+        job = get_job(job_id)
+        dead = job.status == JobStatus.RUNNING and not _pid_alive(job.worker_pid)
+        if not job.finished and (dead or _pool_broken.is_set()):
+            print(f'validation worker died, restarting the pool ({job.id=})')
+            _restart_pool()
+            job = get_job(job_id)
+    return job
+
+
+def submit_validation(file_name: str, employee_id: int, case_id: int = None) -> str:
+    """
+    Queue a validation and return its job id right away.
+    The result is written to the job store (and to the case's violations if `case_id` is given).
+    """
+    # fail early so the caller can tell the user, rather than finding out in a worker
+    if not bp_name2path(file_name, employee_id).exists():
+        raise FileNotFoundError(file_name)
+
+    pool = _get_pool()
+    key = validation_key(file_name, employee_id)
+
+    with _submit_lock, closing(_connect()) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # double clicks and two reviewers on one case share the job that is already queued/running
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE flight_key = ? AND case_id IS ? AND status IN (?, ?)",
+                (key, case_id, JobStatus.QUEUED.value, JobStatus.RUNNING.value),
+            ).fetchone()
+            if row is not None:
+                print(f'attaching to validation job {row["id"]} for {file_name=}')
+                return row["id"]
+
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (id, case_id, file_name, employee_id, status, submitted_at, flight_key) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, case_id, file_name, employee_id, JobStatus.QUEUED.value, time.time(), key),
+            )
+        finally:
+            conn.execute("COMMIT")
+
+    try:
+        _submit(pool, job_id)
+    except BrokenProcessPool:
+        # a worker died (e.g. OOM on a huge scan), a fresh pool resumes the job with the others
+        _restart_pool()
+    return job_id
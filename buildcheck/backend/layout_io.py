@@ -0,0 +1,294 @@
+"""
+On-disk format for `Layout`s.
+
+Layouts are stored as an Arrow IPC stream, zstd compressed, one row per layout.
+A layout's symbol table is stored once and rooms refer to its symbols by id.
+Geometry (room polygons and symbol bboxes) is WKB so it round trips exactly
+and decodes in one vectorized `shapely.from_wkb` call per batch.
+
+The format version lives in the schema metadata. Bump `LAYOUT_SCHEMA_VERSION`
+when the schema changes and add a function to `_UPGRADES` that turns a batch
+written by the previous version into the current schema, so old layouts stay loadable.
+"""
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+import numpy as np
+import pyarrow as pa
+import shapely
+from .vectorization import Layout, Room, Symbol, Category, Label, Dimension, Metadata, symbol_boxes
+
+
+LAYOUT_SCHEMA_VERSION = 2
+_VERSION_KEY = b'buildcheck.layout_version'
+
+# layouts per record batch when streaming to a file
+LAYOUT_BATCH_SIZE = 256
+
+_LABEL = 0
+_DIMENSION = 1
+
+_metadata_type = pa.struct([
+    ('kind', pa.int8()),
+    ('text', pa.string()),
+    ('width', pa.float64()),
+    ('height', pa.float64()),
+])
+_symbol_type = pa.struct([
+    ('category', pa.int8()),
+    ('bbox', pa.binary()),
+])
+_room_type = pa.struct([
+    ('polygon', pa.binary()),
+    ('symbol_ids', pa.list_(pa.int32())),
+    ('metadata', pa.list_(_metadata_type)),
+])
+
+LAYOUT_SCHEMA = pa.schema(
+    [
+        ('file_name', pa.string()),
+        ('symbols', pa.list_(_symbol_type)),
+        ('rooms', pa.list_(_room_type)),
+        ('metadata', pa.list_(_metadata_type)),
+    ],
+    metadata={_VERSION_KEY: str(LAYOUT_SCHEMA_VERSION).encode()},
+)
+
+_WRITE_OPTIONS = pa.ipc.IpcWriteOptions(compression='zstd')
+
+
+def _v1_to_v2(batch: pa.RecordBatch) -> pa.RecordBatch:
+    # v1 stored a symbol in every room it is in, v2 stores it once per layout
+    rows = batch.to_pylist()
+    for row in rows:
+        symbol_ids = {}
+        row['symbols'] = []
+        for room in row['rooms']:
+            room['symbol_ids'] = []
+            for symbol in room.pop('symbols'):
+                key = (symbol['category'], symbol['bbox'])
+                if key not in symbol_ids:
+                    symbol_ids[key] = len(row['symbols'])
+                    row['symbols'].append(symbol)
+                room['symbol_ids'].append(symbol_ids[key])
+    return pa.RecordBatch.from_pylist(rows, schema=LAYOUT_SCHEMA)
+
+
+# version -> function upgrading a batch of that version to version + 1
+_UPGRADES: dict[int, Callable[[pa.RecordBatch], pa.RecordBatch]] = {1: _v1_to_v2}
+
+
+#
+# MARK - Encoding
+#
+
+def _offsets(lengths: list[int]) -> pa.Array:
+    return pa.array(np.concatenate(([0], np.cumsum(lengths, dtype=np.int64))).astype(np.int32))
+
+
+def _wkb(geometries: list) -> pa.Array:
+    return pa.array(shapely.to_wkb(np.array(geometries, dtype=object)), type=pa.binary())
+
+
+def _metadata_array(metadata_lists: list[list[Metadata]]) -> pa.ListArray:
+    kinds, texts, widths, heights = [], [], [], []
+    for metadata in metadata_lists:
+        for data in metadata:
+            if isinstance(data, Label):
+                kinds.append(_LABEL)
+                texts.append(data.text)
+                widths.append(None)
+                heights.append(None)
+            else:
+                kinds.append(_DIMENSION)
+                texts.append(None)
+                widths.append(float(data.width))
+                heights.append(float(data.height))
+
+    values = pa.StructArray.from_arrays(
+        [
+            pa.array(kinds, type=pa.int8()),
+            pa.array(texts, type=pa.string()),
+            pa.array(widths, type=pa.float64()),
+            pa.array(heights, type=pa.float64()),
+        ],
+        fields=list(_metadata_type),
+    )
+    return pa.ListArray.from_arrays(_offsets([len(m) for m in metadata_lists]), values)
+
+
+def layouts2batch(layouts: list[Layout]) -> pa.RecordBatch:
+    rooms = [room for layout in layouts for room in layout.rooms]
+    symbols = [symbol for layout in layouts for symbol in layout.symbols]
+    symbol_ids = np.fromiter((i for room in rooms for i in room.symbol_ids), dtype=np.int32)
+
+    symbol_values = pa.StructArray.from_arrays(
+        [
+            pa.array([symbol.category.value for symbol in symbols], type=pa.int8()),
+            _wkb(symbol_boxes(symbols)),
+        ],
+        fields=list(_symbol_type),
+    )
+    room_values = pa.StructArray.from_arrays(
+        [
+            _wkb([room.polygon for room in rooms]),
+            pa.ListArray.from_arrays(_offsets([len(room.symbol_ids) for room in rooms]), pa.array(symbol_ids)),
+            _metadata_array([room.metadata for room in rooms]),
+        ],
+        fields=list(_room_type),
+    )
+
+    return pa.RecordBatch.from_arrays(
+        [
+            pa.array([layout.file_name for layout in layouts], type=pa.string()),
+            pa.ListArray.from_arrays(_offsets([len(layout.symbols) for layout in layouts]), symbol_values),
+            pa.ListArray.from_arrays(_offsets([len(layout.rooms) for layout in layouts]), room_values),
+            _metadata_array([layout.metadata for layout in layouts]),
+        ],
+        schema=LAYOUT_SCHEMA,
+    )
+
+
+#
+# MARK - Decoding
+#
+
+def _split(items: list, offsets: np.ndarray) -> list[list]:
+    return [items[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def _metadata_lists(array: pa.ListArray) -> list[list[Metadata]]:
+    values = array.values
+    kinds = values.field('kind').to_numpy(zero_copy_only=False)
+    texts = values.field('text').to_pylist()
+    widths = values.field('width').to_pylist()
+    heights = values.field('height').to_pylist()
+
+    items = [
+        Label(text) if kind == _LABEL else Dimension(width, height)
+        for kind, text, width, height in zip(kinds, texts, widths, heights)
+    ]
+    return _split(items, array.offsets.to_numpy())
+
+
+def _upgrade(batch: pa.RecordBatch, version: int) -> pa.RecordBatch:
+    if version > LAYOUT_SCHEMA_VERSION:
+        raise ValueError(f"layout format v{version} is newer than this version of buildcheck (v{LAYOUT_SCHEMA_VERSION})")
+    while version < LAYOUT_SCHEMA_VERSION:
+        batch = _UPGRADES[version](batch)
+        version += 1
+    return batch
+
+
+def _schema_version(schema: pa.Schema) -> int:
+    metadata = schema.metadata or {}
+    if _VERSION_KEY not in metadata:
+        raise ValueError("not a buildcheck layout file (no format version)")
+    return int(metadata[_VERSION_KEY])
+
+
+def batch2layouts(batch: pa.RecordBatch, version: int = LAYOUT_SCHEMA_VERSION) -> list[Layout]:
+    batch = _upgrade(batch, version)
+
+    symbol_lists = batch.column('symbols')
+    symbol_values = symbol_lists.values
+    room_lists = batch.column('rooms')
+    room_values = room_lists.values
+    id_lists = room_values.field('symbol_ids')
+
+    bboxes = shapely.from_wkb(symbol_values.field('bbox').to_numpy(zero_copy_only=False))
+    if len(bboxes) and not np.all(shapely.get_num_coordinates(bboxes) == 5):
+        raise ValueError("corrupt layout, symbol bbox is not a 4 point polygon")
+    categories = [Category(value) for value in symbol_values.field('category').to_pylist()]
+    # symbols only keep the bounds, their polygons are rebuilt when needed
+    symbols = [Symbol.from_bounds(category, bounds) for category, bounds in zip(categories, shapely.bounds(bboxes))]
+
+    polygons = shapely.from_wkb(room_values.field('polygon').to_numpy(zero_copy_only=False))
+    room_metadata = _metadata_lists(room_values.field('metadata'))
+    room_symbol_ids = _split(id_lists.values.to_numpy(zero_copy_only=False).tolist(), id_lists.offsets.to_numpy())
+
+    layouts = []
+    for file_name, layout_symbols, room_slice, layout_metadata in zip(
+        batch.column('file_name').to_pylist(),
+        _split(symbols, symbol_lists.offsets.to_numpy()),
+        _split(list(range(len(polygons))), room_lists.offsets.to_numpy()),
+        _metadata_lists(batch.column('metadata')),
+    ):
+        layout = Layout(
+            rooms=[Room(polygons[i], metadata=room_metadata[i]) for i in room_slice],
+            metadata=layout_metadata,
+            file_name=file_name,
+        )
+        for symbol in layout_symbols:
+            layout.add_symbol(symbol)
+        for room, i in zip(layout.rooms, room_slice):
+            for symbol_id in room_symbol_ids[i]:
+                if not 0 <= symbol_id < len(layout.symbols):
+                    raise ValueError(f"corrupt layout, room refers to unknown symbol {symbol_id}")
+                layout.link(symbol_id, room)
+        layouts.append(layout)
+    return layouts
+
+
+#
+# MARK - Files & bytes
+#
+
+def write_layouts(path: Path, layouts: Iterable[Layout], batch_size: int = LAYOUT_BATCH_SIZE):
+    """
+    Stream `layouts` to `path`, `batch_size` layouts per record batch.
+    Written to a temp file first so readers never see a partial file.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with pa.OSFile(str(tmp_path), 'wb') as sink, \
+            pa.ipc.new_stream(sink, LAYOUT_SCHEMA, options=_WRITE_OPTIONS) as writer:
+        batch = []
+        for layout in layouts:
+            batch.append(layout)
+            if len(batch) >= batch_size:
+                writer.write_batch(layouts2batch(batch))
+                batch = []
+        if batch:
+            writer.write_batch(layouts2batch(batch))
+    tmp_path.replace(path)
+
+
+def iter_layout_batches(path: Path) -> Iterator[list[Layout]]:
+    # one record batch at a time, the file is never loaded as a whole
+    with pa.OSFile(str(path), 'rb') as source:
+        reader = pa.ipc.open_stream(source)
+        version = _schema_version(reader.schema)
+        for batch in reader:
+            yield batch2layouts(batch, version)
+
+
+def iter_layouts(path: Path) -> Iterator[Layout]:
+    for layouts in iter_layout_batches(path):
+        yield from layouts
+
+
+def save_layout(layout: Layout, path: Path):
+    write_layouts(path, [layout])
+
+
+def load_layout(path: Path) -> Layout:
+    layouts = list(iter_layouts(path))
+    if len(layouts) != 1:
+        raise ValueError(f"expected one layout in {path}, found {len(layouts)}")
+    return layouts[0]
+
+
+def dump_layout(layout: Layout) -> bytes:
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, LAYOUT_SCHEMA, options=_WRITE_OPTIONS) as writer:
+        writer.write_batch(layouts2batch([layout]))
+    return sink.getvalue().to_pybytes()
+
+
+def parse_layout(data: bytes) -> Layout:
+    reader = pa.ipc.open_stream(pa.py_buffer(data))
+    version = _schema_version(reader.schema)
+    layouts = [layout for batch in reader for layout in batch2layouts(batch, version)]
+    if len(layouts) != 1:
+        raise ValueError(f"expected one layout, found {len(layouts)}")
+    return layouts[0]
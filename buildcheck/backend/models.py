@@ -0,0 +1,173 @@
+import os
+import hashlib
+import threading
+import time
+from dataclasses import dataclass
+from functools import cache
+from importlib.metadata import version as package_version
+from pathlib import Path
+from typing import Callable
+import numpy as np
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+YOLO_MODEL_PATH = "buildcheck/backend/best.pt"
+OCR_LANGS = ('en',)
+
+# run a dummy inference right after loading so the first real case doesn't pay for it
+WARMUP_MODELS = True
+
+# when set, the models are served by `inference_server.py` on this unix socket
+# instead of being loaded by every process
+INFERENCE_SOCKET = os.getenv('INFERENCE_SOCKET', '')
+
+
+# A model that has been loaded (and warmed up) by this process
+@dataclass
+class LoadedModel:
+    name: str
+    model: object
+    version: str  # changes whenever the weights change
+    load_seconds: float
+    warm_seconds: float
+
+
+# process level registry, every model is loaded at most once per process
+_registry: dict[str, LoadedModel] = {}
+_registry_lock = threading.Lock()
+_key_locks: dict[str, threading.Lock] = {}
+
+
+def _file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+# versions can be looked up without loading the models,
+# e.g. to tell whether a cached detection is still valid
+
+@cache
+def yolo_version(model_path: str = YOLO_MODEL_PATH) -> str:
+    return f'yolo-{_file_hash(model_path)}'
+
+
+@cache
+def ocr_version(langs: tuple[str, ...] = OCR_LANGS) -> str:
+    return f'easyocr-{package_version("easyocr")}-{"+".join(langs)}'
+
+
+def _get_model(key: str, loader: Callable[[], LoadedModel]) -> LoadedModel:
+    # fast path, no locking once the model is there
+    loaded = _registry.get(key)
+    if loaded is not None:
+        return loaded
+
+    # one lock per model so loading the reader does not wait on the yolo weights
+    with _registry_lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+
+    with key_lock:
+        if key not in _registry:
+            _registry[key] = loader()
+        return _registry[key]
+
+
+def _load_yolo(model_path: str) -> LoadedModel:
+    from ultralytics import YOLO
+
+    start = time.perf_counter()
+    model = YOLO(model_path)
+    loaded = time.perf_counter()
+
+    # the first predict builds the predictor and fuses layers, pay for it now
+    if WARMUP_MODELS:
+        model.predict(source=np.full((640, 640, 3), 255, dtype=np.uint8), save=False, verbose=False)
+    warmed = time.perf_counter()
+
+    return LoadedModel(
+        name='yolo',
+        model=model,
+        version=yolo_version(model_path),
+        load_seconds=loaded - start,
+        warm_seconds=warmed - loaded,
+    )
+
+
+def _load_ocr_reader(langs: tuple[str, ...]) -> LoadedModel:
+    import easyocr
+
+    start = time.perf_counter()
+    reader = easyocr.Reader(list(langs), gpu=False)
+    loaded = time.perf_counter()
+
+    # run detection + recognition once on a blank strip
+    if WARMUP_MODELS:
+        reader.readtext(np.full((64, 256, 3), 255, dtype=np.uint8))
+    warmed = time.perf_counter()
+
+    return LoadedModel(
+        name='easyocr',
+        model=reader,
+        version=ocr_version(langs),
+        load_seconds=loaded - start,
+        warm_seconds=warmed - loaded,
+    )
+
+
+def _connect(name: str, expected_version: str) -> LoadedModel:
+    from .inference_server import InferenceClient, InferenceError, RemoteYOLO, RemoteOCRReader
+
+    start = time.perf_counter()
+    client = InferenceClient(INFERENCE_SOCKET)
+    info = client.call('info')
+    if info[name] != expected_version:
+        raise InferenceError(f'the inference server runs {info[name]}, expected {expected_version}')
+    model = RemoteYOLO(client, info["names"]) if name == 'yolo' else RemoteOCRReader(client)
+
+    return LoadedModel(
+        name=name,
+        model=model,
+        version=info[name],
+        load_seconds=time.perf_counter() - start,
+        warm_seconds=0.0,
+    )
+
+
+def _use_server(remote: bool = None) -> bool:
+    # by default, use the inference server if there is one
+    return remote if remote is not None else bool(INFERENCE_SOCKET)
+
+
+def get_yolo(model_path: str = YOLO_MODEL_PATH, remote: bool = None) -> LoadedModel:
+    if _use_server(remote):
+        return _get_model(f'remote-yolo:{INFERENCE_SOCKET}', lambda: _connect('yolo', yolo_version(model_path)))
+    key = f'yolo:{Path(model_path).resolve()}'
+    return _get_model(key, lambda: _load_yolo(model_path))
+
+
+def get_ocr_reader(langs: tuple[str, ...] = OCR_LANGS, remote: bool = None) -> LoadedModel:
+    if _use_server(remote):
+        return _get_model(f'remote-easyocr:{INFERENCE_SOCKET}', lambda: _connect('easyocr', ocr_version(langs)))
+    key = f'easyocr:{"+".join(langs)}'
+    return _get_model(key, lambda: _load_ocr_reader(langs))
+
+
+def model_versions() -> dict[str, str]:
+    # versions of the models loaded so far in this process
+    return {loaded.name: loaded.version for loaded in _registry.values()}
+
+
+def warm_models():
+    """
+    Load and warm every model the validation pipeline uses.
+    Meant to be used as a worker process initializer.
+    """
+    yolo = get_yolo()
+    ocr = get_ocr_reader()
+    for loaded in (yolo, ocr):
+        print(f'loaded {loaded.version} in {loaded.load_seconds:.2f}s (warmup {loaded.warm_seconds:.2f}s)')
@@ -1,17 +1,66 @@
-import easyocr
-import cv2
+import os
 from buildcheck.backend.vectorization import *
+from buildcheck.backend.models import get_ocr_reader
+from buildcheck.backend.tracing import span
+from buildcheck.backend.images import as_bgr
+from buildcheck.backend.tiling import tile_grid, batched, should_tile, merge_detections, check_tiling
 import re
+from collections import defaultdict
 import shapely
 from PIL import Image
 import numpy as np
 
+
+# 'full' reads the whole sheet, 'rooms' only reads the (padded) room bounding boxes
+OCR_MODES = ('full', 'rooms')
+OCR_MODE = os.getenv('OCR_MODE', 'full')
+# in 'rooms' mode, also read the rest of the sheet for layout level text (title block, notes, ...)
+OCR_LAYOUT_TEXT = os.getenv('OCR_LAYOUT_TEXT', '1') == '1'
+OCR_REGION_PADDING = 16  # px
+OCR_BATCH_SIZE = 8
+# crops are padded up to a multiple of this, so crops of about the same size share a batch
+OCR_CANVAS_STEP = 128  # px
+# big sheets are read in overlapping tiles, EasyOCR shrinks anything larger than
+# its 2560px canvas before detecting text. 'auto', 'on' or 'off'
+OCR_TILING = os.getenv('OCR_TILING', 'auto')
+OCR_TILE_SIZE = int(os.getenv('OCR_TILE_SIZE', '1536'))  # px
+# should be longer than the longest line of text
+OCR_TILE_OVERLAP = int(os.getenv('OCR_TILE_OVERLAP', '256'))  # px
+OCR_MERGE_IOU = 0.5
+
+
+def _text_fragment(fragment: str, text: str) -> bool:
+    # the piece of a line a tile edge cut off reads as a part of the whole line, or at
+    # least starts (or ends) like it when the letter at the cut was misread
+    fragment, text = fragment.strip().upper(), text.strip().upper()
+    if not fragment:
+        return True
+    k = min(len(fragment), 3)
+    return fragment in text or text.startswith(fragment[:k]) or text.endswith(fragment[-k:])
+
+
+def _check_mode(mode: str):
+    # a typo would silently fall back to 'full' and still be cached under its own name
+    if mode not in OCR_MODES:
+        raise ValueError(f"unknown OCR mode {mode!r}, expected one of {OCR_MODES}")
+
+
+_check_mode(OCR_MODE)
+check_tiling(OCR_TILING, OCR_TILE_SIZE, OCR_TILE_OVERLAP)
+
+
 class OCRProcessor:
-    def __init__(self, image_pil: Image, layout: Layout):
-        self.reader = easyocr.Reader(['en'], gpu=False)
-        self.image_pil = image_pil
+    def __init__(self, image, layout: Layout):
+        # the decoded BGR blueprint (see `images.py`), or a PIL image
+        self.image = image
         self.layout = layout
 
+    @property
+    def reader(self):
+        # shared, already warmed reader. see `models.py`
+        # only looked up when we actually read text
+        return get_ocr_reader().model
+
     @staticmethod
     def isDimension(text: str) -> bool:
         #pattern handles feet/inches notation like 12'6" x 11'8"
@@ -52,35 +101,176 @@ class OCRProcessor:
 
         return width, height
     
-    # This function extracts text with bounding boxes from the image 
-    # and fill room objects with their labels and dimensions 
-    def ocrProcess(self) :
+    @staticmethod
+    def text2metadata(text: str) -> Metadata:
+        if OCRProcessor.isDimension(text):
+            width, height = OCRProcessor.parse_dimension_text(text)
+            return Dimension(width, height)
+        return Label(text)
+
+    # Fill room objects with their labels and dimensions given
+    # EasyOCR style (bbox, text, confidence) results in image coordinates
+    def assign_text(self, results: list):
+        if not results:
+            return
+
+        # centroids of every text box at once, (n, 4, 2) corners -> (n, 2) centers
+        # (degenerate boxes give empty centroids, i.e. nan, which fall outside every room)
+        corners = np.asarray([bbox for bbox, _, _ in results], dtype=float)
+        centroids = shapely.centroid(shapely.polygons(corners))
+        centers = np.column_stack([shapely.get_x(centroids), shapely.get_y(centroids)])
+
+        # room index for every center, -1 where the text is outside every room
+        room_of = self.layout.rooms_for_points(centers)
+
+        for (_, text, _), room_idx in zip(results, room_of):
+            metadata = self.text2metadata(text)
+            if room_idx >= 0:
+                self.layout.rooms[room_idx].add_metadata(metadata)
+            else:
+                self.layout.metadata.append(metadata)
+
+    def room_regions(self, width: int, height: int, padding: int = OCR_REGION_PADDING) -> list[tuple[int, int, int, int]]:
+        # Union of the padded room bounding boxes, as a list of
+        # non overlapping (x0, y0, x1, y1) crops clipped to the image
+        if not self.layout.rooms:
+            return []
+
+        bounds = shapely.bounds(np.array([room.polygon for room in self.layout.rooms], dtype=object))
+        bounds += np.array([-padding, -padding, padding, padding])
+        boxes = shapely.box(*bounds.T)
+
+        # merging boxes can make their bounds overlap a neighbour, repeat until stable
+        while True:
+            merged = shapely.get_parts(shapely.union_all(boxes))
+            merged_boxes = shapely.box(*shapely.bounds(merged).T)
+            if len(merged_boxes) == len(boxes):
+                break
+            boxes = merged_boxes
+
+        regions = []
+        for x0, y0, x1, y1 in shapely.bounds(merged_boxes):
+            x0, y0 = max(int(x0), 0), max(int(y0), 0)
+            x1, y1 = min(int(np.ceil(x1)), width), min(int(np.ceil(y1)), height)
+            if x1 > x0 and y1 > y0:
+                regions.append((x0, y0, x1, y1))
+        return regions
+
+    def read_regions(self, image: np.ndarray, regions: list[tuple[int, int, int, int]], blank: list = ()) -> list:
+        # Run EasyOCR on every crop in one batched call and map the boxes back to image coordinates
+        # parts of the crops inside the `blank` regions are whited out
+        if not regions:
+            return []
+
+        # readtext_batched needs equally sized inputs, so pad every crop (anchored at the top left,
+        # to keep offsets simple) with white paper. padding all of them to the biggest crop could make
+        # a wide and a tall region cost more than the whole sheet, instead crops are rounded up to
+        # `OCR_CANVAS_STEP` and only crops of the same rounded size are read together
+        def canvas(x0, y0, x1, y1) -> tuple[int, int]:
+            return -(-(y1 - y0) // OCR_CANVAS_STEP) * OCR_CANVAS_STEP, -(-(x1 - x0) // OCR_CANVAS_STEP) * OCR_CANVAS_STEP
+
+        groups = defaultdict(list)
+        for i, region in enumerate(regions):
+            groups[canvas(*region)].append(i)
+
+        read = [None] * len(regions)
+        for (canvas_h, canvas_w), indices in groups.items():
+            crops = []
+            for x0, y0, x1, y1 in (regions[i] for i in indices):
+                crop = np.full((canvas_h, canvas_w, 3), 255, dtype=np.uint8)
+                crop[:y1 - y0, :x1 - x0] = image[y0:y1, x0:x1]
+                for bx0, by0, bx1, by1 in blank:
+                    if bx0 < x1 and bx1 > x0 and by0 < y1 and by1 > y0:
+                        crop[max(by0 - y0, 0):by1 - y0, max(bx0 - x0, 0):bx1 - x0] = 255
+                crops.append(crop)
+
+            for i, crop_results in zip(indices, self.reader.readtext_batched(crops, batch_size=OCR_BATCH_SIZE)):
+                read[i] = crop_results
+
+        results = []
+        for (x0, y0, _, _), crop_results in zip(regions, read):
+            for bbox, text, conf in crop_results:
+                bbox = [[x + x0, y + y0] for x, y in bbox]
+                results.append((bbox, text, conf))
+        return results
+
+    def read_tiled(self, image: np.ndarray, blank: list = ()) -> list:
+        # Read the sheet in overlapping tiles, `OCR_BATCH_SIZE` at a time so only
+        # that many padded tiles are in memory, and merge the text found twice
+        height, width = image.shape[:2]
+        tiles = tile_grid(width, height, OCR_TILE_SIZE, OCR_TILE_OVERLAP)
+
+        results = []
+        with span('ocr.read_tiled', tiles=len(tiles)) as s:
+            for batch in batched(tiles, OCR_BATCH_SIZE):
+                results += self.read_regions(image, batch, blank)
+
+            if results:
+                # text in the overlaps is read twice, and a line cut by a tile edge shows up as a fragment
+                corners = np.asarray([bbox for bbox, _, _ in results], dtype=float)
+                rects = np.column_stack([corners.min(axis=1), corners.max(axis=1)])
+                texts = [text for _, text, _ in results]
+                keep = merge_detections(
+                    rects, [conf for _, _, conf in results], iou_threshold=OCR_MERGE_IOU, tiles=tiles,
+                    # a box inside a bigger one is only a cut off piece of it if the text says so too
+                    related=lambda i, j: _text_fragment(texts[i], texts[j]),
+                )
+                s.set(raw_text_boxes=len(results), text_boxes=len(keep))
+                results = [results[i] for i in keep]
+
+        return results
+
+    def readtext(self, image: np.ndarray, tiled: bool = None) -> list:
+        # Whole sheet pass, tiled if the sheet is too big to read in one go
+        if tiled is None:
+            tiled = should_tile(image, OCR_TILING, OCR_TILE_SIZE)
+        if tiled:
+            return self.read_tiled(image)
+        with span('ocr.readtext'):
+            return self.reader.readtext(image)
+
+    def read_outside_regions(self, image: np.ndarray, regions: list[tuple[int, int, int, int]], tiled: bool = None) -> list:
+        # Full page pass for layout level text, with the room regions blanked
+        # out since they were already read. Whatever is found here belongs to the layout
+        if tiled is None:
+            tiled = should_tile(image, OCR_TILING, OCR_TILE_SIZE)
+        if tiled:
+            # blanked per tile, instead of in a copy of the whole sheet
+            return self.read_tiled(image, blank=regions)
+
+        masked = image.copy()
+        for x0, y0, x1, y1 in regions:
+            masked[y0:y1, x0:x1] = 255
+        return self.reader.readtext(masked)
+
+    # This function extracts text with bounding boxes from the image
+    # `tiled` forces tiled reading on or off, by default it follows OCR_TILING
+    def read(self, mode: str = None, layout_text: bool = None, tiled: bool = None) -> list:
+        mode = mode if mode is not None else OCR_MODE
+        _check_mode(mode)
+        layout_text = layout_text if layout_text is not None else OCR_LAYOUT_TEXT
+
         # Extract text with bounding boxes from image
-        image = cv2.cvtColor(np.array(self.image_pil), cv2.COLOR_RGB2BGR)
+        image = as_bgr(self.image)
 
         # Perform OCR
-        results = self.reader.readtext(image)
-        for bbox, text, _ in results:
-            # To calculate the center of the bounding box
-            center = shapely.centroid(shapely.Polygon(bbox))
-            # Track whether this text was included in any room
-            included = False
-            for room in self.layout.rooms:
-                # Create a polygon for each room
-                if room.polygon.contains(center):
-                    if self.isDimension(text):
-                        width, height = self.parse_dimension_text(text)
-                        room.metadata.append(Dimension(width, height))
-                    else:
-                        room.metadata.append(Label(text))
-                    included = True
-                    break
-            if not included:
-                if self.isDimension(text):
-                    width, height = self.parse_dimension_text(text)
-                    self.layout.metadata.append(Dimension(width, height))
-                else:
-                    self.layout.metadata.append(Label(text))
+        if mode == 'rooms':
+            height, width = image.shape[:2]
+            regions = self.room_regions(width, height)
+            with span('ocr.read_regions', regions=len(regions)):
+                results = self.read_regions(image, regions)
+            if layout_text:
+                with span('ocr.read_outside_regions'):
+                    results += self.read_outside_regions(image, regions, tiled)
+        else:
+            results = self.readtext(image, tiled)
+
+        return results
+
+    # This function extracts text with bounding boxes from the image 
+    # and fill room objects with their labels and dimensions 
+    def ocrProcess(self, mode: str = None, layout_text: bool = None, tiled: bool = None) :
+        self.assign_text(self.read(mode, layout_text, tiled))
                     
 
 def create_test_layout():
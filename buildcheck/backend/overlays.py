@@ -0,0 +1,97 @@
+"""
+Validation overlays, rendered when first requested instead of during validation.
+
+An overlay is a function of the saved layout (see `layout_io.py`), the
+blueprint and the overlay style, so it is cached under the hash of the three.
+Its ETag hashes the paths, mtimes and sizes of the two files instead, so a
+browser that already has the overlay gets a 304 without either being read.
+"""
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional
+from .blueprints import bp_name2path, bp_name2layoutpath, OVERLAY_FORMAT
+from .cache import DiskCache, content_hash
+from .images import decode_image
+from .layout_io import parse_layout
+from .singleflight import SingleFlight
+from .tracing import span
+from .visualizer import FloorPlanVisualizer, VISUALIZER_RENDERER, VISUALIZER_MAX_SIDE, VISUALIZER_QUALITY, VISUALIZER_MAX_KB
+
+
+# bump whenever a change to the visualizer changes what an overlay looks like
+OVERLAY_STYLE_VERSION = '1'
+OVERLAY_MEDIA_TYPES = {'png': 'image/png', 'webp': 'image/webp', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg'}
+
+_overlays = DiskCache('overlays')
+_flights = SingleFlight()
+# pyplot keeps global state, only one matplotlib render at a time
+_render_lock = threading.Lock()
+
+
+def overlay_style() -> str:
+    return '-'.join(map(str, (
+        OVERLAY_STYLE_VERSION, VISUALIZER_RENDERER, OVERLAY_FORMAT,
+        VISUALIZER_MAX_SIDE, VISUALIZER_QUALITY, VISUALIZER_MAX_KB,
+    )))
+
+
+def _overlay_key(layout_bytes: bytes, image_bytes: bytes) -> str:
+    return content_hash(content_hash(layout_bytes), content_hash(image_bytes), overlay_style())
+
+
+def _file_version(path: Path) -> str:
+    # both files are only ever replaced as a whole, a new write changes the mtime
+    stat = path.stat()
+    return f'{path}:{stat.st_mtime_ns}:{stat.st_size}'
+
+
+def overlay_etag(file_name: str, employee_id: int) -> Optional[str]:
+    """ETag of the overlay of a blueprint, None if it was not validated yet"""
+    layout_path = bp_name2layoutpath(file_name, employee_id)
+    try:
+        return content_hash(
+            _file_version(layout_path), _file_version(bp_name2path(file_name, employee_id)), overlay_style()
+        )
+    except FileNotFoundError:
+        return None
+
+
+def _render(layout_bytes: bytes, image_bytes: bytes, image_path: Path) -> bytes:
+    layout = parse_layout(layout_bytes)
+    image = decode_image(image_bytes)
+    with tempfile.TemporaryDirectory(prefix='buildcheck-overlay-') as tmp:
+        path = Path(tmp) / f'overlay.{OVERLAY_FORMAT}'
+        with _render_lock:
+            FloorPlanVisualizer(str(image_path), layout, image=image).visualize(str(path))
+        return path.read_bytes()
+
+
+def get_overlay(file_name: str, employee_id: int) -> Optional[tuple[str, bytes]]:
+    """
+    (etag, image bytes) of the overlay of a blueprint, rendered on first request.
+    None if the blueprint was not validated yet.
+    """
+    etag = overlay_etag(file_name, employee_id)
+    if etag is None:
+        return None
+    image_path = bp_name2path(file_name, employee_id)
+    layout_bytes = bp_name2layoutpath(file_name, employee_id).read_bytes()
+    image_bytes = image_path.read_bytes()
+    key = _overlay_key(layout_bytes, image_bytes)
+
+    data = _overlays.get(key)
+    if data is None:
+        def render() -> bytes:
+            with span('overlay.render', file_name=file_name):
+                rendered = _render(layout_bytes, image_bytes, image_path)
+            _overlays.put(key, rendered)
+            return rendered
+
+        # the same overlay asked for twice at once is rendered once
+        data = _flights.do(key, render)
+    return etag, data
+
+
+def media_type() -> str:
+    return OVERLAY_MEDIA_TYPES.get(OVERLAY_FORMAT, 'application/octet-stream')
@@ -0,0 +1,129 @@
+import json
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, Union
+from .cache import DiskCache, content_hash
+from .tracing import span
+
+
+def _json_encode(value) -> bytes:
+    return json.dumps(value).encode('utf-8')
+
+
+def _json_decode(data: bytes):
+    return json.loads(data)
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    One step of a pipeline.
+
+    `fn` is called with the outputs of the `inputs` stages (or sources), in order.
+    `version` is the code/model version of the stage, bump it (or derive it from
+    the model weights) whenever the stage would produce different output.
+    Stages with `cache=True` have their output stored under a hash of their name,
+    version and the keys of their inputs, so they only rerun when one of those changes.
+    """
+    name: str
+    inputs: tuple[str, ...]
+    fn: Callable[..., Any]
+    version: Union[str, Callable[[], str]] = '1'
+    cache: bool = True
+    encode: Callable[[Any], bytes] = _json_encode
+    decode: Callable[[bytes], Any] = _json_decode
+
+    def get_version(self) -> str:
+        return self.version() if callable(self.version) else self.version
+
+
+class Pipeline:
+    """
+    A DAG of `Stage`s with memoized, content addressed stage outputs.
+
+    Sources are the values fed into the pipeline from outside (e.g. the image bytes),
+    each with a key identifying its content. A stage's key only depends on the keys
+    upstream of it, so a cached stage can be loaded without computing (or even
+    loading) any of its inputs.
+    """
+
+    def __init__(self, stages: list[Stage], store: DiskCache):
+        self.stages = {stage.name: stage for stage in stages}
+        self.store = store
+
+        # catch typos and cycles up front
+        for stage in stages:
+            self._check(stage.name, ())
+
+    def _check(self, name: str, path: tuple[str, ...]):
+        if name in path:
+            raise ValueError(f"pipeline has a cycle: {' -> '.join(path + (name,))}")
+        stage = self.stages.get(name)
+        if stage is None:
+            return  # a source
+        for input_name in stage.inputs:
+            self._check(input_name, path + (name,))
+
+    def run(self, sources: dict[str, Any], source_keys: dict[str, str], targets: list[str]) -> 'PipelineRun':
+        # compute (or load) `targets` and everything they need, see `PipelineRun.values`
+        run = PipelineRun(self, sources, source_keys)
+        for target in targets:
+            run.get(target)
+        return run
+
+
+class PipelineRun:
+    def __init__(self, pipeline: Pipeline, sources: dict[str, Any], source_keys: dict[str, str]):
+        self.pipeline = pipeline
+        self.values = dict(sources)
+        self.keys = dict(source_keys)
+        # which stages were computed and which were loaded from the cache
+        self.hits: list[str] = []
+        self.misses: list[str] = []
+        # seconds spent in each stage itself (loading or computing), not in its inputs
+        self.timings: dict[str, float] = {}
+
+    def key(self, name: str) -> str:
+        if name not in self.keys:
+            stage = self.pipeline.stages.get(name)
+            if stage is None:
+                raise KeyError(f"unknown source or stage {name!r}")
+            input_keys = [self.key(input_name) for input_name in stage.inputs]
+            self.keys[name] = content_hash(name, stage.get_version(), *input_keys)
+        return self.keys[name]
+
+    def _load(self, stage: Stage) -> Optional[Any]:
+        data = self.pipeline.store.get(self.key(stage.name))
+        return stage.decode(data) if data is not None else None
+
+    def compute(self, stage: Stage) -> Any:
+        args = [self.get(input_name) for input_name in stage.inputs]
+        with span(f'stage.{stage.name}') as s:
+            value = stage.fn(*args)
+        self.timings[stage.name] = s.wall_seconds
+        return value
+
+    def get(self, name: str) -> Any:
+        if name in self.values:
+            return self.values[name]
+
+        stage = self.pipeline.stages.get(name)
+        if stage is None:
+            raise KeyError(f"unknown source or stage {name!r}")
+
+        value = None
+        if stage.cache:
+            with span('cache.load', stage=name) as s:
+                value = self._load(stage)
+                s.set(hit=value is not None)
+
+        if value is not None:
+            self.timings[name] = s.wall_seconds
+            self.hits.append(name)
+        else:
+            value = self.compute(stage)
+            self.misses.append(name)
+            if stage.cache:
+                self.pipeline.store.put(self.key(name), stage.encode(value))
+
+        self.values[name] = value
+        return value
@@ -1,54 +1,166 @@
 import os
 import sys
+import time
+import threading
 import requests
+import cv2
+import numpy as np
 from PIL import Image
 from pathlib import Path
-from .blueprints import bp_name2image, bp_name2r2g
+from .images import decode_image, rgb_view
+from .r2g_transport import R2GTransport, R2GUnavailable
 from dotenv import load_dotenv
 from io import BytesIO
 import base64
 from json import JSONDecodeError
 from .vectorization import Room
+from .tracing import span
 from pprint import pprint
-import json
 
 
 DEBUG = True
 
 load_dotenv()
 
-def _get_r2g_url() -> str:
-	R2G_PORT=8080
-	response = requests.get("https://rest.runpod.io/v1/pods", headers={"Authorization": f"Bearer {os.getenv('RUNPOD_KEY')}"})
-	r = response.json()[0]
-	return f'https://{r['id']}-{R2G_PORT}.proxy.runpod.net'
+R2G_PORT = 8080
+# how long a discovered endpoint is trusted before we look it up (and health check it) again
+R2G_URL_TTL = float(os.getenv('R2G_URL_TTL', '300'))
+R2G_HEALTH_PATH = os.getenv('R2G_HEALTH_PATH', '/')
 
-R2G_API = _get_r2g_url()
 
+def _discover_r2g_url() -> str:
+	# R2G_API_URL points at a fixed server, e.g. a local stand-in during development
+	override = os.getenv('R2G_API_URL')
+	if override:
+		return override.rstrip('/')
 
-if DEBUG:
-	print(f'R2G_API is {R2G_API}')
+	try:
+		response = requests.get(
+			"https://rest.runpod.io/v1/pods",
+			headers={"Authorization": f"Bearer {os.getenv('RUNPOD_KEY')}"},
+			timeout=10,
+		)
+		response.raise_for_status()
+		pods = response.json()
+	except (requests.RequestException, JSONDecodeError) as e:
+		raise R2GUnavailable(f"could not list runpod pods: {e}") from e
 
+	# prefer a pod that is actually up, the list also has stopped/exited ones
+	running = [pod for pod in pods if pod.get('desiredStatus') == 'RUNNING']
+	pods = running or pods
+	if not pods:
+		raise R2GUnavailable("no runpod pods found. check if runpod container is running")
 
+	return f'https://{pods[0]['id']}-{R2G_PORT}.proxy.runpod.net'
 
 
-# TODO need to pull this directly from the runpod or better yet use endpoint
-#      right now, this changes every time we destroy the pod which is somewhat often
-# R2G_API = 'https://s71nx5jaqrdy09-8080.proxy.runpod.net'
+def _is_healthy(url: str) -> bool:
+	try:
+		res = requests.get(f'{url}{R2G_HEALTH_PATH}', timeout=5)
+	except requests.RequestException:
+		return False
+	# the runpod proxy answers 404 for a pod that is gone, only a 2xx is R2G itself
+	return 200 <= res.status_code < 300
+
+
+_r2g_url = None
+_r2g_url_resolved_at = 0.0
+_r2g_url_lock = threading.Lock()
+
+
+def get_r2g_url(refresh: bool = False) -> str:
+	"""
+	The R2G endpoint, resolved lazily on first use and cached for R2G_URL_TTL seconds.
+	Pass `refresh=True` to look it up again, e.g. after the pod was replaced.
+	"""
+	global _r2g_url, _r2g_url_resolved_at
+
+	with _r2g_url_lock:
+		expired = time.monotonic() - _r2g_url_resolved_at > R2G_URL_TTL
+		if refresh or _r2g_url is None or expired:
+			try:
+				url = _discover_r2g_url()
+			except R2GUnavailable as e:
+				if refresh or _r2g_url is None:
+					raise
+				# the runpod api being down says nothing about the pod, keep using the one we know
+				print(f'R2G discovery failed, keeping {_r2g_url}: {e}')
+				_r2g_url_resolved_at = time.monotonic()
+				return _r2g_url
+
+			if not _is_healthy(url):
+				_r2g_url = None
+				raise R2GUnavailable(f"R2G at {url} is not responding")
+
+			if DEBUG and url != _r2g_url:
+				print(f'R2G_API is {url}')
+
+			_r2g_url = url
+			_r2g_url_resolved_at = time.monotonic()
+
+		return _r2g_url
+
+
+# bump when the model behind R2G changes, so cached results are not reused
+R2G_MODEL_VERSION = os.getenv('R2G_MODEL_VERSION', 'r2g-1')
+
+# pooled connections to R2G
+transport = R2GTransport(get_r2g_url)
+
+
+
+
+# R2G works on 512x512 inputs, anything bigger only costs upload time
+R2G_INPUT_SIZE = 512
+# 'json' embeds the (downscaled) png base64 encoded, 'multipart' sends it as a file.
+# json until the R2G server that accepts multipart uploads is deployed
+R2G_UPLOAD = os.getenv('R2G_UPLOAD', 'json')
+
+
+def _downscale(image: np.ndarray) -> tuple[Image, float]:
+	# shrink the decoded (BGR) blueprint so the longest side is R2G_INPUT_SIZE,
+	# returns the (RGB) image to upload and the scale we used
+	height, width = image.shape[:2]
+	scale = min(1.0, R2G_INPUT_SIZE / max(width, height))
+	if scale < 1.0:
+		size = (max(1, round(width * scale)), max(1, round(height * scale)))
+		image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+	# only the small image gets its channels swapped (and copied)
+	return Image.fromarray(np.ascontiguousarray(rgb_view(image))), scale
+
+
+def _img2png(img: Image) -> bytes:
+	img_buf = BytesIO()
+	img.save(img_buf, format="PNG", optimize=True)
+	return img_buf.getvalue()
+
 
 def _img2b64(img: Image) -> str:
 	# https://jdhao.github.io/2020/03/17/base64_opencv_pil_image_conversion/
-	img_buf = BytesIO()
-	img.save(img_buf, format="PNG")
-	img_bytes = img_buf.getvalue()
-	img_b64 = base64.b64encode(img_bytes).decode('utf-8')
+	img_b64 = base64.b64encode(_img2png(img)).decode('utf-8')
 
 	return img_b64
 
 
+def _upload_request(image: np.ndarray) -> tuple[dict, float]:
+	# build the kwargs for the /vectorize post, and the scale the client applied
+	img, client_scale = _downscale(image)
+
+	if R2G_UPLOAD == 'json':
+		request = {"json": {"input": _img2b64(img)}}
+	else:
+		request = {"files": {"image": ("blueprint.png", _img2png(img), "image/png")}}
+
+	if DEBUG:
+		print(f'uploading {img.size} image to r2g ({client_scale=:.3f})')
+
+	return request, client_scale
+
+
 def unscale_point(x: int, y: int, scale_factor: float):
 	# N.B. scale_factor is what was used to shrink coords to 512x512
-	#      which is what we get.
+	#      which is what we get. it is R2G's own scale_factor times
+	#      the scale we downsized the image with before uploading it.
 	#      i.e. scaled = (x,y) * scale_factor
 	#      so we must multiply by scale_factor^-1 to undo it
 	#      e.g. unscaled = scaled * scale_factor^-1
@@ -60,42 +172,34 @@ def unscale_point(x: int, y: int, scale_factor: float):
 def unscale_room(juncts: list, scale_factor: float) -> list:
 	return list(map(lambda p: unscale_point(*p, scale_factor), juncts))
 
-def vectorize(file_name: str, employee_id: int) -> list[Room]:
-	r2g_cached = bp_name2r2g(file_name, employee_id)
-	payload = None
-
-
-	if not r2g_cached.exists():
-		print(f'no cached result for {employee_id=} {file_name=}')
-		print('calling r2g')
-		img = bp_name2image(file_name, employee_id)
-		img_b64 = _img2b64(img)
-		res = requests.post(f'{R2G_API}/vectorize', json={"input": img_b64})
-
-		try:
-			payload = res.json()
-		except JSONDecodeError as e:
-			print(e)
-			raise Exception("error calling vectorize. check if runpod container is running")
-	else:
-		print(f'found cached result for {employee_id=} {file_name=}')
-		with open(r2g_cached, 'r', encoding='utf-8') as f:
-			payload = json.load(f)
+def _parse_response(res) -> dict:
+	try:
+		return res.json()
+	except (JSONDecodeError, ValueError) as e:
+		print(e)
+		raise R2GUnavailable("error calling vectorize. check if runpod container is running")
+
+def request_vectorize(image: np.ndarray) -> dict:
+	# call R2G on the decoded blueprint. the validation pipeline caches the result
+	request, client_scale = _upload_request(image)
+	with span('r2g.request') as s:
+		res = transport.post('/vectorize', **request)
+		payload = _parse_response(res)
+		s.set(rooms=len(payload.get("rooms") or []))
 
 	# TODO we need to experiment and handle what happens when r2g fails
-	# right now rooms is just null
+	# right now rooms is just null. raising keeps it out of the cache
+	if not payload.get("rooms"):
+		raise R2GUnavailable("R2G returned no rooms")
+
+	payload["client_scale"] = client_scale
+	return payload
 
+def payload2rooms(payload: dict) -> list[Room]:
 	# extract rooms from payload
 	rooms_raw = payload["rooms"]
-	scale_factor = payload["scale_factor"]
-
-	if rooms_raw and not r2g_cached.exists():
-		# if r2g worked fine and we have detected rooms
-		# we'll save this json to reuse later
-		with open(r2g_cached, 'w', encoding='utf-8') as f:
-		    json.dump(payload, f, ensure_ascii=False, indent=4)
-
-		print(f'finished writing to cache {employee_id=} {file_name=}')
+	# results cached before we downscaled on the client have no client_scale
+	scale_factor = payload["scale_factor"] * payload.get("client_scale", 1.0)
 
 	# discard semantic for now, keeping only junction points
 	room_polys_raw = list(map(lambda d: d['room_junctions'], rooms_raw))
@@ -142,7 +246,8 @@ def vectorize(file_name: str, employee_id: int) -> list[Room]:
 
 if __name__ == '__main__':
 	print('starting')
-	vec = vectorize(file_name, employee_id)
+	# usage: python -m buildcheck.backend.r2g_client <blueprint image>
+	vec = payload2rooms(request_vectorize(decode_image(Path(sys.argv[1]).read_bytes())))
 	print("vec result")
 	pprint(vec)
 
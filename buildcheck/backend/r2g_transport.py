@@ -0,0 +1,134 @@
+import os
+import time
+import random
+import threading
+from typing import Callable
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+R2G_CONNECT_TIMEOUT = float(os.getenv('R2G_CONNECT_TIMEOUT', '5'))
+# vectorizing a big plan on a cold pod can take a while, but not forever
+R2G_READ_TIMEOUT = float(os.getenv('R2G_READ_TIMEOUT', '120'))
+R2G_MAX_RETRIES = int(os.getenv('R2G_MAX_RETRIES', '3'))
+R2G_BACKOFF = 0.5  # seconds, doubled on every retry
+R2G_POOL_SIZE = int(os.getenv('R2G_POOL_SIZE', '4'))
+
+# the breaker opens after this many failed calls in a row
+# and lets a single trial call through after the cooldown
+R2G_BREAKER_THRESHOLD = int(os.getenv('R2G_BREAKER_THRESHOLD', '5'))
+R2G_BREAKER_COOLDOWN = float(os.getenv('R2G_BREAKER_COOLDOWN', '30'))
+
+
+class R2GUnavailable(Exception):
+	pass
+
+
+class CircuitOpen(R2GUnavailable):
+	pass
+
+
+class CircuitBreaker:
+	def __init__(self, threshold: int = R2G_BREAKER_THRESHOLD, cooldown: float = R2G_BREAKER_COOLDOWN):
+		self.threshold = threshold
+		self.cooldown = cooldown
+		self.failures = 0
+		self.opened_at = None
+		# when the half open trial call started, None if there is none in flight
+		self.trial_started_at = None
+		self._lock = threading.Lock()
+
+	def before_call(self):
+		with self._lock:
+			if self.opened_at is None:
+				return
+			now = time.monotonic()
+			remaining = self.cooldown - (now - self.opened_at)
+			if remaining > 0:
+				raise CircuitOpen(f"R2G is down, not retrying for another {remaining:.0f}s")
+			# half open: a single trial call goes through, everyone else waits for its outcome.
+			# a trial that never reported back (e.g. an unexpected error) is replaced after a cooldown
+			if self.trial_started_at is not None and now - self.trial_started_at < self.cooldown:
+				raise CircuitOpen("R2G is down, a trial call is in progress")
+			self.trial_started_at = now
+
+	def record_success(self):
+		with self._lock:
+			self.failures = 0
+			self.opened_at = None
+			self.trial_started_at = None
+
+	def record_failure(self):
+		with self._lock:
+			self.failures += 1
+			if self.trial_started_at is not None or self.failures >= self.threshold:
+				# a failed trial re-opens the breaker for another cooldown
+				self.opened_at = time.monotonic()
+			self.trial_started_at = None
+
+
+def _should_retry(status_code: int) -> bool:
+	# 404 is what the runpod proxy answers for a pod that no longer exists
+	return status_code >= 500 or status_code == 404
+
+
+def _backoff(attempt: int) -> float:
+	# exponential with a bit of jitter so workers don't retry in lockstep
+	return R2G_BACKOFF * (2 ** attempt) * (0.5 + random.random())
+
+
+class R2GTransport:
+	"""
+	Pooled keep-alive session to R2G with timeouts, retries and a circuit breaker.
+
+	`resolve_url(refresh)` gives the base url, it is called with `refresh=True`
+	when retrying so that a replaced pod is picked up.
+	"""
+
+	def __init__(self, resolve_url: Callable[[bool], str], breaker: CircuitBreaker = None):
+		self.resolve_url = resolve_url
+		self.breaker = breaker if breaker is not None else CircuitBreaker()
+		self.timeout = (R2G_CONNECT_TIMEOUT, R2G_READ_TIMEOUT)
+		self._session = None
+		self._session_lock = threading.Lock()
+
+	@property
+	def session(self) -> requests.Session:
+		with self._session_lock:
+			if self._session is None:
+				session = requests.Session()
+				adapter = HTTPAdapter(pool_connections=1, pool_maxsize=R2G_POOL_SIZE)
+				session.mount('https://', adapter)
+				session.mount('http://', adapter)
+				self._session = session
+			return self._session
+
+	def post(self, path: str, **kwargs) -> requests.Response:
+		self.breaker.before_call()
+
+		last_error = None
+		for attempt in range(R2G_MAX_RETRIES + 1):
+			if attempt:
+				time.sleep(_backoff(attempt - 1))
+
+			try:
+				url = self.resolve_url(attempt > 0)
+				res = self.session.post(f'{url}{path}', timeout=self.timeout, **kwargs)
+			except (R2GUnavailable, requests.ConnectionError) as e:
+				last_error = e
+				continue
+			except requests.Timeout as e:
+				# a hung pod, retrying would just hang again
+				last_error = e
+				break
+
+			if not _should_retry(res.status_code):
+				self.breaker.record_success()
+				return res
+			last_error = f'HTTP {res.status_code}'
+
+		self.breaker.record_failure()
+		raise R2GUnavailable(f"calling R2G {path} failed: {last_error}")
@@ -0,0 +1,95 @@
+"""
+Rules-only re-validation.
+
+Re-runs the current rule set (`rule_engine.ajyal_guidelines`) against the
+layouts saved by `run_validation`, without touching R2G, YOLO or OCR.
+Use it after changing a rule's thresholds or adding a rule:
+
+    python -m buildcheck.backend.revalidate            # every case
+    python -m buildcheck.backend.revalidate 12 15 17   # just these cases
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+from .blueprints import bp_name2layoutpath
+from .layout_io import load_layout
+from .rule_engine import validate_ajyal
+from .vectorization import Layout
+from .violations import _chunks, case_pages, read_violations, write_violations_bulk
+
+
+# cases handled (and written back) per round trip to the db
+REVALIDATE_BATCH_SIZE = 500
+# loading layouts is file io + arrow decoding, which both release the gil
+REVALIDATE_LOAD_THREADS = 8
+
+
+@dataclass
+class RevalidateSummary:
+    checked: int = 0
+    changed: int = 0
+    # cases that were never validated (or predate saved layouts), they need a full run
+    missing: list[int] = field(default_factory=list)
+    seconds: float = 0.0
+
+
+def revalidate_layout(layout: Layout) -> list[int]:
+    return [f.guideline.value for f in validate_ajyal(layout)]
+
+
+def _load_case_layout(case: dict) -> Optional[Layout]:
+    path = bp_name2layoutpath(case["blueprint_path"], case["submitter_id"])
+    if not path.exists():
+        return None
+    return load_layout(path)
+
+
+def _revalidate_batch(batch: list[dict], pool: ThreadPoolExecutor, summary: RevalidateSummary, dry_run: bool):
+    results = {}
+    for case, layout in zip(batch, pool.map(_load_case_layout, batch)):
+        if layout is None:
+            summary.missing.append(case["id"])
+            continue
+        results[case["id"]] = revalidate_layout(layout)
+    summary.checked += len(results)
+
+    current = read_violations(list(results))
+    changed = {
+        case_id: codes for case_id, codes in results.items()
+        if sorted(codes) != sorted(current[case_id])
+    }
+    summary.changed += len(changed)
+    if changed and not dry_run:
+        write_violations_bulk(changed)
+
+
+def revalidate_cases(case_ids: list[int] = None, batch_size: int = REVALIDATE_BATCH_SIZE, dry_run: bool = False) -> RevalidateSummary:
+    """
+    Re-check the saved layouts of `case_ids` (or every case) against the current rules.
+    Only cases whose violations actually changed are written back, in bulk.
+    """
+    start = time.perf_counter()
+    summary = RevalidateSummary()
+
+    with ThreadPoolExecutor(REVALIDATE_LOAD_THREADS) as pool:
+        for page in case_pages("id, submitter_id, blueprint_path", case_ids):
+            cases = [case for case in page if case["blueprint_path"]]
+            for batch in _chunks(cases, batch_size):
+                _revalidate_batch(batch, pool, summary, dry_run)
+
+    summary.seconds = time.perf_counter() - start
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="re-run the rules against the saved layouts")
+    parser.add_argument('case_ids', nargs='*', type=int, help="cases to re-check, defaults to all of them")
+    parser.add_argument('--dry-run', action='store_true', help="report what would change without writing it")
+    args = parser.parse_args()
+
+    summary = revalidate_cases(args.case_ids or None, dry_run=args.dry_run)
+    print(f'checked {summary.checked} cases in {summary.seconds:.2f}s, {summary.changed} changed')
+    if summary.missing:
+        print(f'{len(summary.missing)} cases have no saved layout and need a full validation: {summary.missing}')
@@ -95,7 +95,7 @@ def rule_every_room_has_dimension(layout: Layout) -> Verdict:
 	failures = []
 
 	def has_dim(room):
-		return any(isinstance(meta, Dimension) for meta in room.metadata)
+		return len(room.dims) > 0
 
 	for room in layout.rooms:
 		if not has_dim(room):
@@ -198,7 +198,7 @@ if __name__ == '__main__':
 
 	# create room with door by cloning and adding a symbol
 	room_basic_door = deepcopy(room_basic_nodoor)
-	room_basic_door.symbols.append(door_within_bounds)
+	room_basic_door.add_symbol(door_within_bounds)
 
 
 	# create layouts
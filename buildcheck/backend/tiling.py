@@ -0,0 +1,183 @@
+"""
+Helpers for running the models on big sheets in overlapping tiles.
+
+A sheet is cut into `tile`-sized windows overlapping by `overlap` pixels, so
+anything up to `overlap` pixels across is seen whole by at least one tile.
+Detections from every tile are moved back to sheet coordinates and merged:
+duplicates are removed with NMS, and fragments of an object cut by a tile edge
+are dropped when a bigger detection of the same object contains them. Only
+boxes that end at a seam (a tile edge inside the sheet) can be fragments.
+"""
+from typing import Callable, Iterator
+import numpy as np
+
+
+# px, how close to a tile edge a box has to end to count as cut by it
+SEAM_TOLERANCE = 4
+# 'auto' tiles sheets more than two tiles long
+TILING_MODES = ('auto', 'on', 'off')
+
+
+def _check_mode(mode: str):
+    # a typo would silently turn tiling off
+    if mode not in TILING_MODES:
+        raise ValueError(f"unknown tiling mode {mode!r}, expected one of {TILING_MODES}")
+
+
+def _check_overlap(tile: int, overlap: int):
+    # an overlap as big as the tile never moves on to the next tile
+    if not 0 <= overlap < tile:
+        raise ValueError(f"tile overlap must be at least 0 and less than the tile size, got {overlap=} {tile=}")
+
+
+def check_tiling(mode: str, tile: int, overlap: int):
+    # for the processors' settings at import, rather than on the first big sheet
+    _check_mode(mode)
+    _check_overlap(tile, overlap)
+
+
+def tile_grid(width: int, height: int, tile: int, overlap: int) -> list[tuple[int, int, int, int]]:
+    # (x0, y0, x1, y1) windows covering the sheet, the last row/column is flush with the edge
+    _check_overlap(tile, overlap)
+
+    def starts(length: int) -> list[int]:
+        if length <= tile:
+            return [0]
+        stride = tile - overlap
+        positions = list(range(0, length - tile, stride))
+        positions.append(length - tile)
+        return positions
+
+    return [
+        (x, y, min(x + tile, width), min(y + tile, height))
+        for y in starts(height)
+        for x in starts(width)
+    ]
+
+
+def should_tile(image: np.ndarray, mode: str, tile: int) -> bool:
+    # `mode` is one of `TILING_MODES`
+    _check_mode(mode)
+    if mode == 'auto':
+        return max(image.shape[:2]) > 2 * tile
+    return mode == 'on'
+
+
+def batched(items: list, size: int) -> Iterator[list]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _areas(boxes: np.ndarray) -> np.ndarray:
+    return np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+
+
+def _intersections(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    w = np.clip(np.minimum(box[2], boxes[:, 2]) - np.maximum(box[0], boxes[:, 0]), 0, None)
+    h = np.clip(np.minimum(box[3], boxes[:, 3]) - np.maximum(box[1], boxes[:, 1]), 0, None)
+    return w * h
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float = 0.5) -> np.ndarray:
+    """
+    Greedy non-maximum suppression of (n, 4) xyxy `boxes`.
+    Returns the indices of the boxes to keep, best first.
+    """
+    order = np.argsort(-scores, kind='stable')
+    areas = _areas(boxes)
+    keep = []
+    while len(order):
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        inter = _intersections(boxes[best], boxes[rest])
+        iou = inter / np.maximum(areas[best] + areas[rest] - inter, 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.intp)
+
+
+def at_seam(boxes: np.ndarray, tiles: list[tuple[int, int, int, int]], tolerance: float = SEAM_TOLERANCE) -> np.ndarray:
+    """
+    Which of the (n, 4) `boxes` end at a seam of a tile they lie in, i.e. at
+    an edge of that tile that is not also the edge of the sheet. Only those
+    can be pieces of an object the tile cut off.
+    """
+    boxes = np.asarray(boxes, dtype=float).reshape(-1, 1, 4)
+    tiles = np.asarray(tiles, dtype=float).reshape(1, -1, 4)
+    if not boxes.size or not tiles.size:
+        return np.zeros(len(boxes), dtype=bool)
+
+    inside = (
+        (boxes[..., 0] >= tiles[..., 0] - tolerance) & (boxes[..., 1] >= tiles[..., 1] - tolerance)
+        & (boxes[..., 2] <= tiles[..., 2] + tolerance) & (boxes[..., 3] <= tiles[..., 3] + tolerance)
+    )
+    # tile edges on the outline of the sheet are not seams
+    sheet_x0, sheet_y0 = tiles[..., 0].min(), tiles[..., 1].min()
+    sheet_x1, sheet_y1 = tiles[..., 2].max(), tiles[..., 3].max()
+    touches = (
+        ((tiles[..., 0] > sheet_x0) & (boxes[..., 0] <= tiles[..., 0] + tolerance))
+        | ((tiles[..., 1] > sheet_y0) & (boxes[..., 1] <= tiles[..., 1] + tolerance))
+        | ((tiles[..., 2] < sheet_x1) & (boxes[..., 2] >= tiles[..., 2] - tolerance))
+        | ((tiles[..., 3] < sheet_y1) & (boxes[..., 3] >= tiles[..., 3] - tolerance))
+    )
+    return (inside & touches).any(axis=1)
+
+
+def drop_fragments(
+    boxes: np.ndarray,
+    containment_threshold: float = 0.8,
+    cut: np.ndarray = None,
+    related: Callable[[int, int], bool] = None,
+) -> np.ndarray:
+    """
+    Indices of the boxes that are not (mostly) inside a bigger box,
+    i.e. drops the pieces of an object that a tile edge cut off.
+
+    Only boxes flagged in `cut` (see `at_seam`) are candidates, all of them if
+    it is None. `related(i, j)`, if given, must also agree that box i is a piece
+    of the bigger box j, e.g. that their texts match.
+    """
+    areas = _areas(boxes)
+    keep = []
+    for i in range(len(boxes)):
+        if cut is None or cut[i]:
+            bigger = np.flatnonzero(areas > areas[i])
+            inside = _intersections(boxes[i], boxes[bigger]) / max(areas[i], 1e-9)
+            containers = bigger[inside > containment_threshold]
+            if any(related is None or related(i, j) for j in containers):
+                continue
+        keep.append(i)
+    return np.array(keep, dtype=np.intp)
+
+
+def merge_detections(
+    boxes: np.ndarray,
+    scores: np.ndarray,
+    classes: np.ndarray = None,
+    iou_threshold: float = 0.5,
+    containment_threshold: float = 0.8,
+    tiles: list[tuple[int, int, int, int]] = None,
+    related: Callable[[int, int], bool] = None,
+) -> np.ndarray:
+    """
+    NMS + fragment removal over the detections of all tiles, per class if
+    `classes` is given. Returns the indices of the detections to keep.
+
+    Fragments are only looked for among boxes at a seam of `tiles`, without
+    tiles nothing was cut and only NMS runs. `related(i, j)` is passed on to
+    `drop_fragments`, with indices into `boxes`.
+    """
+    boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=float)
+    if classes is None:
+        classes = np.zeros(len(boxes), dtype=int)
+    cut = at_seam(boxes, tiles) if tiles is not None else np.zeros(len(boxes), dtype=bool)
+
+    keep = []
+    for clazz in np.unique(classes):
+        idx = np.flatnonzero(classes == clazz)
+        idx = idx[nms(boxes[idx], scores[idx], iou_threshold)]
+        related_here = (lambda i, j, idx=idx: related(idx[i], idx[j])) if related is not None else None
+        idx = idx[drop_fragments(boxes[idx], containment_threshold, cut[idx], related_here)]
+        keep.append(idx)
+
+    return np.sort(np.concatenate(keep)) if keep else np.array([], dtype=np.intp)
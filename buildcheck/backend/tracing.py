@@ -0,0 +1,283 @@
+"""
+Lightweight spans for the validation pipeline.
+
+    with span('yolo.predict') as s:
+        ...
+        s.set(detections=len(symbols))
+
+Every finished span records its wall time, CPU time and the process' peak RSS,
+plus whatever counts were attached to it. Finished spans are
+
+- appended as JSON lines to `BUILDCHECK_TRACE_FILE` (if set), which every
+  worker process can share, and
+- aggregated into per span latency histograms in this process, exported in
+  the prometheus text format by `export_prometheus()`.
+
+The pipeline runs in worker processes, so the app's own histograms miss most
+spans. With `BUILDCHECK_TRACE_FILE` set, the app's `/metrics` route (see
+`api.py`) follows the trace file with a `TraceFileFollower` and serves the
+histograms of every process. `python -m buildcheck.backend.tracing trace.jsonl`
+prints the histograms of a trace file.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import resource
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Optional
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+TRACE_FILE = os.getenv('BUILDCHECK_TRACE_FILE')
+
+# upper bounds (seconds) of the latency histogram buckets, the last one catches the rest
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, float('inf'))
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start: float  # unix time
+    attrs: dict = field(default_factory=dict)
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    peak_rss_mb: float = 0.0
+    # how much this span raised the process' peak rss, i.e. roughly what it allocated on top
+    peak_rss_growth_mb: float = 0.0
+    error: Optional[str] = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def record(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "wall_seconds": self.wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "peak_rss_mb": self.peak_rss_mb,
+            "peak_rss_growth_mb": self.peak_rss_growth_mb,
+            "error": self.error,
+            "pid": os.getpid(),
+            **self.attrs,
+        }
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        # upper bound of the bucket the q-th observation falls in
+        rank = q * self.count
+        seen = 0
+        for upper, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank and n:
+                return upper
+        return 0.0
+
+
+_current: ContextVar[Optional[Span]] = ContextVar('current_span', default=None)
+_histograms: dict[str, Histogram] = {}
+_histograms_lock = threading.Lock()
+_sinks: list[Callable[[dict], None]] = []
+_trace_file_lock = threading.Lock()
+
+
+def _write_trace_file(record: dict):
+    line = json.dumps(record, default=str) + '\n'
+    # one short write on an O_APPEND fd, so lines from several processes don't interleave
+    with _trace_file_lock:
+        fd = os.open(TRACE_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode('utf-8'))
+        finally:
+            os.close(fd)
+
+
+def add_sink(sink: Callable[[dict], None]):
+    # `sink` is called with the record of every finished span
+    _sinks.append(sink)
+
+
+def remove_sink(sink: Callable[[dict], None]):
+    _sinks.remove(sink)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def annotate(**attributes):
+    # set attributes on the current span, a no-op when called outside of one
+    s = _current.get()
+    if s is not None:
+        s.set(**attributes)
+
+
+def _emit(s: Span):
+    with _histograms_lock:
+        _histograms.setdefault(s.name, Histogram()).observe(s.wall_seconds)
+
+    record = s.record()
+    if TRACE_FILE:
+        _write_trace_file(record)
+    for sink in _sinks:
+        sink(record)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    parent = _current.get()
+    s = Span(
+        name=name,
+        trace_id=parent.trace_id if parent is not None else uuid.uuid4().hex,
+        span_id=uuid.uuid4().hex[:16],
+        parent_id=parent.span_id if parent is not None else None,
+        start=time.time(),
+        attrs=attrs,
+    )
+    token = _current.set(s)
+
+    rss_before = _peak_rss_mb()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        s.wall_seconds = time.perf_counter() - wall
+        s.cpu_seconds = time.process_time() - cpu
+        s.peak_rss_mb = _peak_rss_mb()
+        s.peak_rss_growth_mb = s.peak_rss_mb - rss_before
+        _current.reset(token)
+        _emit(s)
+
+
+def histograms() -> dict[str, Histogram]:
+    with _histograms_lock:
+        return dict(_histograms)
+
+
+def aggregate(records: Iterable[dict]) -> dict[str, Histogram]:
+    # histograms of spans recorded elsewhere, e.g. a trace file written by the workers
+    result = {}
+    for record in records:
+        result.setdefault(record["name"], Histogram()).observe(record["wall_seconds"])
+    return result
+
+
+def read_trace_file(path: str) -> Iterable[dict]:
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class TraceFileFollower:
+    """
+    Histograms of the spans in a trace file, kept up to date by reading only
+    what was appended since the last `update()`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offset = 0
+        self.histograms: dict[str, Histogram] = {}
+        self.lock = threading.Lock()
+
+    def update(self) -> dict[str, Histogram]:
+        with self.lock:
+            try:
+                size = os.path.getsize(self.path)
+            except FileNotFoundError:
+                size = 0
+            if size < self.offset:
+                # truncated or rotated, start over
+                self.offset, self.histograms = 0, {}
+
+            if size > self.offset:
+                with open(self.path, 'rb') as f:
+                    f.seek(self.offset)
+                    data = f.read(size - self.offset)
+                # a line still being written is picked up next time
+                complete = data[:data.rfind(b'\n') + 1]
+                self.offset += len(complete)
+                for line in complete.splitlines():
+                    if line.strip():
+                        record = json.loads(line)
+                        self.histograms.setdefault(record["name"], Histogram()).observe(record["wall_seconds"])
+            return dict(self.histograms)
+
+
+def export_prometheus(hists: dict[str, Histogram] = None) -> str:
+    hists = hists if hists is not None else histograms()
+    lines = [
+        '# HELP buildcheck_span_seconds Wall time of validation pipeline spans.',
+        '# TYPE buildcheck_span_seconds histogram',
+    ]
+    for name, hist in sorted(hists.items()):
+        cumulative = 0
+        for upper, n in zip(hist.buckets, hist.counts):
+            cumulative += n
+            le = '+Inf' if upper == float('inf') else repr(float(upper))
+            lines.append(f'buildcheck_span_seconds_bucket{{span="{name}",le="{le}"}} {cumulative}')
+        lines.append(f'buildcheck_span_seconds_sum{{span="{name}"}} {hist.sum}')
+        lines.append(f'buildcheck_span_seconds_count{{span="{name}"}} {hist.count}')
+    return '\n'.join(lines) + '\n'
+
+
+def format_histograms(hists: dict[str, Histogram]) -> str:
+    lines = [f'{"span":<24}{"count":>8}{"mean":>10}{"p50<=":>10}{"p90<=":>10}{"p99<=":>10}']
+    for name, hist in sorted(hists.items()):
+        mean = hist.sum / hist.count if hist.count else 0.0
+        p50, p90, p99 = (hist.quantile(q) for q in (0.5, 0.9, 0.99))
+        lines.append(f'{name:<24}{hist.count:>8}{mean:>10.3f}{p50:>10g}{p90:>10g}{p99:>10g}')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="summarize a trace file")
+    parser.add_argument('trace_file', nargs='?', default=TRACE_FILE)
+    parser.add_argument('--prometheus', action='store_true', help="print in the prometheus text format")
+    args = parser.parse_args()
+    if not args.trace_file:
+        parser.error("no trace file given and BUILDCHECK_TRACE_FILE is not set")
+
+    hists = aggregate(read_trace_file(args.trace_file))
+    print(export_prometheus(hists) if args.prometheus else format_histograms(hists))
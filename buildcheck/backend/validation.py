@@ -1,13 +1,122 @@
-from PIL import Image
+import numpy as np
 from .vectorization import *
 from pathlib import Path
 from .blueprints import *
-from .r2g_client import vectorize
+from .r2g_client import request_vectorize, payload2rooms, R2G_MODEL_VERSION
 from .rule_engine import validate_ajyal, Failure
 from pprint import pprint
-from .yolo_processor import YOLOProcessor, YOLO_MODEL_PATH
-from .ocr_processor import OCRProcessor
+from .yolo_processor import YOLOProcessor, YOLO_MODEL_PATH, YOLO_TILING, YOLO_TILE_SIZE, YOLO_TILE_OVERLAP
+from .ocr_processor import OCRProcessor, OCR_MODE, OCR_LAYOUT_TEXT, OCR_TILING, OCR_TILE_SIZE, OCR_TILE_OVERLAP
 from .visualizer import FloorPlanVisualizer
+from .models import yolo_version, ocr_version
+from .pipeline import Pipeline, PipelineRun, Stage
+from .cache import DiskCache, content_hash
+from .images import decode_image
+from .layout_io import save_layout
+from .tracing import span, annotate
+
+
+YOLO_CONFIDENCE = 0.25
+INTERSECTION_THRESHOLD = 0.05
+
+
+#
+# MARK - Stages
+#
+# every stage's output is json (or not cached at all) so the artifacts
+# can be shared between processes and survive restarts
+
+
+def _decode_image(image_bytes: bytes) -> np.ndarray:
+    # decoded once, every other stage works on (views of) this buffer
+    image = decode_image(image_bytes)
+    annotate(width=image.shape[1], height=image.shape[0], megabytes=image.nbytes / 2**20)
+    return image
+
+
+def _detect(image: np.ndarray) -> list:
+    # [category, minx, miny, maxx, maxy] for every detection
+    symbols = YOLOProcessor(image, YOLO_MODEL_PATH, Layout()).detect(YOLO_CONFIDENCE)
+    annotate(detections=len(symbols))
+    return [[symbol.category.value, *symbol.bounds] for symbol in symbols]
+
+
+def _read_text(image: np.ndarray, r2g_payload: dict = None) -> list:
+    # in 'rooms' mode the OCR only looks inside the rooms R2G found
+    rooms = payload2rooms(r2g_payload) if r2g_payload is not None else []
+    results = OCRProcessor(image, Layout(rooms=rooms)).read()
+    annotate(text_boxes=len(results))
+    return [
+        [[[float(x), float(y)] for x, y in bbox], str(text), float(conf)]
+        for bbox, text, conf in results
+    ]
+
+
+def _build_layout(r2g_payload: dict, detections: list, text: list, file_name: str) -> Layout:
+    layout = Layout(rooms=payload2rooms(r2g_payload), file_name=file_name)
+
+    # assign symbols to the rooms
+    symbols = [Symbol.from_bounds(Category(category), bounds) for category, *bounds in detections]
+    processor_yolo = YOLOProcessor(None, YOLO_MODEL_PATH, layout)
+    with span('yolo.assign_symbols', symbols=len(symbols), rooms=len(layout.rooms)):
+        processor_yolo.assign_symbols(symbols, INTERSECTION_THRESHOLD)  # TODO see if we want 2.5
+    processor_yolo.print_room_summary()
+
+    # assign text to the rooms
+    with span('ocr.assign_text', text_boxes=len(text), rooms=len(layout.rooms)):
+        OCRProcessor(None, layout).assign_text(text)
+    for room in layout.rooms:
+        print(f"\n{room.name}")
+
+    return layout
+
+
+def _visualize(layout: Layout, image: np.ndarray, image_path: str, output_path: str) -> str:
+    visualizer = FloorPlanVisualizer(image_path, layout, image=image)
+    visualizer.visualize(output_path)
+    return output_path
+
+
+validation_pipeline = Pipeline(
+    [
+        Stage('image', ('image_bytes',), _decode_image, cache=False),
+        Stage('r2g', ('image',), request_vectorize, version=R2G_MODEL_VERSION),
+        Stage('detections', ('image',), _detect,
+              version=lambda: f'{yolo_version(YOLO_MODEL_PATH)}-conf{YOLO_CONFIDENCE}'
+                              f'-tiles-{YOLO_TILING}-{YOLO_TILE_SIZE}-{YOLO_TILE_OVERLAP}'),
+        Stage('text', ('image', 'r2g') if OCR_MODE == 'rooms' else ('image',), _read_text,
+              version=lambda: f'{ocr_version()}-{OCR_MODE}-{OCR_LAYOUT_TEXT}'
+                              f'-tiles-{OCR_TILING}-{OCR_TILE_SIZE}-{OCR_TILE_OVERLAP}'),
+        # cheap python from here on, always recomputed
+        Stage('layout', ('r2g', 'detections', 'text', 'file_name'), _build_layout, cache=False),
+        Stage('failures', ('layout',), validate_ajyal, cache=False),
+        Stage('overlay', ('layout', 'image', 'image_path', 'output_path'), _visualize, cache=False),
+    ],
+    store=DiskCache('artifacts'),
+)
+
+
+def validate_image(image_path: Path, output_path: Path = None) -> PipelineRun:
+    """
+    Run `validation_pipeline` on the blueprint at `image_path`, rendering the
+    overlay to `output_path` if one is given. Stages whose inputs did not change
+    are loaded from the cache.
+    """
+    image_bytes = Path(image_path).read_bytes()
+    sources = {
+        'image_bytes': image_bytes,
+        'file_name': Path(image_path).name,
+        'image_path': str(image_path),
+        'output_path': str(output_path),
+    }
+    source_keys = dict(sources, image_bytes=content_hash(image_bytes))
+    targets = ['failures', 'overlay'] if output_path is not None else ['failures']
+
+    with span('validation', file_name=sources['file_name']) as s:
+        run = validation_pipeline.run(sources, source_keys, targets)
+        s.set(cache_hits=len(run.hits), failures=len(run.values['failures']))
+    print(f'pipeline cache hits={run.hits} misses={run.misses}')
+    return run
 
 
 def run_validation(file_name: str, employee_id: int) -> list[Failure]:
@@ -17,32 +126,18 @@ def run_validation(file_name: str, employee_id: int) -> list[Failure]:
     - run yolo
     - run ocr
     - run rules
-    """
-    image = bp_name2image(file_name, employee_id)
-
-    # call r2g on image
-    rooms = vectorize(file_name, employee_id)
-    layout = Layout(rooms=rooms, file_name=file_name)
 
-    # run yolo on layout
-    processor_yolo = YOLOProcessor(image, YOLO_MODEL_PATH, layout)
-    processor_yolo.yoloProcesser()  # TODO see if we want 2.5
-    processor_yolo.print_room_summary()
-
-    # run OCR on the layout
-    processor_ocr = OCRProcessor(image, layout)
-    processor_ocr.ocrProcess()
-    for room in layout.rooms:
-        print(f"\n{room.name}")
-
-    # run rules checking engine on layout
-    failures = validate_ajyal(layout)
+    see `validation_pipeline`. The overlay is not rendered here,
+    but when it is first requested, see `overlays.py`
+    """
     image_path = bp_name2path(file_name, employee_id)
-    output_path = bp_name2vispath(file_name, employee_id)
-    visualizer = FloorPlanVisualizer(image_path, layout)
-    visualizer.visualize(str(output_path))
+    run = validate_image(image_path)
+
+    # keep the full layout around so the rules can be re-checked without the models,
+    # and the overlay can be rendered from it
+    save_layout(run.values['layout'], bp_name2layoutpath(file_name, employee_id))
 
-    return failures
+    return run.values['failures']
 
 if __name__ == '__main__':
     # assuming we have `uploaded_files/user_2/2d-floor-plan.jpg` exists
@@ -50,4 +145,4 @@ if __name__ == '__main__':
     failures = run_validation('2d-floor-plan.jpg', 2)
 
 
-    pprint(failures)
\ No newline at end of file
+    pprint(failures)
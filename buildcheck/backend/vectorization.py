@@ -1,6 +1,10 @@
+from array import array
 from dataclasses import dataclass
 from enum import Enum
 from typing import Union
+import numpy as np
+import shapely
+from shapely import STRtree
 from shapely.geometry import Polygon
 
 
@@ -26,22 +30,65 @@ class Category(Enum):
 
 
 # Represents a floor plan symbol such as a window, door, etc. 
-@dataclass(frozen=True)
 class Symbol:
-    category: Category
-    bbox: Polygon
+    """
+    Detections are axis aligned, so the bbox is kept as its 4 bounds in a float32
+    array; the shapely polygon is only built when something asks for `bbox`.
+    """
+    __slots__ = ('category', 'quad', '_bbox')
 
-    def __post_init__(self):
-        if not is_4_point_polygon(self.bbox):
-            raise ValueError(f"bbox failed 4pt test {self.bbox=}")
+    def __init__(self, category: Category, bbox: Polygon):
+        if not is_4_point_polygon(bbox):
+            raise ValueError(f"bbox failed 4pt test {bbox=}")
+        self.category = category
+        self.quad = array('f', bbox.bounds)  # minx, miny, maxx, maxy
+        self._bbox = None
+
+    @classmethod
+    def from_bounds(cls, category: Category, bounds) -> 'Symbol':
+        # skips the 4 point test, an xyxy box always passes it
+        symbol = object.__new__(cls)
+        symbol.category = category
+        symbol.quad = array('f', bounds)
+        symbol._bbox = None
+        return symbol
+
+    @property
+    def bounds(self) -> tuple[float, float, float, float]:
+        return tuple(self.quad)
+
+    @property
+    def bbox(self) -> Polygon:
+        if self._bbox is None:
+            self._bbox = shapely.box(*self.quad)
+        return self._bbox
+
+    def __eq__(self, other):
+        if not isinstance(other, Symbol):
+            return NotImplemented
+        return self.category == other.category and self.quad == other.quad
+
+    def __hash__(self):
+        return hash((self.category, self.bounds))
+
+    def __repr__(self):
+        return f"Symbol(category={self.category}, bounds={self.bounds})"
+
+
+def symbol_boxes(symbols: list[Symbol]) -> np.ndarray:
+    # the bboxes of many symbols in one vectorized call
+    if not symbols:
+        return np.empty(0, dtype=object)
+    quads = np.frombuffer(b''.join(symbol.quad.tobytes() for symbol in symbols), dtype=np.float32).reshape(-1, 4)
+    return shapely.box(quads[:, 0], quads[:, 1], quads[:, 2], quads[:, 3])
 
 
 # Metadata Definitions
-@dataclass
+@dataclass(slots=True)
 class Label:
     text: str
 #A class that represents the width and height of a room recovered from the OCR process
-@dataclass
+@dataclass(slots=True)
 class Dimension:
     width: float
     height: float
@@ -49,6 +96,8 @@ class Dimension:
 Metadata = Union[Label, Dimension]
 
 class Room:
+    __slots__ = ('polygon', 'symbol_ids', 'labels', 'dims', '_layout', '_own_symbols')
+
     def __init__(
         self,
         polygon: Polygon,  
@@ -56,8 +105,17 @@ class Room:
         metadata: list[Metadata] = None,
     ):
         self.polygon = polygon
-        self.symbols = symbols if symbols is not None else []  # NEW LIST!
-        self.metadata = metadata if metadata is not None else []
+        # ids into the symbol table of the layout the room is in, see `Layout.add_symbol`
+        self.symbol_ids = array('i')
+        # metadata by type, kept up to date by `add_metadata` so rules don't filter on every read
+        self.labels: list[Label] = []
+        self.dims: list[Dimension] = []
+        self._layout = None
+        self._own_symbols = []  # table of a room that is not in a layout (yet)
+        for symbol in symbols or []:
+            self.add_symbol(symbol)
+        for data in metadata or []:
+            self.add_metadata(data)
 
     @classmethod
     def from_junctions(cls, junctions):
@@ -68,16 +126,32 @@ class Room:
         return cls(polygon)
 
     @property
-    def name(self) -> str:
-        name = ""
-        for data in self.metadata:
-            if isinstance(data, Label):
-                name += " " + data.text
-        return name
+    def symbols(self) -> tuple[Symbol, ...]:
+        # read only, add symbols with `add_symbol`
+        table = self._layout.symbols if self._layout is not None else self._own_symbols
+        return tuple(table[i] for i in self.symbol_ids)
+
+    def add_symbol(self, symbol: Symbol) -> int:
+        if self._layout is not None:
+            return self._layout.add_symbol(symbol, [self])
+        self._own_symbols.append(symbol)
+        self.symbol_ids.append(len(self._own_symbols) - 1)
+        return self.symbol_ids[-1]
+
+    def add_metadata(self, data: Metadata):
+        if isinstance(data, Label):
+            self.labels.append(data)
+        else:
+            self.dims.append(data)
+
+    @property
+    def metadata(self) -> tuple[Metadata, ...]:
+        # read only, add metadata with `add_metadata`
+        return (*self.labels, *self.dims)
 
     @property
-    def dims(self) -> list[Dimension]:
-        return list(filter(lambda m: isinstance(m, Dimension), self.metadata))
+    def name(self) -> str:
+        return "".join(" " + label.text for label in self.labels)
 
 
     def __repr__(self):
@@ -87,11 +161,102 @@ class Room:
         )
 
 class Layout:
+    __slots__ = (
+        'symbols', '_symbol_rooms', 'rooms', 'metadata', 'file_name',
+        '_indexed_rooms', '_room_polygons', '_room_index',
+    )
+
     def __init__(self, rooms: list[Room] = None, metadata: list[Metadata] = None, file_name: str = None):
-        self.rooms = rooms if rooms is not None else []
+        # symbol table, a symbol's id is its index. a symbol in several rooms is stored once
+        self.symbols: list[Symbol] = []
+        # symbol id -> the rooms it is in, the inverse of `Room.symbol_ids`
+        self._symbol_rooms: list[list[Room]] = []
+        self.rooms = []
         self.metadata = metadata if metadata is not None else []
         self.file_name = file_name
+        self._indexed_rooms = None
+        self._room_polygons = None
+        self._room_index = None
+        for room in rooms or []:
+            self.add_room(room)
 
     def add_room(self, room: Room):
+        if room._layout is not None:
+            raise ValueError("room is already in a layout")
+        # the room's symbols move to this layout's table
+        symbols = room.symbols
+        room.symbol_ids, room._own_symbols, room._layout = array('i'), [], self
         self.rooms.append(room)
+        for symbol in symbols:
+            self.add_symbol(symbol, [room])
+
+    def add_symbol(self, symbol: Symbol, rooms: list[Room] = ()) -> int:
+        """Add `symbol` to the symbol table and to each of `rooms`, returns its id"""
+        symbol_id = len(self.symbols)
+        self.symbols.append(symbol)
+        self._symbol_rooms.append([])
+        for room in rooms:
+            self.link(symbol_id, room)
+        return symbol_id
+
+    def link(self, symbol_id: int, room: Room):
+        # put a symbol that is already in the table in one more room
+        room.symbol_ids.append(symbol_id)
+        self._symbol_rooms[symbol_id].append(room)
+
+    def rooms_of(self, symbol_id: int) -> list[Room]:
+        return self._symbol_rooms[symbol_id]
+
+    def room_index(self) -> STRtree:
+        """
+        R-tree over the (prepared) room polygons. It is built on first use
+        and rebuilt only if the rooms changed since.
+        """
+        if self._room_index is None or self._indexed_rooms != self.rooms:
+            self._indexed_rooms = list(self.rooms)
+            self._room_polygons = np.array([room.polygon for room in self.rooms], dtype=object)
+            shapely.prepare(self._room_polygons)
+            self._room_index = STRtree(self._room_polygons)
+        return self._room_index
+
+    def rooms_for_boxes(self, boxes: np.ndarray, intersection_threshold: float = 0.0) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Match all `boxes` against the rooms in one bulk query.
+
+        A box belongs to a room if the overlap covers at least `intersection_threshold`
+        of the box's area, so a box fully inside a room always matches.
+        Returns parallel (box index, room index) arrays sorted by box then room.
+        """
+        boxes = np.asarray(boxes, dtype=object)
+        tree = self.room_index()
+        box_idx, room_idx = tree.query(boxes, predicate='intersects')
+
+        if intersection_threshold > 0 and len(box_idx):
+            overlap = shapely.area(shapely.intersection(boxes[box_idx], self._room_polygons[room_idx]))
+            box_area = shapely.area(boxes[box_idx])
+            # degenerate (zero area) boxes that touch a room count as inside it
+            ratio = np.divide(overlap, box_area, out=np.ones_like(overlap), where=box_area > 0)
+            keep = ratio >= intersection_threshold
+            box_idx, room_idx = box_idx[keep], room_idx[keep]
+
+        order = np.lexsort((room_idx, box_idx))
+        return box_idx[order], room_idx[order]
+
+    def rooms_for_points(self, points: np.ndarray) -> np.ndarray:
+        """
+        Find the room containing each of the (n, 2) `points` in one vectorized pass.
+        Returns the index of the first such room for every point, or -1 if there is none.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if not len(points) or not self.rooms:
+            return np.full(len(points), -1, dtype=np.intp)
+
+        tree = self.room_index()
+        point_idx, room_idx = tree.query(shapely.points(points), predicate='within')
+
+        # a point may sit inside overlapping rooms, keep the first room like a linear scan would
+        room_of = np.full(len(points), len(self.rooms), dtype=np.intp)
+        np.minimum.at(room_of, point_idx, room_idx)
+        room_of[room_of == len(self.rooms)] = -1
+        return room_of
     
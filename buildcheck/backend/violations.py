@@ -0,0 +1,130 @@
+from enum import Enum
+from typing import Iterator
+from buildcheck.backend.supabase_client import supabase_client
+
+
+class AIDecision(Enum):
+    APPROVED = "approved"
+    REJECTED = "rejected"
+
+
+def write_violations(case_id: int, failure_codes: list[int]):
+    # we need to overwrite all previous violations,
+    # to prevent stale violations
+
+    # unfortunately supabase-py does not support atomic transactions
+
+
+    # delete all current violations for this case
+    (supabase_client.table("violations")
+        .delete()
+        .eq("case_id", case_id)
+        .execute()
+    )
+
+
+    # insert all the violations for current case
+    if failure_codes:
+        (supabase_client.table("violations")
+            .insert([
+                {
+                    "case_id": case_id,
+                    "guideline_code": code
+                } for code in failure_codes
+            ])
+            .execute()
+        )
+
+    # update the cases ai_descision
+    ai_decision = AIDecision.REJECTED.value if failure_codes else AIDecision.APPROVED.value
+    (supabase_client.table("cases")
+        .update({"ai_decision": ai_decision})
+        .eq("id", case_id)
+        .execute()
+    )
+
+
+# supabase/postgrest puts `in` filters in the url, keep them reasonably short
+BULK_CHUNK_SIZE = 200
+
+
+def _chunks(items: list, size: int = BULK_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+# postgrest caps every response (1000 rows by default), bigger reads go page by page
+PAGE_SIZE = 1000
+
+
+def case_pages(columns: str, case_ids: list[int] = None, page_size: int = PAGE_SIZE) -> Iterator[list[dict]]:
+    """
+    The `columns` (which must include id) of every case, or just of `case_ids`,
+    a page at a time in id order. Pages are keyed on the last id seen, so rows
+    are neither skipped nor repeated however small the server's row cap is.
+    """
+    for chunk in _chunks(case_ids) if case_ids else [None]:
+        last_id = None
+        while True:
+            query = supabase_client.table("cases").select(columns)
+            if chunk is not None:
+                query = query.in_("id", chunk)
+            if last_id is not None:
+                query = query.gt("id", last_id)
+            page = query.order("id").limit(page_size).execute().data
+            if not page:
+                break
+            yield page
+            last_id = page[-1]["id"]
+
+
+def read_violations(case_ids: list[int]) -> dict[int, list[int]]:
+    # current guideline codes of many cases, fetched a chunk at a time
+    violations = {case_id: [] for case_id in case_ids}
+    for chunk in _chunks(case_ids):
+        response = (supabase_client.table("violations")
+            .select("case_id, guideline_code")
+            .in_("case_id", chunk)
+            .execute()
+        )
+        for row in response.data:
+            violations[row["case_id"]].append(row["guideline_code"])
+    return violations
+
+
+def write_violations_bulk(results: dict[int, list[int]]):
+    """
+    `write_violations` for many cases at once, with a handful of requests
+    per chunk of cases instead of three per case.
+    """
+    case_ids = list(results)
+    for chunk in _chunks(case_ids):
+        (supabase_client.table("violations")
+            .delete()
+            .in_("case_id", chunk)
+            .execute()
+        )
+
+        rows = [
+            {
+                "case_id": case_id,
+                "guideline_code": code
+            } for case_id in chunk for code in results[case_id]
+        ]
+        if rows:
+            (supabase_client.table("violations")
+                .insert(rows)
+                .execute()
+            )
+
+        for decision in AIDecision:
+            decided = [
+                case_id for case_id in chunk
+                if (AIDecision.REJECTED if results[case_id] else AIDecision.APPROVED) == decision
+            ]
+            if decided:
+                (supabase_client.table("cases")
+                    .update({"ai_decision": decision.value})
+                    .in_("id", decided)
+                    .execute()
+                )
@@ -1,18 +1,136 @@
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from matplotlib.patches import Polygon as MplPolygon
+import os
 import cv2
-from typing import List, Tuple
+import numpy as np
+from pathlib import Path
+from typing import List, Optional, Tuple
 import colorsys
+from collections import defaultdict
+from dotenv import load_dotenv
 from buildcheck.backend.vectorization import *
+from buildcheck.backend.images import rgb_view
+
+
+load_dotenv()
+
+# 'matplotlib' renders the two panel 300dpi figure, 'raster' draws straight onto the plan
+VISUALIZER_RENDERER = os.getenv('VISUALIZER_RENDERER', 'matplotlib')
+# raster renderer only: longest side of the output in px, webp/jpeg quality,
+# and a size budget for the file (0 for none) that lowers quality, then resolution
+VISUALIZER_MAX_SIDE = int(os.getenv('VISUALIZER_MAX_SIDE', '2400'))
+VISUALIZER_QUALITY = int(os.getenv('VISUALIZER_QUALITY', '85'))
+VISUALIZER_MAX_KB = int(os.getenv('VISUALIZER_MAX_KB', '0'))
+MIN_QUALITY = 40
+
+# BGR versions of the matplotlib colors in `render_matplotlib`
+SYMBOL_COLORS_BGR = {
+    Category.DOOR: (0, 0, 255),
+    Category.WINDOW: (255, 0, 0),
+    Category.WALL: (42, 42, 165),
+    Category.COLUMN: (128, 128, 128),
+    Category.STAIR_CASE: (128, 0, 128),
+    Category.RAILING: (0, 165, 255),
+}
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+
+def encode_overlay(canvas: np.ndarray, suffix: str, quality: int = VISUALIZER_QUALITY, max_kb: int = VISUALIZER_MAX_KB) -> bytes:
+    """Encode a BGR image as png, webp or jpeg (by `suffix`), within `max_kb` if given"""
+    suffix = suffix.lower()
+    if suffix == '.png':
+        return cv2.imencode('.png', canvas, [cv2.IMWRITE_PNG_COMPRESSION, 3])[1].tobytes()
+
+    flag = cv2.IMWRITE_WEBP_QUALITY if suffix == '.webp' else cv2.IMWRITE_JPEG_QUALITY
+    while True:
+        data = cv2.imencode(suffix, canvas, [flag, quality])[1]
+        if not max_kb or data.nbytes <= max_kb * 1024 or max(canvas.shape[:2]) < 256:
+            return data.tobytes()
+        # too big, first give up quality, then resolution
+        if quality > MIN_QUALITY:
+            quality = max(quality - 10, MIN_QUALITY)
+        else:
+            canvas = cv2.resize(canvas, None, fx=0.75, fy=0.75, interpolation=cv2.INTER_AREA)
+
+
+# where a label may go relative to its anchor, at scale 1: rings of 12 directions,
+# nearer first, and on a ring above/below before the sides
+def _candidate_offsets(radii=(30, 50, 75, 105, 140), directions: int = 12) -> list[Tuple[float, float]]:
+    candidates = []
+    for radius in radii:
+        for k in range(directions):
+            angle = 2 * np.pi * k / directions
+            dx, dy = radius * np.sin(angle), -radius * np.cos(angle)  # k = 0 is straight above
+            # 0 on the vertical axis, 1 on the horizontal one
+            sideways = abs(dx) / radius
+            cost = radius * (1 + 0.5 * sideways) + (0.5 if dy > 0 else 0)
+            candidates.append((cost, float(dx), float(dy)))
+    return [(dx, dy) for _, dx, dy in sorted(candidates)]
+
+
+CANDIDATE_OFFSETS = _candidate_offsets()
+
+
+class LabelPlacer:
+    """
+    Places label boxes around their anchors so they don't overlap the labels
+    placed so far. Placed boxes are kept in a uniform grid, so a collision
+    check only looks at the labels in the few cells it touches instead of
+    every label, which keeps placement near linear in the number of labels.
+    """
+
+    def __init__(self, scale: float = 1.0, cell: float = 64, margin: float = 10):
+        self.scale = scale
+        self.cell = cell * scale
+        self.margin = margin * scale
+        self.offsets = [(dx * scale, dy * scale) for dx, dy in CANDIDATE_OFFSETS]
+        self.boxes: list[Tuple[float, float, float, float]] = []
+        self.grid: dict[Tuple[int, int], list[int]] = defaultdict(list)
+
+    def _cells(self, x0: float, y0: float, x1: float, y1: float):
+        for gx in range(int(x0 // self.cell), int(x1 // self.cell) + 1):
+            for gy in range(int(y0 // self.cell), int(y1 // self.cell) + 1):
+                yield gx, gy
+
+    def collides(self, x0: float, y0: float, x1: float, y1: float, margin: float = None) -> bool:
+        # closer than 2 * margin to a placed box, i.e. their margins overlap
+        gap = 2 * (self.margin if margin is None else margin * self.scale)
+        x0, y0, x1, y1 = x0 - gap, y0 - gap, x1 + gap, y1 + gap
+        for cell in self._cells(x0, y0, x1, y1):
+            for i in self.grid.get(cell, ()):
+                bx0, by0, bx1, by1 = self.boxes[i]
+                if x0 < bx1 and x1 > bx0 and y0 < by1 and y1 > by0:
+                    return True
+        return False
+
+    def add(self, x0: float, y0: float, x1: float, y1: float):
+        self.boxes.append((x0, y0, x1, y1))
+        for cell in self._cells(x0, y0, x1, y1):
+            self.grid[cell].append(len(self.boxes) - 1)
+
+    def place(self, center_x: float, center_y: float, width: float, height: float) -> Tuple[float, float]:
+        """Center of the cheapest free spot for a `width` x `height` label around the anchor"""
+        for dx, dy in self.offsets:
+            x, y = center_x + dx, center_y + dy
+            box = (x - width / 2, y - height / 2, x + width / 2, y + height / 2)
+            if not self.collides(*box):
+                self.add(*box)
+                return x, y
+
+        # nowhere free, default to above the anchor and accept the overlap
+        x, y = center_x, center_y - 30 * self.scale
+        self.add(x - width / 2, y - height / 2, x + width / 2, y + height / 2)
+        return x, y
+
 
 class FloorPlanVisualizer:
-    def __init__(self, image_path: str, layout: Layout):
+    def __init__(self, image_path: str, layout: Layout, image: np.ndarray = None):
         self.image_path = image_path
+        # the already decoded BGR blueprint, read from `image_path` if not given
+        self.image = image
         self.layout = layout
         self.room_colors = {}
         self.room_names = []
-        self.text_positions = []  # Track text positions for collision avoidance
+        # placed labels, for collision avoidance. set up by each renderer at its own scale
+        self.labels: Optional[LabelPlacer] = None
         
     def generate_distinct_colors(self, n: int) -> List[Tuple[float, float, float]]:
         """Generate n visually distinct colors"""
@@ -25,71 +143,138 @@ class FloorPlanVisualizer:
             colors.append(rgb)
         return colors
 
-    def find_symbol_room_connections(self, symbol: Symbol) -> List[str]:
-        connected_rooms = []
-        for room in self.layout.rooms:
-            if symbol in room.symbols:
-                connected_rooms.append(room.name)
-        return connected_rooms
+    def find_symbol_room_connections(self, symbol_id: int) -> List[str]:
+        return [room.name for room in self.layout.rooms_of(symbol_id)]
     
     def get_symbol_center(self, symbol: Symbol) -> Tuple[float, float]:
         """Get the center point of a symbol"""
-        center = symbol.bbox.centroid
-        return center.x, center.y
+        minx, miny, maxx, maxy = symbol.bounds
+        return (minx + maxx) / 2, (miny + maxy) / 2
     
     def check_text_collision(self, x: float, y: float, width: float, height: float, margin: float = 10) -> bool:
         """Check if a text box would collide with existing text positions"""
-        for pos_x, pos_y, pos_w, pos_h in self.text_positions:
-            if (x - margin < pos_x + pos_w + margin and 
-                x + width + margin > pos_x - margin and
-                y - margin < pos_y + pos_h + margin and 
-                y + height + margin > pos_y - margin):
-                return True
-        return False
-    
+        return self.labels.collides(x, y, x + width, y + height, margin)
+
     def find_best_text_position(self, center_x: float, center_y: float, text_width: float, text_height: float) -> Tuple[float, float]:
         """Find the best position for text around a center point to avoid collisions"""
-        # Try different positions around the center
-        offsets = [
-            (0, -30),      # Above
-            (0, 30),       # Below
-            (30, 0),       # Right
-            (-30, 0),      # Left
-            (25, -25),     # Top-right
-            (-25, -25),    # Top-left
-            (25, 25),      # Bottom-right
-            (-25, 25),     # Bottom-left
-            (0, -50),      # Further above
-            (0, 50),       # Further below
-            (50, 0),       # Further right
-            (-50, 0),      # Further left
-        ]
-        
-        for dx, dy in offsets:
-            test_x = center_x + dx - text_width/2
-            test_y = center_y + dy - text_height/2
-            
-            if not self.check_text_collision(test_x, test_y, text_width, text_height):
-                self.text_positions.append((test_x, test_y, text_width, text_height))
-                return center_x + dx, center_y + dy
-        
-        # If no good position found, use default and add to collision list anyway
-        final_x, final_y = center_x, center_y - 30
-        self.text_positions.append((final_x - text_width/2, final_y - text_height/2, text_width, text_height))
-        return final_x, final_y
-    
-    def get_text_dimensions(self, text: str, fontsize: int) -> Tuple[float, float]:
-        """Estimate text dimensions based on font size"""
-        # Rough estimation: width = chars * fontsize * 0.6, height = fontsize * 1.2
-        width = len(text) * fontsize * 0.6
-        height = fontsize * 1.2
-        return width, height
-    
-    def visualize(self, save_path: str, figsize=(16, 12), show_original=True):
+        return self.labels.place(center_x, center_y, text_width, text_height)
+
+    def get_text_dimensions(self, text: str, fontsize: int, bold: bool = True, pad: float = 0.3) -> Tuple[float, float]:
+        """Size of `text` in points as matplotlib draws it, including the padding of its box"""
+        from matplotlib.font_manager import FontProperties
+        from matplotlib.textpath import text_to_path
+
+        font = FontProperties(size=fontsize, weight='bold' if bold else 'normal')
+        width, height, _ = text_to_path.get_text_width_height_descent(text, font, ismath=False)
+        return width + 2 * pad * fontsize, height + 2 * pad * fontsize
+
+    @staticmethod
+    def _units_per_point(fig, ax) -> float:
+        # plan units per typographic point, to size text in the plan's coordinates
+        x0, x1 = ax.get_xlim()
+        y0, y1 = ax.get_ylim()
+        box = ax.get_position()
+        width_pt = box.width * fig.get_figwidth() * 72
+        height_pt = box.height * fig.get_figheight() * 72
+        # with an equal aspect the axis that needs more units per point sets the scale
+        return max(abs(x1 - x0) / width_pt, abs(y1 - y0) / height_pt)
+
+    def visualize(self, save_path: str, figsize=(16, 12), show_original=True, renderer: str = None):
         """Create a comprehensive visualization of the floor plan"""
-        
-        # Reset text positions for each visualization
-        self.text_positions = []
+        renderer = renderer or VISUALIZER_RENDERER
+        if renderer == 'raster':
+            self.render_raster(save_path)
+        else:
+            self.render_matplotlib(save_path, figsize, show_original)
+
+    def _draw_label(self, canvas: np.ndarray, text: str, center: Tuple[float, float], font_scale: float,
+                    background: Tuple[int, int, int], border: Tuple[int, int, int], leader: bool = False):
+        thickness = max(1, round(font_scale * 2))
+        (text_w, text_h), baseline = cv2.getTextSize(text, FONT, font_scale, thickness)
+        pad = max(2, text_h // 4)
+
+        x, y = self.find_best_text_position(*center, text_w + 2 * pad, text_h + baseline + 2 * pad)
+        x0, y0 = int(x - text_w / 2), int(y - (text_h + baseline) / 2)
+
+        if leader:
+            cv2.line(canvas, (int(center[0]), int(center[1])), (int(x), int(y)), border, thickness, cv2.LINE_AA)
+        cv2.rectangle(canvas, (x0 - pad, y0 - pad), (x0 + text_w + pad, y0 + text_h + baseline + pad), background, -1)
+        cv2.rectangle(canvas, (x0 - pad, y0 - pad), (x0 + text_w + pad, y0 + text_h + baseline + pad), border, 1)
+        cv2.putText(canvas, text, (x0, y0 + text_h), FONT, font_scale, (0, 0, 0), thickness, cv2.LINE_AA)
+
+    def render_raster(self, save_path: str, max_side: int = VISUALIZER_MAX_SIDE,
+                      quality: int = VISUALIZER_QUALITY, max_kb: int = VISUALIZER_MAX_KB):
+        """Draw rooms, symbols and labels straight onto the (downscaled) plan with OpenCV"""
+
+        image = self.image if self.image is not None else cv2.imread(self.image_path)
+        height, width = image.shape[:2]
+        scale = min(1.0, max_side / max(height, width))
+        # the only full size buffer we allocate, the decoded plan is shared and read-only
+        if scale < 1:
+            canvas = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+        else:
+            canvas = image.copy()
+
+        # line widths and fonts follow the output size, so small and huge sheets look alike
+        unit = max(canvas.shape[:2]) / 1000
+        line = max(1, round(2 * unit))
+        self.labels = LabelPlacer(scale=unit)
+
+        def points(polygon) -> np.ndarray:
+            return np.round(np.asarray(polygon.exterior.coords) * scale).astype(np.int32)
+
+        # translucent room fills, then their outlines
+        colors = self.generate_distinct_colors(len(self.layout.rooms))
+        fills = canvas.copy()
+        for room, (r, g, b) in zip(self.layout.rooms, colors):
+            self.room_colors[room.name] = (int(b * 255), int(g * 255), int(r * 255))
+            cv2.fillPoly(fills, [points(room.polygon)], self.room_colors[room.name])
+        cv2.addWeighted(fills, 0.25, canvas, 0.75, 0, dst=canvas)
+        del fills
+        cv2.polylines(canvas, [points(room.polygon) for room in self.layout.rooms], True, (0, 0, 0), line, cv2.LINE_AA)
+
+        # the layout's symbol table has every symbol once, even if it is in several rooms
+        symbols = self.layout.symbols
+        for symbol in symbols:
+            x0, y0, x1, y1 = np.round(np.asarray(symbol.bounds) * scale).astype(int)
+            cv2.rectangle(canvas, (x0, y0), (x1, y1), SYMBOL_COLORS_BGR.get(symbol.category, (0, 0, 0)), line)
+
+        # labels, rooms first so they get the best spots
+        for room in self.layout.rooms:
+            centroid = room.polygon.centroid
+            center = (centroid.x * scale, centroid.y * scale)
+            if room.name:
+                self._draw_label(canvas, room.name, center, 0.6 * unit, self.room_colors[room.name], (0, 0, 0))
+
+            dimensions = room.dims
+            if dimensions:
+                dim = dimensions[0]
+                below = (center[0], center[1] + 25 * unit)
+                self._draw_label(canvas, f"{dim.width}' x {dim.height}'", below, 0.5 * unit, (211, 211, 211), (128, 128, 128))
+
+        for symbol in symbols:
+            center = self.get_symbol_center(symbol)
+            self._draw_label(canvas, symbol.category.name.replace('_', ''), (center[0] * scale, center[1] * scale),
+                             0.4 * unit, (255, 255, 255), SYMBOL_COLORS_BGR.get(symbol.category, (0, 0, 0)), leader=True)
+
+        # legend of the symbol types present, top right
+        present = [category for category in SYMBOL_COLORS_BGR if any(s.category == category for s in symbols)]
+        row = round(22 * unit)
+        x = canvas.shape[1] - round(190 * unit)
+        for i, category in enumerate(present):
+            y = round(15 * unit) + i * row
+            cv2.rectangle(canvas, (x, y), (x + row // 2, y + row // 2), SYMBOL_COLORS_BGR[category], -1)
+            cv2.putText(canvas, category.name.replace('_', ' ').title(), (x + row, y + row // 2), FONT,
+                        0.5 * unit, (0, 0, 0), max(1, round(unit)), cv2.LINE_AA)
+
+        Path(save_path).write_bytes(encode_overlay(canvas, Path(save_path).suffix, quality, max_kb))
+
+    def render_matplotlib(self, save_path: str, figsize=(16, 12), show_original=True):
+        """Two panel matplotlib figure, the original plan with detections and the room layout"""
+        import matplotlib.pyplot as plt
+        import matplotlib.patches as patches
+        from matplotlib.patches import Polygon as MplPolygon
+
         # Define symbol colors
         symbol_colors = {
             Category.DOOR: 'red',
@@ -105,40 +290,34 @@ class FloorPlanVisualizer:
             fig, (ax1, ax2) = plt.subplots(1, 2, figsize=figsize)
             
             # Show original image
-            image = cv2.imread(self.image_path)
-            image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            image = self.image if self.image is not None else cv2.imread(self.image_path)
+            image_rgb = rgb_view(image)
             ax1.imshow(image_rgb)
             ax1.set_title("Original Floor Plan with Detections", fontsize=14, fontweight='bold')
             ax1.axis('off')
             
             # Draw symbol rectangles on original image
-            all_symbols_temp = []
-            for room in self.layout.rooms:
-                for symbol in room.symbols:
-                    if symbol not in all_symbols_temp:
-                        all_symbols_temp.append(symbol)
-                        
-                        bbox = symbol.bbox
-                        minx, miny, maxx, maxy = bbox.bounds
-                        
-                        rect = patches.Rectangle(
-                            (minx, miny),
-                            maxx - minx,
-                            maxy - miny,
-                            linewidth=3,
-                            edgecolor=symbol_colors.get(symbol.category, 'black'),
-                            facecolor='none',
-                            alpha=0.8
-                        )
-                        ax1.add_patch(rect)
-                        
-                        # Add simple label on original image
-                        center_x, center_y = (minx + maxx) / 2, (miny + maxy) / 2
-                        ax1.text(center_x, center_y - 15, symbol.category.name,
-                                ha='center', va='center', fontsize=8, fontweight='bold',
-                                bbox=dict(boxstyle="round,pad=0.2", 
-                                        facecolor=symbol_colors.get(symbol.category, 'white'), 
-                                        alpha=0.8))
+            for symbol in self.layout.symbols:
+                minx, miny, maxx, maxy = symbol.bounds
+                
+                rect = patches.Rectangle(
+                    (minx, miny),
+                    maxx - minx,
+                    maxy - miny,
+                    linewidth=3,
+                    edgecolor=symbol_colors.get(symbol.category, 'black'),
+                    facecolor='none',
+                    alpha=0.8
+                )
+                ax1.add_patch(rect)
+                
+                # Add simple label on original image
+                center_x, center_y = (minx + maxx) / 2, (miny + maxy) / 2
+                ax1.text(center_x, center_y - 15, symbol.category.name,
+                        ha='center', va='center', fontsize=8, fontweight='bold',
+                        bbox=dict(boxstyle="round,pad=0.2", 
+                                facecolor=symbol_colors.get(symbol.category, 'white'), 
+                                alpha=0.8))
             
             # Set proper axis limits for original image to match coordinate system
             ax1.set_xlim(0, image_rgb.shape[1])
@@ -154,8 +333,6 @@ class FloorPlanVisualizer:
         main_ax.set_aspect('equal')
         main_ax.set_title("Room Layout with Symbol Assignments", fontsize=16, fontweight='bold')
         
-        # Track all symbols to avoid duplicates in annotation
-        all_symbols = []
         symbol_annotations = []
         
         # Generate colors for rooms
@@ -180,30 +357,27 @@ class FloorPlanVisualizer:
             )
             main_ax.add_patch(room_patch)
         
-        # Collect all symbols first
-        for room in self.layout.rooms:
-            for symbol in room.symbols:
-                if symbol not in all_symbols:
-                    all_symbols.append(symbol)
-                    
-                    # Find room connections for this symbol
-                    connected_rooms = self.find_symbol_room_connections(symbol)
-                    
-                    # Create shorter annotation text
-                    if len(connected_rooms) > 1:
-                        # Show only first letters of room names if multiple
-                        room_abbrev = ",".join([room for room in connected_rooms])
-                        connection_text = f"{symbol.category.name.replace('_', '')}({room_abbrev})"
-                    elif len(connected_rooms) == 1:
-                        room_name = connected_rooms[0]  # Truncate long room names
-                        connection_text = f"{symbol.category.name.replace('_', '')}({room_name})"
-                    else:
-                        connection_text = f"{symbol.category.name.replace('_', '')}(N/A)"
-                    
-                    symbol_annotations.append((symbol, connection_text))
+        # Collect all symbols first, the symbol table has each of them once
+        for symbol_id, symbol in enumerate(self.layout.symbols):
+            # Find room connections for this symbol
+            connected_rooms = self.find_symbol_room_connections(symbol_id)
+            
+            # Create shorter annotation text
+            if len(connected_rooms) > 1:
+                # Show only first letters of room names if multiple
+                room_abbrev = ",".join([room for room in connected_rooms])
+                connection_text = f"{symbol.category.name.replace('_', '')}({room_abbrev})"
+            elif len(connected_rooms) == 1:
+                room_name = connected_rooms[0]  # Truncate long room names
+                connection_text = f"{symbol.category.name.replace('_', '')}({room_name})"
+            else:
+                connection_text = f"{symbol.category.name.replace('_', '')}(N/A)"
+            
+            symbol_annotations.append((symbol, connection_text))
         
         # Draw symbol rectangles first
         for symbol, annotation_text in symbol_annotations:
+            minx, miny, maxx, maxy = symbol.bounds
             rect = patches.Rectangle(
                 (minx, miny),
                 maxx - minx,
@@ -215,12 +389,29 @@ class FloorPlanVisualizer:
             )
             main_ax.add_patch(rect)
         
+        # Set axis limits with better margins
+        if self.layout.rooms:
+            all_coords = []
+            for room in self.layout.rooms:
+                all_coords.extend(list(room.polygon.exterior.coords))
+            
+            if all_coords:
+                xs, ys = zip(*all_coords)
+                margin = max(100, (max(xs) - min(xs)) * 0.1)  # Dynamic margin
+                main_ax.set_xlim(min(xs) - margin, max(xs) + margin)
+                main_ax.set_ylim(min(ys) - margin, max(ys) + margin)
+        
+        # labels are sized in plan units, from their real extents in points,
+        # so the placer's offsets, grid and margin are in points too, labels a few points apart
+        units_per_point = self._units_per_point(fig, main_ax)
+        self.labels = LabelPlacer(scale=units_per_point, margin=2)
+
         # Add symbol annotations with collision avoidance
         for symbol, annotation_text in symbol_annotations:
             center_x, center_y = self.get_symbol_center(symbol)
             
             # Get text dimensions
-            text_width, text_height = self.get_text_dimensions(annotation_text, 8)
+            text_width, text_height = (d * units_per_point for d in self.get_text_dimensions(annotation_text, 8))
             
             # Find best position for text
             text_x, text_y = self.find_best_text_position(center_x, center_y, text_width, text_height)
@@ -250,7 +441,7 @@ class FloorPlanVisualizer:
             room_name = room.name
             
             # Get text dimensions for room name
-            text_width, text_height = self.get_text_dimensions(room_name, 12)
+            text_width, text_height = (d * units_per_point for d in self.get_text_dimensions(room_name, 12, pad=0.4))
             
             # Find best position for room name
             label_x, label_y = self.find_best_text_position(centroid.x, centroid.y, text_width, text_height)
@@ -269,16 +460,18 @@ class FloorPlanVisualizer:
             )
             
             # Display room dimensions if available
-            dimensions = [meta for meta in room.metadata if isinstance(meta, Dimension)]
+            dimensions = room.dims
             if dimensions:
                 dim = dimensions[0]
                 dim_text = f"{dim.width}' x {dim.height}'"
                 
                 # Get dimensions for dimension text
-                dim_text_width, dim_text_height = self.get_text_dimensions(dim_text, 10)
+                dim_text_width, dim_text_height = (
+                    d * units_per_point for d in self.get_text_dimensions(dim_text, 10, bold=False, pad=0.2)
+                )
                 
                 # Position dimension text below room name
-                dim_x, dim_y = self.find_best_text_position(centroid.x, centroid.y + 25, dim_text_width, dim_text_height)
+                dim_x, dim_y = self.find_best_text_position(centroid.x, centroid.y + 25 * units_per_point, dim_text_width, dim_text_height)
                 
                 main_ax.text(
                     dim_x, dim_y,
@@ -313,18 +506,6 @@ class FloorPlanVisualizer:
             )
             legend.get_title().set_fontweight('bold')
         
-        # Set axis limits with better margins
-        if self.layout.rooms:
-            all_coords = []
-            for room in self.layout.rooms:
-                all_coords.extend(list(room.polygon.exterior.coords))
-            
-            if all_coords:
-                xs, ys = zip(*all_coords)
-                margin = max(100, (max(xs) - min(xs)) * 0.1)  # Dynamic margin
-                main_ax.set_xlim(min(xs) - margin, max(xs) + margin)
-                main_ax.set_ylim(min(ys) - margin, max(ys) + margin)
-        
         # Invert y-axis to match image coordinates
         main_ax.invert_yaxis()
         main_ax.grid(True, alpha=0.2, linestyle=':')
@@ -355,22 +536,23 @@ class FloorPlanVisualizer:
             print("-" * (len(room.name) + 1))
             
             # Print dimensions
-            dimensions = [meta for meta in room.metadata if isinstance(meta, Dimension)]
+            dimensions = room.dims
             if dimensions:
                 for dim in dimensions:
                     print(f"  Dimensions: {dim.width}' x {dim.height}'")
             
             # Print labels
-            labels = [meta for meta in room.metadata if isinstance(meta, Label)]
+            labels = room.labels
             if labels:
                 print(f"  Labels: {', '.join([label.text for label in labels])}")
             
             # Print symbols with connections
-            if room.symbols:
+            if room.symbol_ids:
                 print("  Symbols:")
                 symbol_counts = {}
-                for symbol in room.symbols:
-                    connected_rooms = self.find_symbol_room_connections(symbol)
+                for symbol_id in room.symbol_ids:
+                    symbol = self.layout.symbols[symbol_id]
+                    connected_rooms = self.find_symbol_room_connections(symbol_id)
                     category_name = symbol.category.name
                     
                     if category_name not in symbol_counts:
@@ -393,7 +575,7 @@ class FloorPlanVisualizer:
         
         # Print layout-level metadata
         if self.layout.metadata:
-            print(f"\nLayout Metadata:")
+            print("\nLayout Metadata:")
             for meta in self.layout.metadata:
                 if isinstance(meta, Label):
                     print(f"  Label: {meta.text}")
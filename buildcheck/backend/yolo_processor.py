@@ -1,20 +1,43 @@
-from ultralytics import YOLO
+import os
 from buildcheck.backend.vectorization import *
-import shapely.geometry as geom
+from buildcheck.backend.models import get_yolo, YOLO_MODEL_PATH
+from buildcheck.backend.tracing import span
+from buildcheck.backend.images import as_bgr
+from buildcheck.backend.tiling import tile_grid, batched, should_tile, merge_detections, check_tiling
 from shapely.geometry import Polygon
 import numpy as np
 from PIL import Image
 
 
+# big sheets are run in overlapping tiles at full resolution instead of being
+# squashed down to the model's input size. 'auto', 'on' or 'off'
+YOLO_TILING = os.getenv('YOLO_TILING', 'auto')
+YOLO_TILE_SIZE = int(os.getenv('YOLO_TILE_SIZE', '1024'))  # px
+# should be larger than the largest symbol, so every symbol is whole in some tile
+YOLO_TILE_OVERLAP = int(os.getenv('YOLO_TILE_OVERLAP', '192'))  # px
+# tiles per predict call, bounds the memory used whatever the sheet size
+YOLO_TILE_BATCH = int(os.getenv('YOLO_TILE_BATCH', '4'))
+YOLO_MERGE_IOU = 0.5
 
+check_tiling(YOLO_TILING, YOLO_TILE_SIZE, YOLO_TILE_OVERLAP)
+
+
+def _numpy(values) -> np.ndarray:
+    # torch tensors from ultralytics, or plain arrays from the inference server
+    return values.cpu().numpy() if hasattr(values, 'cpu') else np.asarray(values)
 
-YOLO_MODEL_PATH = "buildcheck/backend/best.pt"
 
 class YOLOProcessor:
     def __init__(self, image_src, model_path: str, layout: Layout):
         self.image_src = image_src
         self.layout = layout
-        self.model = YOLO(model_path)
+        self.model_path = model_path
+
+    @property
+    def model(self):
+        # shared, already warmed model. see `models.py`
+        # only looked up when we actually run inference
+        return get_yolo(self.model_path).model
 
     @staticmethod
     def map_class_to_category(class_name: str) -> Category:
@@ -44,73 +67,125 @@ class YOLOProcessor:
         return symbol
     
     def find_rooms_for_symbol(self, symbol_bbox: Polygon, intersection_threshold: float = 0.05) -> list[Room]:
+        # single box version of `find_rooms_for_symbols`
+        _, room_idx = self.layout.rooms_for_boxes([symbol_bbox], intersection_threshold)
+        return [self.layout.rooms[i] for i in room_idx]
 
-        room_matches = []
-        
-        for room in self.layout.rooms:
-            # Returns True if symbol and room overlap at all
-            intersects = room.polygon.intersects(symbol_bbox)
-            # Check if intersection meets threshold
-            if intersects or room.polygon.contains(symbol_bbox):
-                room_matches.append(room)
+    def find_rooms_for_symbols(self, symbol_bboxes: list[Polygon], intersection_threshold: float = 0.05) -> list[list[Room]]:
+        # Match all detections against the rooms' R-tree at once.
+        # a symbol goes in a room if at least `intersection_threshold` of its area overlaps it
+        room_matches = [[] for _ in symbol_bboxes]
+        if not symbol_bboxes or not self.layout.rooms:
+            return room_matches
+
+        box_idx, room_idx = self.layout.rooms_for_boxes(symbol_bboxes, intersection_threshold)
+        for b, r in zip(box_idx, room_idx):
+            room_matches[b].append(self.layout.rooms[r])
 
-        
         return room_matches
     
-    def yoloProcesser(self, confidence_threshold: float = 0.25, intersection_threshold: float = 0.05):
-        # Run YOLO detection and associate symbols with rooms
-        
-        # Run YOLO inference
-        results = self.model.predict(
-            source=self.image_src,
-            conf=confidence_threshold,
-            save=False,  # Don't save automatically
-            verbose=False
-        )
-        
-        total_detections = 0
-        symbols_assigned = 0
-        
-        # Process each result
+    def predict(self, image, confidence_threshold: float = 0.25) -> tuple[np.ndarray, np.ndarray, dict]:
+        # Run YOLO inference on the whole sheet
+        # -> (n, 4) xyxy boxes, (n,) class ids, class id to name mapping
+        with span('yolo.predict'):
+            results = self.model.predict(
+                source=image,
+                conf=confidence_threshold,
+                save=False,  # Don't save automatically
+                verbose=False
+            )
+
+        boxes, classes, names = [np.empty((0, 4))], [np.empty(0)], {}
         for result in results:
-            # Get detection data
-            if result.boxes is None or len(result.boxes) == 0:
-                print("No objects detected.")
-                continue
-                
-            boxes = result.boxes.xyxy.cpu().numpy()  # [x1, y1, x2, y2]
-            classes = result.boxes.cls.cpu().numpy()  # Class IDs
-            names = result.names  # Class ID to name mapping
-
-            # todo enumerate zip
-            for box, clazz in zip(boxes, classes):
+            names = result.names
+            if result.boxes is not None and len(result.boxes):
+                boxes.append(_numpy(result.boxes.xyxy))
+                classes.append(_numpy(result.boxes.cls))
+        return np.concatenate(boxes), np.concatenate(classes), names
+
+    def predict_tiled(self, image: np.ndarray, confidence_threshold: float = 0.25) -> tuple[np.ndarray, np.ndarray, dict]:
+        # Run YOLO on overlapping tiles of the sheet, a few tiles per call,
+        # and merge the detections back in sheet coordinates
+        height, width = image.shape[:2]
+        tiles = tile_grid(width, height, YOLO_TILE_SIZE, YOLO_TILE_OVERLAP)
+
+        boxes, scores, classes, names = [np.empty((0, 4))], [np.empty(0)], [np.empty(0)], {}
+        with span('yolo.predict_tiled', tiles=len(tiles)) as s:
+            for batch in batched(tiles, YOLO_TILE_BATCH):
+                # views of the shared buffer, only the model's letterboxed inputs are new memory
+                crops = [image[y0:y1, x0:x1] for x0, y0, x1, y1 in batch]
+                results = self.model.predict(
+                    source=crops,
+                    conf=confidence_threshold,
+                    imgsz=YOLO_TILE_SIZE,
+                    save=False,
+                    verbose=False
+                )
+                for (x0, y0, _, _), result in zip(batch, results):
+                    names = result.names
+                    if result.boxes is None or len(result.boxes) == 0:
+                        continue
+                    boxes.append(_numpy(result.boxes.xyxy) + [x0, y0, x0, y0])
+                    scores.append(_numpy(result.boxes.conf))
+                    classes.append(_numpy(result.boxes.cls))
+
+            boxes, scores, classes = np.concatenate(boxes), np.concatenate(scores), np.concatenate(classes)
+            # the overlaps see the same symbol twice, and a symbol cut by a tile edge shows up as a fragment
+            keep = merge_detections(boxes, scores, classes, YOLO_MERGE_IOU, tiles=tiles)
+            s.set(raw_detections=len(boxes), detections=len(keep))
+
+        return boxes[keep], classes[keep], names
+
+    def detect(self, confidence_threshold: float = 0.25, tiled: bool = None) -> list[Symbol]:
+        image = as_bgr(self.image_src)
+        if tiled is None:
+            tiled = should_tile(image, YOLO_TILING, YOLO_TILE_SIZE)
+
+        if tiled:
+            boxes, classes, names = self.predict_tiled(image, confidence_threshold)
+        else:
+            boxes, classes, names = self.predict(image, confidence_threshold)
+
+        if len(boxes) == 0:
+            print("No objects detected.")
+            return []
+
+        symbols = []
+        for box, clazz in zip(boxes, classes):
+            # we need lowercase since the model.names dict keys are case sensitive.
+            category = self.map_class_to_category(names[int(clazz)].lower())
+
+            # Create symbol from detection, the polygon is only built if something needs it
+            symbols.append(Symbol.from_bounds(category, box))
+
+        return symbols
+
+    def assign_symbols(self, symbols: list[Symbol], intersection_threshold: float = 0.05):
+        # Find applicable rooms for every symbol with one bulk spatial query
+        applicable_rooms = self.find_rooms_for_symbols(
+            list(symbol_boxes(symbols)), intersection_threshold
+        )
 
-                bbox = geom.box(*box)
+        total_detections = len(symbols)
+        symbols_assigned = 0
 
-                class_id = int(clazz)
-                class_name = names[class_id]
-                
-                total_detections += 1
-                
-                # Create symbol from detection
-                symbol = self.create_symbol_from_detection(
-                    class_name, bbox
-                )
-                
-              # Find applicable rooms using intersection-based matching
-                applicable_rooms = self.find_rooms_for_symbol(bbox, intersection_threshold)
-                                
-                if applicable_rooms:
-                    symbols_assigned += 1
-                    
-                    for room in applicable_rooms:
-                        room.symbols.append(symbol)
+        for symbol, rooms in zip(symbols, applicable_rooms):
+            if rooms:
+                symbols_assigned += 1
+                # stored once in the layout, the rooms refer to it by id
+                self.layout.add_symbol(symbol, rooms)
         
-        print(f"\nDETECTION SUMMARY:")
+        print("\nDETECTION SUMMARY:")
         print(f"Total detections: {total_detections}")
         print(f"Symbols assigned to rooms: {symbols_assigned}")
         print(f"Unassigned symbols: {total_detections - symbols_assigned}")
 
+    def yoloProcesser(self, confidence_threshold: float = 0.25, intersection_threshold: float = 0.05, tiled: bool = None):
+        # Run YOLO detection and associate symbols with rooms
+        # `tiled` forces tiled inference on or off, by default it follows YOLO_TILING
+        symbols = self.detect(confidence_threshold, tiled)
+        self.assign_symbols(symbols, intersection_threshold)
+
     
     def print_room_summary(self):
         """Print summary of symbols found in each room"""
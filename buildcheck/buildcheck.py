@@ -8,6 +8,8 @@ from buildcheck.views.employee_view import employee_view
 from buildcheck.views.reviewer_assignment import rv_assignment
 from buildcheck.state.user_state import UserState
 import buildcheck.views.employee_upload as em
+from buildcheck.api import api
+from buildcheck.backend.jobs import resume_jobs
 
 class State(UserState):
     is_new_account: bool = False
@@ -158,9 +160,14 @@ app = rx.App(
         has_background=True,
         radius="large",
         # accent_color="grass"
-    )
+    ),
+    # on demand validation overlays, see `api.py`
+    api_transformer=api,
 )
 
+# pick up the validations that were queued or running when the app last went down
+app.register_lifespan_task(resume_jobs)
+
 app.add_page(index, route="/", title="Login", description="Login or create an account")
 app.add_page(em.upload_page, title="Employee Dashboard", description="This page is where the employee can view their case.")
 app.add_page(rv_assignment, title="Blueprint Assignment")
@@ -0,0 +1,260 @@
+"""
+Command line tools, run with `python -m buildcheck <command>`.
+
+    python -m buildcheck validate plans/ --out results.jsonl --overlays overlays/
+    python -m buildcheck validate manifest.txt --out results.parquet --shard 0/3
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from typing import Iterable, Optional
+import numpy as np
+
+
+IMAGE_SUFFIXES = {'.png', '.jpg', '.jpeg'}
+# parquet rows buffered before they are written out as a row group
+PARQUET_ROW_GROUP = 256
+
+# stages reported in the latency summary, in pipeline order
+STAGES = ('r2g', 'detections', 'text', 'layout', 'failures', 'overlay')
+
+
+#
+# MARK - Inputs
+#
+
+def find_plans(source: Path) -> list[Path]:
+    """
+    A directory is searched (recursively) for images, anything else is read
+    as a manifest with one image path per line, relative to the manifest.
+    """
+    if source.is_dir():
+        return sorted(p for p in source.rglob('*') if p.suffix.lower() in IMAGE_SUFFIXES)
+
+    plans = []
+    for line in source.read_text().splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            plans.append(source.parent / line)
+    return plans
+
+
+def shard(plans: list[Path], spec: Optional[str]) -> list[Path]:
+    # "i/n" keeps every n-th plan starting at i, to split an archive over several machines
+    if not spec:
+        return plans
+    index, count = (int(part) for part in spec.split('/'))
+    if not 0 <= index < count:
+        raise ValueError(f"bad shard {spec!r}, expected i/n with 0 <= i < n")
+    return plans[index::count]
+
+
+def plans_root(source: Path) -> Path:
+    # what the plans' paths are relative to, the directory or the manifest's folder
+    return source if source.is_dir() else source.parent
+
+
+def overlay_subdir(plan: Path, root: Path, overlay_dir: Path) -> Path:
+    # mirror the plan's folder under the input root, so plans/a/plan.png and
+    # plans/b/plan.png don't write the same overlay
+    plan, root = plan.resolve(), root.resolve()
+    relative = plan.relative_to(root) if plan.is_relative_to(root) else plan.relative_to(plan.anchor)
+    return overlay_dir / relative.parent
+
+
+#
+# MARK - Workers
+#
+
+def _validate_plan(image_path: str, overlay_dir: Optional[str]) -> dict:
+    # N.B. runs in a pool worker, the models are loaded once per worker by `warm_models`
+    from .backend.validation import validate_image
+    from .backend.blueprints import OVERLAY_FORMAT
+
+    start = time.perf_counter()
+    record = {"path": image_path, "failures": None, "rooms": None, "symbols": None, "error": None}
+    try:
+        output_path = None
+        if overlay_dir is not None:
+            output_path = Path(overlay_dir) / (Path(image_path).stem + f'_output.{OVERLAY_FORMAT}')
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+        run = validate_image(Path(image_path), output_path)
+
+        layout = run.values['layout']
+        record["failures"] = [f.guideline.value for f in run.values['failures']]
+        record["rooms"] = len(layout.rooms)
+        record["symbols"] = len(layout.symbols)
+        timings = run.timings
+    except Exception:
+        record["error"] = traceback.format_exc()
+        timings = {}
+
+    record["seconds"] = time.perf_counter() - start
+    for stage in STAGES:
+        record[f"{stage}_seconds"] = timings.get(stage)
+    return record
+
+
+#
+# MARK - Outputs
+#
+
+class JsonlWriter:
+    def __init__(self, path: Path):
+        self.file = open(path, 'w')
+
+    def write(self, record: dict):
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    def __init__(self, path: Path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = pa.schema(
+            [
+                ('path', pa.string()),
+                ('failures', pa.list_(pa.int32())),
+                ('rooms', pa.int32()),
+                ('symbols', pa.int32()),
+                ('error', pa.string()),
+                ('seconds', pa.float64()),
+            ] + [(f'{stage}_seconds', pa.float64()) for stage in STAGES]
+        )
+        self.writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+        self.rows = []
+
+    def write(self, record: dict):
+        self.rows.append(record)
+        if len(self.rows) >= PARQUET_ROW_GROUP:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.writer.write_table(self.pa.Table.from_pylist(self.rows, schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def open_writer(path: Path):
+    if path.suffix == '.parquet':
+        return ParquetWriter(path)
+    return JsonlWriter(path)
+
+
+#
+# MARK - Validate
+#
+
+def _print_summary(records: list[dict], seconds: float):
+    failed = sum(record["error"] is not None for record in records)
+    print(f'\nvalidated {len(records)} plans in {seconds:.1f}s ({len(records) / seconds * 60:.1f} plans/min), {failed} errors')
+
+    print(f'{"stage":<12}{"p50":>10}{"p90":>10}{"p99":>10}{"max":>10}')
+    for stage in STAGES + ('total',):
+        column = 'seconds' if stage == 'total' else f'{stage}_seconds'
+        values = [record[column] for record in records if record[column] is not None]
+        if not values:
+            continue
+        p50, p90, p99 = np.percentile(values, [50, 90, 99])
+        print(f'{stage:<12}{p50:>10.3f}{p90:>10.3f}{p99:>10.3f}{max(values):>10.3f}')
+
+
+def validate_plans(plans: Iterable[Path], out: Path, workers: int, overlay_dir: Path = None, root: Path = None) -> list[dict]:
+    """
+    Validate `plans` on `workers` processes and write a record per plan to `out`.
+    Overlays go to the plan's folder relative to `root` under `overlay_dir`.
+    """
+    from .backend.models import warm_models
+
+    plans = list(plans)
+    writer = open_writer(out)
+    records = []
+    start = time.perf_counter()
+
+    ctx = multiprocessing.get_context('spawn')
+    remaining = iter(plans)
+    in_flight = set()
+
+    try:
+        with ProcessPoolExecutor(workers, mp_context=ctx, initializer=warm_models) as pool:
+            while True:
+                # a couple of plans queued per worker, without pickling the whole archive up front
+                while len(in_flight) < workers * 2:
+                    plan = next(remaining, None)
+                    if plan is None:
+                        break
+                    overlay = None
+                    if overlay_dir is not None:
+                        overlay = str(overlay_subdir(plan, root or plan.parent, overlay_dir))
+                    in_flight.add(pool.submit(_validate_plan, str(plan), overlay))
+
+                if not in_flight:
+                    break
+
+                completed, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    record = future.result()
+                    writer.write(record)
+                    records.append(record)
+                    status = 'error' if record["error"] else f'{len(record["failures"])} failures'
+                    print(f'[{len(records)}/{len(plans)}] {record["path"]}: {status} ({record["seconds"]:.1f}s)')
+    finally:
+        writer.close()
+
+    _print_summary(records, time.perf_counter() - start)
+    return records
+
+
+def default_workers() -> int:
+    # every worker holds YOLO and EasyOCR in memory, unless they are shared through the inference server
+    from .backend.inference_server import INFERENCE_SOCKET
+
+    if not INFERENCE_SOCKET:
+        return 1
+    return min(4, os.cpu_count() or 1)
+
+
+def cmd_validate(args: argparse.Namespace) -> int:
+    plans = shard(find_plans(args.source), args.shard)
+    if not plans:
+        print(f'no plans found in {args.source}', file=sys.stderr)
+        return 1
+
+    if args.overlays is not None:
+        args.overlays.mkdir(parents=True, exist_ok=True)
+
+    records = validate_plans(plans, args.out, args.workers, args.overlays, plans_root(args.source))
+    return 1 if any(record["error"] for record in records) else 0
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog='buildcheck')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    validate = commands.add_parser('validate', help="validate a directory (or manifest) of blueprints offline")
+    validate.add_argument('source', type=Path, help="directory of images, or a manifest with one image path per line")
+    validate.add_argument('--out', type=Path, default=Path('results.jsonl'), help="results file, .jsonl or .parquet")
+    validate.add_argument('--workers', type=int, default=default_workers(),
+                          help="every worker loads its own models unless INFERENCE_SOCKET is set")
+    validate.add_argument('--overlays', type=Path, help="also render the overlays into this directory")
+    validate.add_argument('--shard', help="only validate shard i of n, e.g. 0/4")
+    validate.set_defaults(func=cmd_validate)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
@@ -4,12 +4,11 @@ from buildcheck.state.user_state import UserState
 from buildcheck.backend.supabase_client import supabase_client
 import traceback
 from buildcheck.components.stat_card import stat_card
-from buildcheck.backend.validation import run_validation
+from buildcheck.backend.jobs import submit_validation, check_job, JobStatus
 import asyncio
 from typing import Optional
-from buildcheck.backend.validation import Failure
-from buildcheck.backend.blueprints import bp_name2vispath
-from pathlib import Path
+from buildcheck.backend.blueprints import bp_name2layoutpath
+from buildcheck.api import overlay_url
 from buildcheck.state.user_state import UserState
 from buildcheck.backend.supabase_client import supabase_client
 import buildcheck.backend.email_utils as em
@@ -22,10 +21,10 @@ class Status(Enum):
     REJECTED = "rejected"
 
 
-class AIDecision(Enum):
-    APPROVED = "approved"
-    REJECTED = "rejected"
-
+# how often the UI checks on a running validation job (seconds)
+JOB_POLL_INTERVAL = 1.0
+# stop waiting for a job after this long, it keeps running and the result still lands in the case
+JOB_POLL_TIMEOUT = 20 * 60
 
 
 class AIValidationState(rx.State):
@@ -37,49 +36,8 @@ class AIValidationState(rx.State):
     comments: list[dict] = []  # Store comments from database
     is_validating: bool = False
     case_result: str = ""  # Default case result status
-    vis_output_trigger: int
-
-
-    async def write_violations(self, failures: list[Failure]):
-        print(f'{failures=}')
-        failure_codes = list(map(lambda f: f.guideline.value, failures))
-
-        # we need to overwrite all previous violations,
-        # to prevent stale violations
-
-        # unfortunately supabase-py does not support atomic transactions
-
-
-        # delete all current violations for this case
-        (supabase_client.table("violations")
-            .delete()
-            .eq("case_id", self.case_id)
-            .execute()
-        )
-
-
-        # insert all the violations for current case
-        if failure_codes:
-            (supabase_client.table("violations")
-                .insert([
-                    {
-                        "case_id": self.case_id,
-                        "guideline_code": code
-                    } for code in failure_codes
-                ])
-                .execute()
-            )
-
-        # update the cases ai_descision
-        ai_decision = AIDecision.REJECTED.value if failures else AIDecision.APPROVED.value
-        (supabase_client.table("cases")
-            .update({"ai_decision": ai_decision})
-            .eq("id", self.case_id)
-            .execute()
-        )
-
-
-        self.violations = failure_codes
+    # rendered on demand by `api.overlay`, empty until the case was validated
+    visualization_url: str = ""
 
 
     def handle_verdict(self, title, message, approved):
@@ -132,6 +90,19 @@ class AIValidationState(rx.State):
         violations_query = supabase_client.table("violations").select("guideline_code").eq("case_id", self.case_id).execute()
 
         self.violations = [row["guideline_code"] for row in violations_query.data]
+        self.refresh_overlay(case)
+
+    def refresh_overlay(self, case: dict):
+        layout_path = bp_name2layoutpath(case['blueprint_path'], case['submitter_id'])
+        if not layout_path.exists():
+            self.visualization_url = ""
+            return
+        self.visualization_url = overlay_url(
+            rx.config.get_config().api_url,
+            case['blueprint_path'],
+            case['submitter_id'],
+            layout_path.stat().st_mtime_ns,
+        )
 
 
     @rx.event
@@ -188,33 +159,58 @@ class AIValidationState(rx.State):
             traceback.print_exc()
     
 
-    @rx.event
+    @rx.event(background=True)
     async def on_validate(self):
-        # Initialize validation state
-        self.is_validating = True
-        yield None
+        # N.B. this is a background task so that a long validation
+        #      does not block the event loop for every other user.
+        #      the pipeline itself runs in a worker process, see `backend.jobs`
+        async with self:
+            # Initialize validation state
+            self.is_validating = True
+            case_id = self.case_id
+            case_data = self.current_case_data
 
-        # run validation
-        print(self.current_case_data)
+        print(case_data)
 
         try:
-            failures = run_validation(
-                self.current_case_data['blueprint_path'],
-                self.current_case_data['submitter_id']
-            )
-        except FileNotFoundError as e:
-            self.is_validating = False
-            yield rx.toast.error('Blueprint file not available')
-            return
-        
-        await self.write_violations(failures)
-
-
-        # Update progress to 100% and finish
-        self.is_validating = False
-        self.vis_output_trigger += 1  # hack to trigger the visualize_path to show the image
-        
-        yield rx.toast.info("AI Validation ran successfully")
+            try:
+                # hashes the blueprint, keep it off the event loop
+                job_id = await asyncio.to_thread(
+                    submit_validation,
+                    case_data['blueprint_path'],
+                    case_data['submitter_id'],
+                    case_id
+                )
+            except FileNotFoundError as e:
+                yield rx.toast.error('Blueprint file not available')
+                return
+
+            # poll the job store until the worker is done, sqlite reads block so they run in a thread.
+            # `check_job` also notices a worker that died and requeues (or fails) its job
+            deadline = asyncio.get_running_loop().time() + JOB_POLL_TIMEOUT
+            job = await asyncio.to_thread(check_job, job_id)
+            while not job.finished:
+                if asyncio.get_running_loop().time() > deadline:
+                    yield rx.toast.warning("AI Validation is taking long, check back on this case later")
+                    return
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+                job = await asyncio.to_thread(check_job, job_id)
+
+            async with self:
+                if job.status == JobStatus.DONE and self.case_id == case_id:
+                    self.violations = job.result
+                    self.refresh_overlay(case_data)
+
+            if job.status == JobStatus.FAILED:
+                yield rx.toast.error(f"AI Validation failed: {job.error}")
+            else:
+                yield rx.toast.info("AI Validation ran successfully")
+        except Exception as e:
+            traceback.print_exc()
+            yield rx.toast.error(f"AI Validation failed: {e}")
+        finally:
+            async with self:
+                self.is_validating = False
 
     @rx.event
     def on_violation_delete(self, guideline_id: int):
@@ -297,26 +293,6 @@ class AIValidationState(rx.State):
             return ""
 
 
-    @rx.var
-    def visualization_path(self) -> Optional[str]:
-        # create dep on the trigger so that we can recompute
-        # this var when we run ai validation
-        _ = self.vis_output_trigger
-        # N.B! This approach exposes blueprints publicly via assets.
-        if not self.current_case_data:
-            return None
-
-        bp_name = self.current_case_data['blueprint_path']
-        bp_submitter = self.current_case_data['submitter_id']
-        vis_output = bp_name2vispath(bp_name, bp_submitter)
-
-        if vis_output.exists():
-            vis_output = Path(*vis_output.parts[1:])
-            print(f"{vis_output=}")
-            return str(vis_output)
-        else:
-            return None
-        
 def get_status(id) -> str:
     return rx.cond(
         AIValidationState.violations.contains(id),
@@ -437,9 +413,9 @@ def compliance_card() -> rx.Component:
                 # Visualization image
                 rx.box(
                     rx.cond(
-                        AIValidationState.visualization_path,
+                        AIValidationState.visualization_url,
                         rx.image(
-                            src=rx.get_upload_url(AIValidationState.visualization_path),
+                            src=AIValidationState.visualization_url,
                             width="100%",
                             height="auto",
                             object_fit="contain"